@@ -0,0 +1,80 @@
+"""
+Measure how fast updater applies an initial sync payload to the local
+sms.db, compared with the previous row-at-a-time code.
+
+Usage:
+    python benchmarks/benchApplyUpdates.py [messages]
+
+The payload is exported from a synthetic chat.db with getMessages.py; the
+default of 23,000 messages produces a little over 50,000 rows.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(here, '..', 'localCode'))
+sys.path.insert(0, os.path.join(here, '..', 'remoteCode', 'node-server'))
+import syntheticdb  # noqa: E402
+import getMessages  # noqa: E402
+import updater  # noqa: E402
+
+# The local mirror has the same update date triggers INSTALL adds to chat.db
+TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS insert_last_update_date AFTER INSERT ON message BEGIN INSERT INTO message_update_date_join (message_id, message_update_date) VALUES ( NEW.ROWID, strftime('%s','now') ); END;
+CREATE TRIGGER IF NOT EXISTS update_last_update_date AFTER UPDATE ON message BEGIN UPDATE message_update_date_join SET message_update_date = strftime('%s','now') WHERE message_id = OLD.ROWID; END;
+"""
+
+
+def legacyApply(path, output):
+    """The apply loop of retrieveUpdates before rows were batched."""
+    conn = sqlite3.connect(path)
+    for table in output:
+        for row in output[table]:
+            if row.keys():
+                columns = ', '.join(row.keys())
+                placeholders = ', '.join('?' * len(row))
+                sql = ('INSERT OR REPLACE INTO {} ({}) VALUES ({})'
+                       .format(table, columns, placeholders))
+                conn.execute(sql, tuple(row.values()))
+    conn.commit()
+    conn.close()
+
+
+def batchedApply(path, output):
+    conn = updater.openDatabase(path)
+    updater.applyUpdates(conn, output)
+    conn.close()
+
+
+def createLocalDb(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(syntheticdb.SCHEMA + TRIGGERS)
+    conn.close()
+
+
+def run(messages):
+    with tempfile.TemporaryDirectory() as tmp:
+        chatDb = syntheticdb.createDatabase(os.path.join(tmp, 'chat.db'),
+                                            messages=messages)
+        chatDb.row_factory = sqlite3.Row
+        output = getMessages.getUpdates(chatDb, 0)
+        rows = sum(len(output[table]) for table in output)
+        print('{} rows in payload'.format(rows))
+
+        for label, apply in (('legacy', legacyApply),
+                             ('batched', batchedApply)):
+            path = os.path.join(tmp, label + '.db')
+            createLocalDb(path)
+            start = time.perf_counter()
+            apply(path, output)
+            elapsed = time.perf_counter() - start
+            print('{:<8} {:>8.3f} s {:>10.0f} rows/s'.format(
+                label, elapsed, rows / elapsed))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 23000)
@@ -0,0 +1,122 @@
+"""
+Report the bytes fetched and stored by the content-addressed attachment store
+on a synthetic dataset where some attachments repeat earlier ones, like an
+image forwarded to several chats.
+
+Usage:
+    python benchmarks/benchBlobStore.py [messages] [duplicateFraction]
+
+Attachments are served by the local stand-in HTTPS server used by the tests
+and downloaded with AttachmentDownloader. Messages stores every copy of a
+forwarded attachment in its own folder, so the comparison is against one
+file per attachment. Requires openssl.
+"""
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+root = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'localCode'))
+import syntheticdb  # noqa: E402
+from tests import standinserver  # noqa: E402
+from messageApi import blobstore, downloader, session  # noqa: E402
+
+
+# Random.randbytes is new in 3.9, and getrandbits(0) only works from 3.9.
+def randomBytes(rand, size):
+    if size <= 0:
+        return b''
+    return rand.getrandbits(8 * size).to_bytes(size, 'little')
+
+
+def loadBodies(chatDb):
+    """Make up content for every attachment; attachments that share a
+    filename share content."""
+    rand = random.Random(0)
+    contents = {}
+    bodies = {}
+    rows = chatDb.execute('SELECT ROWID, filename, total_bytes '
+                          'FROM attachment')
+    for rowid, filename, size in rows:
+        if filename not in contents:
+            contents[filename] = randomBytes(rand, size)
+        bodies[rowid] = contents[filename]
+    return bodies
+
+
+def serve(server, bodies):
+    digests = {rowid: json.dumps({'size': len(body),
+                                  'sha256': hashlib.sha256(body).hexdigest()})
+               for rowid, body in bodies.items()}
+
+    def attachment(request):
+        parts = request.path.split('/')
+        rowid = int(parts[3])
+        if len(parts) == 5:
+            request.sendBody(digests[rowid])
+        else:
+            request.sendRange(bodies[rowid])
+
+    server.route('GET', '/sent/attachment/', attachment)
+
+
+def run(messages, duplicates):
+    with tempfile.TemporaryDirectory() as tmp, \
+            standinserver.StandInServer() as server:
+        chatDb = syntheticdb.createDatabase(
+            os.path.join(tmp, 'chat.db'), messages=messages,
+            duplicateAttachments=duplicates)
+        bodies = loadBodies(chatDb)
+        chatDb.close()
+        serve(server, bodies)
+        certs = server.certs
+        session._session = session.HttpSession(
+            'localhost', certs['server'], certs['client'], certs['clientKey'],
+            port=server.port)
+
+        conn = sqlite3.connect(os.path.join(tmp, 'sms.db'))
+        conn.execute('CREATE TABLE attachment (ROWID INTEGER PRIMARY KEY, '
+                     'guid TEXT, filename TEXT)')
+        conn.executemany('INSERT INTO attachment VALUES (?, ?, ?)',
+                         [(rowid, str(rowid), '') for rowid in bodies])
+        downloader.createTable(conn)
+        blobstore.createTables(conn)
+        store = blobstore.BlobStore(os.path.join(tmp, 'blobs'))
+        attachmentDownloader = downloader.AttachmentDownloader(store)
+
+        start = time.perf_counter()
+        attachmentDownloader.enqueue(conn, [(rowid, str(rowid))
+                                            for rowid in bodies])
+        while attachmentDownloader.queueDepth():
+            time.sleep(0.01)
+        attachmentDownloader.poll(conn)
+        elapsed = time.perf_counter() - start
+        attachmentDownloader.shutdown()
+
+        naive = sum(len(body) for body in bodies.values())
+        fetched = attachmentDownloader.stats()['bytes']
+        stats = store.stats(conn)
+        print('{} attachments, {:.0%} repeats, {:.1f} s'.format(
+            len(bodies), duplicates, elapsed))
+        print('one file per attachment: {:>12,} bytes fetched and stored'
+              .format(naive))
+        print('blob store:              {:>12,} bytes fetched, {:,} stored '
+              'in {} blobs'.format(fetched, stats['storedBytes'],
+                                   stats['blobs']))
+        print('saved:                   {:>12,} bytes ({:.0%})'.format(
+            stats['savedBytes'], stats['savedBytes'] / naive))
+        conn.close()
+        session._session.close()
+
+
+if __name__ == '__main__':
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    duplicates = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    run(messages, duplicates)
@@ -0,0 +1,98 @@
+"""
+Measure the time from switching to a long chat to it being ready to show:
+reading its whole history, as MessageFrame used to on first open, against
+reading only its newest page. When there is a display, the time until the
+MessageFrame has painted the chat is measured too.
+
+Usage:
+    python benchmarks/benchChatSwitch.py [messages] [switches]
+
+Each switch opens a new Chat, as the first open of a chat does.
+"""
+import os
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(here, '..', 'localCode'))
+import benchStartup  # noqa: E402
+import messageframe  # noqa: E402
+from messageApi import api  # noqa: E402
+from messageApi import connections  # noqa: E402
+
+
+class FullHistoryDatabase(api.MessageDatabase):
+    """Reads a chat's whole history on first open, as it used to."""
+
+    def getLatestMessages(self, chatId, count):
+        return self.getMessagesForChat(chatId)
+
+
+def load(database):
+    db = database()
+    chat = api.Chat(ROWID=1)
+    messageList, lastAccessTime = db.getLatestMessages(
+        chat.chatId, messageframe.FIRST_PAGE_SIZE)
+    chat.addOlderMessages(messageList, lastAccessTime)
+    return chat
+
+
+def createFrame():
+    import tkinter as tk
+    from tkinter import ttk
+    root = tk.Tk()
+    style = ttk.Style()
+    borderImage = tk.PhotoImage('borderImage', file=os.path.join(
+        here, '..', 'localCode', 'messageBox.png'))
+    style.element_create('RoundedFrame', 'image', borderImage,
+                         ('focus', borderImage), border=16, sticky='nsew')
+    style.layout('RoundedFrame', [('RoundedFrame', {'sticky': 'nsew'})])
+    frames = {}
+    for label, database in (('whole', FullHistoryDatabase),
+                            ('newest', api.MessageDatabase)):
+        frames[label] = messageframe.MessageFrame(root, 0, 360, None, database)
+    return root, frames
+
+
+def run(messages, switches):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sms.db')
+        benchStartup.createMirror(path, 1, messages)
+        api._useTestDatabase(path)
+        display = bool(os.environ.get('DISPLAY'))
+        if display:
+            root, frames = createFrame()
+        print('1 chat, {} messages, {} switches'.format(messages, switches))
+        for label, database in (('whole', FullHistoryDatabase),
+                                ('newest', api.MessageDatabase)):
+            loaded = 0
+            painted = 0
+            for _ in range(switches):
+                begin = time.perf_counter()
+                chat = load(database)
+                loaded += time.perf_counter() - begin
+                if display:
+                    frame = frames[label]
+                    frame.grid(row=0, column=0, sticky='nsew')
+                    begin = time.perf_counter()
+                    # changeChat reads the chat itself on first open.
+                    frame.changeChat(api.Chat(ROWID=1))
+                    root.update()
+                    painted += time.perf_counter() - begin
+                    frame.grid_forget()
+            print('{:<7} {:>6} messages loaded {:>9.1f} ms   painted '
+                  '{}'.format(label, len(chat.getMessages()),
+                              loaded / switches * 1000,
+                              '{:.1f} ms'.format(painted / switches * 1000)
+                              if display else 'skipped, no display'))
+        if display:
+            root.destroy()
+        connections.getManager().close()
+
+
+if __name__ == '__main__':
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    switches = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    run(messages, switches)
@@ -0,0 +1,94 @@
+"""
+Compare answering /update polls by spawning getMessages.py for every request
+against asking a long-running exportDaemon.py.
+
+Usage:
+    python benchmarks/benchExportDaemon.py [messages] [requests]
+
+Each request asks for the changes in the last 100 messages of a synthetic
+chat.db, like a steady-state poll. Requires python-dotenv, as on the remote
+machine.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+import syntheticdb  # noqa: E402
+
+serverDir = os.path.join(os.path.dirname(__file__), '..', 'remoteCode',
+                         'node-server')
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def report(label, latencies, elapsed):
+    print('{:<11} {:>9.1f} req/s   p50 {:>7.2f} ms   p99 {:>7.2f} ms'.format(
+        label, len(latencies) / elapsed,
+        statistics.median(latencies) * 1000,
+        percentile(latencies, 0.99) * 1000))
+
+
+def benchSubprocess(env, lastTime, requests):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        t = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, 'getMessages.py', str(lastTime)], cwd=serverDir,
+            env=env, check=True, stdout=subprocess.PIPE).stdout
+        json.loads(out)
+        latencies.append(time.perf_counter() - t)
+    report('subprocess', latencies, time.perf_counter() - start)
+
+
+def benchDaemon(env, lastTime, requests):
+    daemon = subprocess.Popen([sys.executable, 'exportDaemon.py'],
+                              cwd=serverDir, env=env, stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE, universal_newlines=True)
+    request = json.dumps({'last_update_time': lastTime}) + '\n'
+    # The first request pays for interpreter start up, like the first poll.
+    daemon.stdin.write(request)
+    daemon.stdin.flush()
+    daemon.stdout.readline()
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        t = time.perf_counter()
+        daemon.stdin.write(request)
+        daemon.stdin.flush()
+        json.loads(daemon.stdout.readline())
+        latencies.append(time.perf_counter() - t)
+    report('daemon', latencies, time.perf_counter() - start)
+    daemon.stdin.close()
+    daemon.wait()
+
+
+def run(messages, requests):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'chat.db')
+        conn = syntheticdb.createDatabase(path, messages=messages)
+        lastTime = conn.execute(
+            'SELECT message_update_date FROM message_update_date_join '
+            'ORDER BY message_update_date DESC LIMIT 1 OFFSET 100'
+        ).fetchone()[0]
+        conn.close()
+        env = dict(os.environ, CHAT_PATH=path)
+        print('{} messages in chat.db, {} requests each'.format(messages,
+                                                                requests))
+        benchSubprocess(env, lastTime, requests)
+        benchDaemon(env, lastTime, requests)
+
+
+if __name__ == '__main__':
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    run(messages, requests)
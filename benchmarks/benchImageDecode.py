@@ -0,0 +1,135 @@
+"""
+Measure how long opening a chat full of photos holds up the Tk event loop,
+decoding the photos on the Tk thread against decoding them on the
+ThumbnailCache's workers behind correctly sized placeholders.
+
+Usage:
+    python benchmarks/benchImageDecode.py [photos] [width] [height]
+
+photos is the number of image bubbles opening the chat shows. Thumbnails
+are cold each time. With a display, a callback scheduled every millisecond
+records the longest gap between two runs of it, from opening the chat until
+every image is shown. Without one, the PIL work left on the Tk thread is
+timed instead: decoding every photo, against reading every photo's header.
+"""
+import os
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(here, '..', 'localCode'))
+import benchThumbnails  # noqa: E402
+import scheduler  # noqa: E402
+import thumbnails  # noqa: E402
+from messageApi import api  # noqa: E402
+
+BOX = thumbnails.bucketBox(3 * 600 // 4, 4 * 480 // 5)
+
+
+def createChat(attachments):
+    chat = api.Chat(ROWID=1)
+    for i, attachment in enumerate(attachments):
+        message = api.Message(ROWID=i + 1, guid=str(i), text='￼',
+                              date=i)
+        message.addAttachment(attachment, 0)
+        chat.addMessage(message)
+    return chat
+
+
+def openChat(root, chat, workers):
+    import messageframe
+    eventScheduler = scheduler.Scheduler()
+    eventScheduler.start(root)
+    if workers:
+        thumbnails.getCache().start(eventScheduler)
+    frame = messageframe.MessageFrame(root, 0, 600, None, api.MessageDatabase)
+    frame.grid(row=0, column=0, sticky='nsew')
+    root.update()
+
+    ticks = []
+
+    def tick():
+        ticks.append(time.perf_counter())
+        root.after(1, tick)
+    tick()
+    root.update()
+
+    def shown():
+        return all(bubble.body.image is not None
+                   for parts in frame.messageBubbles.values()
+                   for bubble in parts)
+
+    def show():
+        frame.currentChat = chat
+        prevMessage = None
+        for i, message in enumerate(chat.getMessages().values()):
+            frame.addMessage(chat, i, message, prevMessage, -1)
+            prevMessage = message
+    begin = time.perf_counter()
+    root.after_idle(show)
+    root.update()
+    while not shown():
+        root.update()
+    done = time.perf_counter() - begin
+    root.update()
+    stall = max(b - a for a, b in zip(ticks, ticks[1:]))
+    thumbnails.getCache().shutdown()
+    frame.destroy()
+    return stall, done
+
+
+def runDisplay(attachments, tmp):
+    import tkinter as tk
+    from tkinter import ttk
+    root = tk.Tk()
+    root.geometry('600x480')
+    root.columnconfigure(0, weight=1)
+    root.rowconfigure(0, weight=1)
+    style = ttk.Style()
+    borderImage = tk.PhotoImage('borderImage', file=os.path.join(
+        here, '..', 'localCode', 'messageBox.png'))
+    style.element_create('RoundedFrame', 'image', borderImage,
+                         ('focus', borderImage), border=16, sticky='nsew')
+    style.layout('RoundedFrame', [('RoundedFrame', {'sticky': 'nsew'})])
+    for label, workers in (('Tk thread', False), ('workers', True)):
+        thumbnails._cache = thumbnails.ThumbnailCache(
+            os.path.join(tmp, label))
+        # Destroying the frame unloads the chat's messages.
+        stall, done = openChat(root, createChat(attachments), workers)
+        print('{:<10} max stall {:>8.1f} ms   all shown {:>8.1f} ms'.format(
+            label, stall * 1000, done * 1000))
+    root.destroy()
+
+
+def runProxy(attachments, tmp):
+    cache = thumbnails.ThumbnailCache(os.path.join(tmp, 'thumbnails'))
+    begin = time.perf_counter()
+    for attachment in attachments:
+        cache.fittedSize(attachment, BOX)
+    headers = time.perf_counter() - begin
+    begin = time.perf_counter()
+    for attachment in attachments:
+        cache.thumbnail(attachment, BOX)
+    decodes = time.perf_counter() - begin
+    print('no display, PIL work on the Tk thread only')
+    for label, elapsed in (('Tk thread', decodes), ('workers', headers)):
+        print('{:<10} max stall {:>8.1f} ms'.format(label, elapsed * 1000))
+
+
+def run(count, size):
+    with tempfile.TemporaryDirectory() as tmp:
+        attachments = benchThumbnails.createPhotos(tmp, count, size)
+        print('{} photos, {}x{}'.format(count, *size))
+        if os.environ.get('DISPLAY'):
+            runDisplay(attachments, tmp)
+        else:
+            runProxy(attachments, tmp)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 15
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 4032
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else 3024
+    run(count, (width, height))
@@ -0,0 +1,147 @@
+"""
+Measure the peak memory of an initial sync on both ends, sent as one /update
+document, as pages of changes or as a stream of ndjson records, and how long
+the first row takes to arrive.
+
+Usage:
+    python benchmarks/benchInitialSync.py [messages] [page size]
+
+The server side exports a synthetic chat.db with getMessages.py and
+serializes it the way exportDaemon.py does. The client side parses the
+result and applies it to a local sms.db the way updater does. Each side
+runs in its own process so its peak RSS can be read back.
+"""
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(here, '..', 'localCode'))
+sys.path.insert(0, os.path.join(here, '..', 'remoteCode', 'node-server'))
+import syntheticdb  # noqa: E402
+
+
+def peakRss():
+    # ru_maxrss survives exec on Linux, so it would include the parent's
+    # peak from building chat.db. VmHWM starts again with the new program.
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        pass
+    # In kilobytes on Linux and bytes on macOS.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def serve(tmp, fmt, pageSize):
+    import getMessages
+    conn = getMessages.connect(os.path.join(tmp, 'chat.db'))
+    start = time.perf_counter()
+    firstRow = None
+    cursor = 0
+    with open(payloadPath(tmp, fmt, pageSize), 'w') as outfile:
+        more = True
+        while more:
+            if fmt == 'json':
+                lines = [getMessages.getUpdates(conn, 0, sinceSeq=cursor,
+                                                pageSize=pageSize)]
+            else:
+                lines = getMessages.streamUpdates(conn, 0, sinceSeq=cursor,
+                                                  pageSize=pageSize)
+            for output in lines:
+                outfile.write(json.dumps(output) + '\n')
+                if firstRow is None:
+                    firstRow = time.perf_counter() - start
+                if 'cursor' in output:
+                    cursor = output['cursor']
+                    more = output['more']
+    return firstRow
+
+
+class NoDownloads:
+    """Attachments are downloaded separately and aren't measured."""
+
+    def __init__(self, tmp):
+        import updater
+        self.store = updater.blobstore.BlobStore(tmp)
+
+    def enqueue(self, conn, downloads):
+        pass
+
+
+def receive(tmp, fmt, pageSize):
+    import updater
+    conn = updater.openDatabase(
+        os.path.join(tmp, 'sms-{}-{}.db'.format(fmt, pageSize)))
+    conn.executescript(syntheticdb.SCHEMA)
+    start = time.perf_counter()
+    firstRow = None
+    with open(payloadPath(tmp, fmt, pageSize)) as infile:
+        records = (json.loads(line) for line in infile)
+        for output in records:
+            if firstRow is None:
+                firstRow = time.perf_counter() - start
+            if fmt == 'json':
+                output.pop('cursor')
+                output.pop('more')
+                updater.handleUpdate(conn, NoDownloads(tmp), output)
+            else:
+                updater.handleUpdateStream(
+                    conn, NoDownloads(tmp), itertools.chain([output], records))
+    conn.close()
+    return firstRow
+
+
+def payloadPath(tmp, fmt, pageSize):
+    return os.path.join(tmp, 'payload-{}-{}'.format(fmt, pageSize))
+
+
+def measure(role, tmp, fmt, pageSize):
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, __file__, '--child', role, tmp, fmt, str(pageSize)],
+        check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    rss, firstRow = out.split()
+    return int(rss), float(firstRow), time.perf_counter() - start
+
+
+def run(messages, pageSize):
+    with tempfile.TemporaryDirectory() as tmp:
+        chatDb = syntheticdb.createDatabase(os.path.join(tmp, 'chat.db'),
+                                            messages=messages)
+        import getMessages
+        getMessages.installChangeLog(chatDb)
+        chatDb.close()
+        print('{} messages in chat.db'.format(messages))
+        for label, fmt, size in (
+                ('one document', 'json', 0),
+                ('pages of {}'.format(pageSize), 'json', pageSize),
+                ('ndjson stream', 'ndjson', 0),
+                ('ndjson pages', 'ndjson', pageSize)):
+            for role in ('server', 'client'):
+                rss, firstRow, elapsed = measure(role, tmp, fmt, size)
+                print('{:<14} {:<6} peak RSS {:>7.1f} MB   first row '
+                      '{:>8.3f} s   total {:>6.2f} s'.format(
+                          label, role, rss / 2 ** 20, firstRow, elapsed))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        role, tmp, fmt = sys.argv[2:5]
+        pageSize = int(sys.argv[5]) or None
+        side = serve if role == 'server' else receive
+        firstRow = side(tmp, fmt, pageSize)
+        print(peakRss(), firstRow)
+    else:
+        messages = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+        pageSize = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+        run(messages, pageSize)
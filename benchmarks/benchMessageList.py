@@ -0,0 +1,84 @@
+"""
+Compare MessageList insertion against the previous pop-and-reinsert
+implementation.
+
+Usage:
+    python benchmarks/benchMessageList.py [count] [legacyCount]
+
+The previous implementation is O(n^2) for a reverse-ordered load, so it is run
+on legacyCount messages (10,000 by default) unless told otherwise.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from localCode.messageApi import api  # noqa: E402
+
+
+class LegacyMessageList:
+    """The MessageList insertion logic prior to the sorted index."""
+
+    def __init__(self):
+        self.messages = {}
+
+    def append(self, message):
+        if message.rowid in self.messages:
+            self.messages[message.rowid].update(message)
+        else:
+            keys = list(self.messages)
+            if keys:
+                self._insert(message, self.messages, keys)
+            else:
+                self.messages[message.rowid] = message
+
+    def _insert(self, message, messageList, keys):
+        i = 0
+        for i in range(len(keys) - 1, -2, -1):
+            if i == -1:
+                break
+            if message.isNewer(messageList[keys[i]]):
+                break
+        poppedMessages = [messageList.pop(k) for k in keys[i + 1:]]
+        messageList[message.rowid] = message
+        for p in poppedMessages:
+            messageList[p.rowid] = p
+
+
+def makeMessages(count):
+    return [api.Message(ROWID=i, date=i // 3) for i in range(1, count + 1)]
+
+
+def timeLoad(listClass, messages):
+    msgList = listClass()
+    start = time.perf_counter()
+    for message in messages:
+        msgList.append(message)
+    elapsed = time.perf_counter() - start
+    ordered = list(msgList.messages)
+    assert ordered == sorted(ordered), 'messages are out of order'
+    return elapsed
+
+
+def run(count, legacyCount):
+    orders = {
+        'random': lambda m: random.Random(0).sample(m, len(m)),
+        'reverse': lambda m: list(reversed(m)),
+        'forward': lambda m: m,
+    }
+    print('{:<8} {:<8} {:>9} {:>11} {:>13}'.format(
+        'order', 'list', 'messages', 'seconds', 'inserts/sec'))
+    for name, order in orders.items():
+        for label, listClass, n in (('sorted', api.MessageList, count),
+                                    ('legacy', LegacyMessageList,
+                                     legacyCount)):
+            elapsed = timeLoad(listClass, order(makeMessages(n)))
+            print('{:<8} {:<8} {:>9} {:>11.3f} {:>13.0f}'.format(
+                name, label, n, elapsed, n / elapsed))
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    legacyCount = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    run(count, legacyCount)
@@ -0,0 +1,59 @@
+"""
+Measure the cost of loading a page of older messages at increasing depths
+into a long chat.
+
+Usage:
+    python benchmarks/benchOlderPages.py [messages]
+
+Each page is read with MessageDatabase.getMessagesBefore, keyed on the
+(date, ROWID) of the oldest message shown, and gets widgets for its
+messages only. Before, MessageFrame destroyed every bubble and rebuilt the
+first messageLimit message parts, growing by 20 a page, so the bubbles
+built for page k are listed alongside for comparison.
+"""
+import os
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(here, '..', 'localCode'))
+import benchStartup  # noqa: E402
+from messageApi import api  # noqa: E402
+from messageApi import connections  # noqa: E402
+
+PAGE_SIZE = 20
+FIRST_LIMIT = 15
+REPEATS = 20
+
+
+def run(messages):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sms.db')
+        benchStartup.createMirror(path, 1, messages)
+        api._useTestDatabase(path)
+        db = api.MessageDatabase()
+        keys = [tuple(row) for row in db.conn.execute(
+            'SELECT message_date, message_id FROM chat_message_date '
+            'WHERE chat_id = 1 ORDER BY message_date, message_id')]
+        print('1 chat, {} messages, {} per page'.format(len(keys),
+                                                        PAGE_SIZE))
+        print('{:>7} {:>13} {:>14} {:>14}'.format(
+            'page', 'read ms', 'bubbles now', 'bubbles before'))
+        pages = (len(keys) - FIRST_LIMIT) // PAGE_SIZE
+        for page in sorted({1, 10, 100, 1000, pages} & set(
+                range(1, pages + 1))):
+            before = keys[-(FIRST_LIMIT + (page - 1) * PAGE_SIZE)]
+            start = time.perf_counter()
+            for _ in range(REPEATS):
+                older = db.getMessagesBefore(1, before, PAGE_SIZE)
+            elapsed = (time.perf_counter() - start) / REPEATS
+            print('{:>7} {:>13.3f} {:>14} {:>14}'.format(
+                page, elapsed * 1000, len(older),
+                FIRST_LIMIT + page * PAGE_SIZE))
+        connections.getManager().close()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
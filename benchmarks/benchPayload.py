@@ -0,0 +1,112 @@
+"""
+Compare the bytes on the wire and the CPU time of each update payload
+format: one JSON document or ndjson records, with messages as objects or
+columns, sent as is, gzipped or zstd compressed.
+
+Usage:
+    python benchmarks/benchPayload.py [messages] [poll messages]
+
+Two payloads are measured: the first page of an initial sync of a synthetic
+chat.db, and a steady-state poll of the most recently changed messages.
+Encoding covers serializing and compressing; decoding covers decompressing
+and parsing. gzip runs at zlib's default level, as index.js uses it. zstd
+needs the zstandard package and is skipped without it.
+"""
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(here, '..', 'remoteCode', 'node-server'))
+import syntheticdb  # noqa: E402
+import getMessages  # noqa: E402
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+REPEATS = 5
+
+
+def jsonBody(conn, sinceSeq, pageSize, columnar):
+    output = getMessages.getUpdates(conn, 0, sinceSeq=sinceSeq,
+                                    pageSize=pageSize, columnar=columnar)
+    return lambda: json.dumps(output).encode()
+
+
+def ndjsonBody(conn, sinceSeq, pageSize, columnar):
+    records = list(getMessages.streamUpdates(conn, 0, sinceSeq=sinceSeq,
+                                             pageSize=pageSize,
+                                             columnar=columnar))
+    return lambda: ''.join(json.dumps(record) + '\n'
+                           for record in records).encode()
+
+
+def parseJson(body):
+    json.loads(body)
+
+
+def parseNdjson(body):
+    for line in body.splitlines():
+        json.loads(line)
+
+
+def encodings():
+    yield 'identity', lambda body: body, lambda body: body
+    # zlib's default level is 6.
+    yield 'gzip', lambda body: gzip.compress(body, 6), gzip.decompress
+    if zstandard is not None:
+        compressor = zstandard.ZstdCompressor()
+        decompressor = zstandard.ZstdDecompressor()
+        yield 'zstd', compressor.compress, decompressor.decompress
+
+
+def timed(function, *args):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def report(conn, label, sinceSeq, pageSize):
+    print('{} ({} changes)'.format(label, pageSize))
+    print('{:<16} {:<9} {:>10} {:>11} {:>11}'.format(
+        'format', 'encoding', 'bytes', 'encode ms', 'decode ms'))
+    for name, makeBody, parse in (('json', jsonBody, parseJson),
+                                  ('ndjson', ndjsonBody, parseNdjson)):
+        for columnar in (False, True):
+            serialize = makeBody(conn, sinceSeq, pageSize, columnar)
+            for encoding, compress, decompress in encodings():
+                wire, encodeTime = timed(lambda: compress(serialize()))
+                _, decodeTime = timed(lambda: parse(decompress(wire)))
+                print('{:<16} {:<9} {:>10} {:>11.2f} {:>11.2f}'.format(
+                    name + (' columnar' if columnar else ''), encoding,
+                    len(wire), encodeTime * 1000, decodeTime * 1000))
+    print()
+
+
+def run(messages, pollMessages):
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = syntheticdb.createDatabase(os.path.join(tmp, 'chat.db'),
+                                          messages=messages)
+        getMessages.installChangeLog(conn)
+        conn.close()
+        conn = getMessages.connect(os.path.join(tmp, 'chat.db'))
+        report(conn, 'Initial sync page', 0, 5000)
+        report(conn, 'Poll', messages - pollMessages, pollMessages)
+        if zstandard is None:
+            print('zstandard is not installed, so zstd was skipped.')
+
+
+if __name__ == '__main__':
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    pollMessages = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    run(messages, pollMessages)
@@ -0,0 +1,103 @@
+"""
+Simulate the GUI's once a second poll of sms.db headlessly and compare the
+CPU it spends per tick opening a new connection for every MessageDatabase,
+as it used to, against reusing the thread's managed connection.
+
+Usage:
+    python benchmarks/benchPollLoop.py [ticks] [chats] [messages]
+
+Before each tick a new message is applied to a random chat the way updater
+applies updates. A tick then does what readChatUpdates and
+MessageFrame.addMessages read: the chats to update, their latest messages,
+chat rows and recipients, and the new messages of the open chat.
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(here, '..', 'localCode'))
+import benchStartup  # noqa: E402
+import updater  # noqa: E402
+from messageApi import api  # noqa: E402
+from messageApi import connections  # noqa: E402
+
+
+class PerTickDatabase(api.MessageDatabase):
+    """MessageDatabase as it was, with a new connection each time."""
+    opened = 0
+
+    def __init__(self):
+        self.dbPath = api.dbPath
+        self.conn = sqlite3.connect(self.dbPath)
+        self.conn.row_factory = sqlite3.Row
+        PerTickDatabase.opened += 1
+
+
+def tick(database, state):
+    db = database()
+    chatIds, state['lastAccessTime'] = db.getChatsToUpdate(
+        state['lastAccessTime'])
+    db.getMostRecentMessages(chatIds)
+    for chatId in chatIds:
+        db.getChat(chatId)
+        db.getRecipients(chatId)
+    db = database()
+    _, state['chatAccessTime'] = db.getMessagesForChat(
+        state['openChat'], state['chatAccessTime'])
+
+
+def poll(path, database, ticks, chats):
+    rand = random.Random(0)
+    writer = sqlite3.connect(path)
+    nextRowid = writer.execute('SELECT max(ROWID) FROM message').fetchone()[0]
+    lastAccessTime = writer.execute(
+        'SELECT max(message_update_date) FROM message_update_date_join'
+    ).fetchone()[0]
+    state = {'lastAccessTime': lastAccessTime, 'openChat': 1,
+             'chatAccessTime': lastAccessTime}
+    cpu = 0
+    for _ in range(ticks):
+        nextRowid += 1
+        lastAccessTime += 1
+        updater.applyUpdates(writer, {
+            'message': [{'ROWID': nextRowid, 'guid': 'NEW{}'.format(nextRowid),
+                         'text': 'new', 'date': lastAccessTime}],
+            'chat_message_join': [{'chat_id': rand.randint(1, chats),
+                                   'message_id': nextRowid}],
+            'message_update_date_join': [{
+                'message_id': nextRowid,
+                'message_update_date': lastAccessTime}]})
+        start = time.process_time()
+        tick(database, state)
+        cpu += time.process_time() - start
+    writer.close()
+    return cpu / ticks
+
+
+def run(ticks, chats, messages):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sms.db')
+        benchStartup.createMirror(path, chats, messages)
+        sqlite3.connect(path).execute('PRAGMA journal_mode=WAL').close()
+        api._useTestDatabase(path)
+        print('{} ticks, {} chats, {} messages'.format(ticks, chats,
+                                                       messages))
+        manager = connections.getManager()
+        for label, database, opened in (
+                ('per tick', PerTickDatabase, lambda: PerTickDatabase.opened),
+                ('managed', api.MessageDatabase, lambda: manager.opened)):
+            perTick = poll(path, database, ticks, chats)
+            print('{:<9} {:>7.3f} ms CPU per tick   {:>4} connections '
+                  'opened'.format(label, perTick * 1000, opened()))
+
+
+if __name__ == '__main__':
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    messages = int(sys.argv[3]) if len(sys.argv) > 3 else 100000
+    run(ticks, chats, messages)
@@ -0,0 +1,109 @@
+"""
+Compare pushed updates from /events with polling /update every second.
+
+Usage:
+    python benchmarks/benchPush.py [messages] [idleSeconds]
+
+Runs the real UpdaterThread against the local stand-in HTTPS server, which
+serves a synthetic chat.db through getMessages.py like index.js does. For
+each mode it counts the requests sent while nothing changes, then writes
+messages to chat.db at random intervals and measures how long each takes to
+appear in the local database. Requires openssl.
+"""
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+root = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'localCode'))
+import syntheticdb  # noqa: E402
+from tests import standinserver  # noqa: E402
+import updater  # noqa: E402
+
+
+def waitForRow(conn, rowid, timeout=10):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if conn.execute('SELECT 1 FROM message WHERE ROWID = ?',
+                        (rowid, )).fetchone():
+            return time.perf_counter()
+        time.sleep(0.002)
+    raise TimeoutError('message {} never arrived'.format(rowid))
+
+
+def run(mode, tmp, messages, idleSeconds):
+    chatDbPath = os.path.join(tmp, mode + '-chat.db')
+    chatDb = syntheticdb.createDatabase(chatDbPath, messages=1000)
+    localPath = os.path.join(tmp, mode + '-sms.db')
+    local = sqlite3.connect(localPath)
+    local.executescript(syntheticdb.SCHEMA)
+
+    with standinserver.StandInServer() as server:
+        feed = standinserver.UpdateFeed(server, chatDbPath,
+                                        push=(mode == 'push'))
+        secretsPath = os.path.join(tmp, 'secrets.json')
+        with open(secretsPath, 'w') as outfile:
+            json.dump(server.secrets(port=server.port, scriptPath='',
+                                     retrieveScriptPath=''), outfile)
+        updater.dataFile = os.path.join(tmp, mode + '-data.json')
+        with open(updater.dataFile, 'w') as outfile:
+            json.dump({'lastAccess': int(time.time())}, outfile)
+        updater.session._session = None
+
+        thread = updater.UpdaterThread(secretsPath=secretsPath,
+                                       databasePath=localPath)
+        thread.start()
+        time.sleep(2)
+
+        before = server.requestCount
+        time.sleep(idleSeconds)
+        idleRequests = server.requestCount - before
+
+        rand = random.Random(0)
+        latencies = []
+        feed.messagesSent = 0
+        for rowid in range(1001, 1001 + messages):
+            time.sleep(rand.uniform(0.2, 0.8))
+            with chatDb:
+                chatDb.execute(
+                    'INSERT INTO message (ROWID, guid, text, date, '
+                    'date_read, date_delivered) VALUES (?, ?, ?, 0, 0, 0)',
+                    (rowid, 'NEW-{}'.format(rowid), 'hi'))
+                chatDb.execute('INSERT INTO chat_message_join VALUES (1, ?)',
+                               (rowid, ))
+                chatDb.execute(
+                    'INSERT INTO message_update_date_join VALUES (?, ?)',
+                    (rowid, int(time.time())))
+            feed.notify()
+            written = time.perf_counter()
+            latencies.append(waitForRow(local, rowid) - written)
+
+        thread.stopThread()
+        thread.join()
+        feed.close()
+        updater.session.getSession().close()
+
+    ordered = sorted(latencies)
+    print('{:<5} idle requests in {} s: {:>3}   latency p50 {:>7.1f} ms  '
+          'max {:>7.1f} ms   messages sent for {} new: {}'.format(
+              mode, idleSeconds, idleRequests,
+              statistics.median(latencies) * 1000, ordered[-1] * 1000,
+              messages, feed.messagesSent))
+    local.close()
+    chatDb.close()
+
+
+if __name__ == '__main__':
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    idleSeconds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        run('poll', tmp, messages, idleSeconds)
+        run('push', tmp, messages, idleSeconds)
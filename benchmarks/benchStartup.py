@@ -0,0 +1,118 @@
+"""
+Measure the cold start of the chat list: the time from opening sms.db to
+having every chat ready to paint, loaded the way updateFrames used to at
+startup or from the chat_summary table, and, when there is a display, to
+the chat list being painted.
+
+Usage:
+    python benchmarks/benchStartup.py [chats] [messages]
+
+Each start runs in a new process, so no Python or SQLite caches are warm,
+though the operating system's file cache may be.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(here, '..', 'localCode'))
+import syntheticdb  # noqa: E402
+
+
+def loadPerChat(db):
+    chatIds, _ = db.getChatsToUpdate(0)
+    chats = []
+    for chatId in chatIds:
+        chat = db.api.Chat(**db.getChat(chatId))
+        chat.addRecipients(db.getRecipients(chatId))
+        chat.addMessage(db.getMostRecentMessage(chatId))
+        chats.append(chat)
+    return chats
+
+
+def loadSummaries(db):
+    chats, _ = db.getChatSummaries()
+    return chats
+
+
+class ResponseFrame:
+    """Stands in for the conversation pane the chat buttons open."""
+
+    def isCurrentChat(self, chat):
+        return False
+
+    def changeChat(self, chat):
+        pass
+
+
+def paint(chats):
+    import tkinter as tk
+    from chatframe import ChatFrame
+    root = tk.Tk()
+    chatFrame = ChatFrame(root, 0, 270)
+    chatFrame.grid(row=0, column=0, sticky='nsew')
+    responseFrame = ResponseFrame()
+    for chat in chats:
+        chatFrame.addChat(chat, responseFrame)
+    chatFrame.chatButtons.sort(
+        key=lambda chatButton: chatButton.lastMessageTimeValue, reverse=True)
+    chatFrame.packChatButtons()
+    root.update()
+    root.destroy()
+
+
+def start(path, mode):
+    from messageApi import api
+    begin = time.perf_counter()
+    api._useTestDatabase(path)
+    db = api.MessageDatabase()
+    db.api = api
+    chats = (loadSummaries if mode == 'summary' else loadPerChat)(db)
+    loaded = time.perf_counter() - begin
+    painted = None
+    if os.environ.get('DISPLAY'):
+        paint(chats)
+        painted = time.perf_counter() - begin
+    return len(chats), loaded, painted
+
+
+def createMirror(path, chats, messages):
+    from messageApi import migrations
+    conn = syntheticdb.createDatabase(path, messages=messages, chats=chats,
+                                      handles=chats * 2, appleTime=False)
+    # The synthetic schema stands in for migration 1.
+    conn.executescript(';\n'.join(
+        script for scripts in migrations.MIGRATIONS[1:]
+        for script in scripts))
+    conn.execute('PRAGMA user_version = {:d}'.format(
+        len(migrations.MIGRATIONS)))
+    conn.close()
+
+
+def run(chats, messages):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sms.db')
+        createMirror(path, chats, messages)
+        print('{} chats, {} messages'.format(chats, messages))
+        for mode in ('per chat', 'summary'):
+            out = subprocess.run(
+                [sys.executable, __file__, '--child', path, mode],
+                check=True, stdout=subprocess.PIPE,
+                universal_newlines=True).stdout
+            count, loaded, painted = out.split()
+            print('{:<9} {:>5} chats loaded {:>8.1f} ms   painted {}'.format(
+                mode, count, float(loaded) * 1000,
+                'skipped, no display' if painted == 'None'
+                else '{:.1f} ms'.format(float(painted) * 1000)))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        print(*start(*sys.argv[2:4]))
+    else:
+        chats = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+        messages = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+        run(chats, messages)
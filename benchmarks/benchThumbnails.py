@@ -0,0 +1,111 @@
+"""
+Measure the memory and resize cost of showing a chat full of photos, the
+way ImageMessageBubble used to, keeping each decoded original and
+resampling it on every <Configure>, against the shared ThumbnailCache.
+
+Usage:
+    python benchmarks/benchThumbnails.py [photos] [width] [height]
+
+Only the PIL side is timed, so no display is needed. Memory is what the
+decoded images hold: width * height * bands for PIL images, plus 4 bytes a
+pixel for the PhotoImage Tk makes from each one either way. The originals
+are decoded one at a time, so the benchmark doesn't need the memory the
+old way did.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(here, '..', 'localCode'))
+import thumbnails  # noqa: E402
+from messageApi import api  # noqa: E402
+
+# A 600x480 message area, and the same area after dragging the window a few
+# pixels wider.
+WINDOW = (600, 480)
+DRAGGED = (610, 484)
+
+
+def createPhotos(directory, count, size):
+    attachments = []
+    gradient = Image.linear_gradient('L').resize(size)
+    for i in range(count):
+        filename = os.path.join(directory, 'IMG_{:04d}.jpg'.format(i))
+        Image.merge('RGB', (gradient, gradient.rotate(90 * (i % 4)),
+                            Image.new('L', size, i % 256))).save(
+            filename, quality=90)
+        attachments.append(api.Attachment(
+            ROWID=i + 1, guid='at_{}'.format(i), filename=filename,
+            uti='public.jpeg'))
+    return attachments
+
+
+def fit(image, winWidth, winHeight):
+    image = image.copy()
+    image.thumbnail((3 * winWidth // 4, 4 * winHeight // 5))
+    return image.size
+
+
+def runOriginals(attachments):
+    opened = resized = 0
+    memory = photoMemory = 0
+    for attachment in attachments:
+        begin = time.perf_counter()
+        with Image.open(attachment.filename) as original:
+            original.load()
+            first = original.resize(fit(original, *WINDOW), Image.LANCZOS)
+            opened += time.perf_counter() - begin
+            begin = time.perf_counter()
+            original.resize(fit(original, *DRAGGED), Image.LANCZOS)
+            resized += time.perf_counter() - begin
+            memory += (original.width * original.height *
+                       len(original.getbands()))
+        photoMemory += first.width * first.height * 4
+    return opened, resized, memory, photoMemory
+
+
+def runThumbnails(cache, attachments):
+    shown = []
+    begin = time.perf_counter()
+    for attachment in attachments:
+        shown.append(cache.thumbnail(attachment, thumbnails.bucketBox(
+            3 * WINDOW[0] // 4, 4 * WINDOW[1] // 5)))
+    opened = time.perf_counter() - begin
+    # Dragging within the size bucket needs no new image.
+    begin = time.perf_counter()
+    for attachment in attachments:
+        thumbnails.bucketBox(3 * DRAGGED[0] // 4,
+                             4 * DRAGGED[1] // 5)
+    resized = time.perf_counter() - begin
+    photoMemory = sum(image.width * image.height * 4 for image in shown)
+    return opened, resized, 0, photoMemory
+
+
+def run(count, size):
+    with tempfile.TemporaryDirectory() as tmp:
+        attachments = createPhotos(tmp, count, size)
+        print('{} photos, {}x{}'.format(count, *size))
+        print('{:<18} {:>10} {:>11} {:>13} {:>13}'.format(
+            '', 'open ms', 'resize ms', 'originals MB', 'photos MB'))
+        cache = thumbnails.ThumbnailCache(os.path.join(tmp, 'thumbnails'))
+        for label, result in (
+                ('originals', lambda: runOriginals(attachments)),
+                ('thumbnails, cold', lambda: runThumbnails(cache,
+                                                           attachments)),
+                ('thumbnails, disk', lambda: runThumbnails(cache,
+                                                           attachments))):
+            opened, resized, memory, photoMemory = result()
+            print('{:<18} {:>10.1f} {:>11.1f} {:>13.1f} {:>13.1f}'.format(
+                label, opened * 1000, resized * 1000, memory / 2 ** 20,
+                photoMemory / 2 ** 20))
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 1600
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else 1200
+    run(count, (width, height))
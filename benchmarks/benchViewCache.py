@@ -0,0 +1,89 @@
+"""
+Measure chat switch latency in ResponseFrame: switching back to a recently
+shown chat, whose MessageFrame is kept and raised, against switching to a
+cold one, whose MessageFrame is built from its messages.
+
+Usage:
+    python benchmarks/benchViewCache.py [chats] [messages] [switches]
+
+Recent switches toggle between two chats. Cold switches cycle through the
+other chats, which should be more than the view cache keeps, so every
+switch misses. Each switch is timed until Tk has painted it, so a display
+is needed.
+"""
+import os
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(__file__)
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(here, '..', 'localCode'))
+import benchStartup  # noqa: E402
+import messageframe  # noqa: E402
+from messageApi import api  # noqa: E402
+from messageApi import connections  # noqa: E402
+
+
+def createResponseFrame():
+    import tkinter as tk
+    from tkinter import ttk
+    from responseframe import ResponseFrame
+    root = tk.Tk()
+    root.geometry('720x540')
+    style = ttk.Style()
+    borderImage = tk.PhotoImage('borderImage', file=os.path.join(
+        here, '..', 'localCode', 'messageBox.png'))
+    style.element_create('RoundedFrame', 'image', borderImage,
+                         ('focus', borderImage), border=16, sticky='nsew')
+    style.layout('RoundedFrame', [('RoundedFrame', {'sticky': 'nsew'})])
+    responseFrame = ResponseFrame(root, 360, api)
+    responseFrame.grid(row=0, column=0, sticky='nsew')
+    root.columnconfigure(0, weight=1)
+    root.rowconfigure(0, weight=1)
+    root.update()
+    return root, responseFrame
+
+
+def switch(root, responseFrame, chat):
+    begin = time.perf_counter()
+    responseFrame.changeChat(chat)
+    root.update()
+    return time.perf_counter() - begin
+
+
+def run(chatCount, messages, switches):
+    if not os.environ.get('DISPLAY'):
+        print('skipped, no display')
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sms.db')
+        benchStartup.createMirror(path, chatCount, messages)
+        api._useTestDatabase(path)
+        root, responseFrame = createResponseFrame()
+        chats = [api.Chat(ROWID=chatId) for chatId in range(1, chatCount + 1)]
+        print('{} chats, {} messages, {} views kept'.format(
+            chatCount, messages, messageframe.MAX_CACHED_VIEWS))
+
+        # Show the recent pair once before timing them.
+        switch(root, responseFrame, chats[0])
+        switch(root, responseFrame, chats[1])
+        recent = [switch(root, responseFrame, chats[i % 2])
+                  for i in range(switches)]
+        others = chats[2:]
+        cold = [switch(root, responseFrame, others[i % len(others)])
+                for i in range(switches)]
+        for label, times in (('recent', recent), ('cold', cold)):
+            times.sort()
+            print('{:<7} median {:>7.1f} ms   max {:>7.1f} ms'.format(
+                label, times[len(times) // 2] * 1000, times[-1] * 1000))
+        print(responseFrame.views.stats())
+        root.destroy()
+        connections.getManager().close()
+
+
+if __name__ == '__main__':
+    chatCount = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    switches = int(sys.argv[3]) if len(sys.argv) > 3 else 40
+    run(chatCount, messages, switches)
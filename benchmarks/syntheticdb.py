@@ -0,0 +1,128 @@
+"""
+Build synthetic message databases for the benchmarks.
+
+The schema matches the tables and columns of chat.db (and of the local sms.db
+mirror created by INSTALL) that iMessageForwarder reads. Dates are stored in
+Apple time (nanoseconds since 2001) like chat.db unless appleTime is False,
+in which case they are unix seconds like the local mirror.
+"""
+import random
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS handle (ROWID INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE, id TEXT NOT NULL, country TEXT, service TEXT NOT NULL, uncanonicalized_id TEXT, UNIQUE (id, service));
+CREATE TABLE IF NOT EXISTS chat (ROWID INTEGER PRIMARY KEY AUTOINCREMENT, guid TEXT UNIQUE NOT NULL, style INTEGER, state INTEGER, account_id TEXT, properties BLOB, chat_identifier TEXT, service_name TEXT, room_name TEXT, account_login TEXT, is_archived INTEGER DEFAULT 0, last_addressed_handle TEXT, display_name TEXT, group_id TEXT, is_filtered INTEGER, successful_query INTEGER);
+CREATE TABLE IF NOT EXISTS message (ROWID INTEGER PRIMARY KEY AUTOINCREMENT, guid TEXT UNIQUE NOT NULL, text TEXT, handle_id INTEGER DEFAULT 0, service TEXT, error INTEGER DEFAULT 0, date INTEGER, date_read INTEGER, date_delivered INTEGER, is_delivered INTEGER DEFAULT 0, is_finished INTEGER DEFAULT 0, is_from_me INTEGER DEFAULT 0, is_read INTEGER DEFAULT 0, is_sent INTEGER DEFAULT 0, cache_has_attachments INTEGER DEFAULT 0, cache_roomnames TEXT, item_type INTEGER DEFAULT 0, other_handle INTEGER DEFAULT 0, group_title TEXT, group_action_type INTEGER DEFAULT 0, associated_message_guid TEXT, associated_message_type INTEGER DEFAULT 0, associated_message_range_location INTEGER DEFAULT 0, associated_message_range_length INTEGER DEFAULT 0);
+CREATE TABLE IF NOT EXISTS attachment (ROWID INTEGER PRIMARY KEY AUTOINCREMENT, guid TEXT UNIQUE NOT NULL, created_date INTEGER DEFAULT 0, start_date INTEGER DEFAULT 0, filename TEXT, uti TEXT, mime_type TEXT, transfer_state INTEGER DEFAULT 0, is_outgoing INTEGER DEFAULT 0, user_info BLOB, transfer_name TEXT, total_bytes INTEGER DEFAULT 0);
+CREATE TABLE IF NOT EXISTS chat_message_join (chat_id INTEGER REFERENCES chat (ROWID) ON DELETE CASCADE, message_id INTEGER REFERENCES message (ROWID) ON DELETE CASCADE, PRIMARY KEY (chat_id, message_id));
+CREATE TABLE IF NOT EXISTS chat_handle_join (chat_id INTEGER REFERENCES chat (ROWID) ON DELETE CASCADE, handle_id INTEGER REFERENCES handle (ROWID) ON DELETE CASCADE, UNIQUE(chat_id, handle_id));
+CREATE TABLE IF NOT EXISTS message_attachment_join (message_id INTEGER REFERENCES message (ROWID) ON DELETE CASCADE, attachment_id INTEGER REFERENCES attachment (ROWID) ON DELETE CASCADE, UNIQUE(message_id, attachment_id));
+CREATE TABLE IF NOT EXISTS message_update_date_join (message_id INTEGER REFERENCES message (ROWID) ON DELETE CASCADE, message_update_date INTEGER DEFAULT 0, PRIMARY KEY (message_id, message_update_date));
+CREATE INDEX IF NOT EXISTS chat_message_join_idx_message_id_only ON chat_message_join(message_id);
+CREATE INDEX IF NOT EXISTS message_attachment_join_idx_message_id ON message_attachment_join(message_id);
+"""
+
+APPLE_EPOCH = 978307200
+
+# Start the synthetic history on 2019-01-01
+START_TIME = 1546300800
+
+
+def createDatabase(path, messages=10000, chats=50, handles=100,
+                   attachmentEvery=10, duplicateAttachments=0.0,
+                   appleTime=True, seed=0):
+    """Create a database at path and return its open connection.
+
+    Messages are spread across chats at random, one every 30 seconds. Every
+    attachmentEvery-th message gets an attachment; duplicateAttachments is
+    the fraction of those that reuse the filename of an earlier attachment,
+    like an image forwarded to several chats.
+    """
+    rand = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+
+    def toDbTime(unixTime):
+        if appleTime:
+            return (unixTime - APPLE_EPOCH) * 1000000000
+        return unixTime
+
+    with conn:
+        conn.executemany(
+            'INSERT INTO handle (ROWID, id, country, service) '
+            'VALUES (?, ?, ?, ?)',
+            [(h, '+1555{:07d}'.format(h), 'us', 'iMessage')
+             for h in range(1, handles + 1)])
+
+        members = {}
+        for c in range(1, chats + 1):
+            isGroup = c % 4 == 0
+            members[c] = rand.sample(range(1, handles + 1),
+                                     min(handles, 4 if isGroup else 1))
+            conn.execute(
+                'INSERT INTO chat (ROWID, guid, style, chat_identifier, '
+                'service_name, display_name) VALUES (?, ?, ?, ?, ?, ?)',
+                (c, 'iMessage;-;chat{}'.format(c), 43 if isGroup else 45,
+                 'chat{}'.format(c), 'iMessage',
+                 'Group {}'.format(c) if isGroup else ''))
+            conn.executemany(
+                'INSERT INTO chat_handle_join (chat_id, handle_id) '
+                'VALUES (?, ?)', [(c, h) for h in members[c]])
+
+        messageRows = []
+        chatMessageRows = []
+        updateRows = []
+        attachmentRows = []
+        messageAttachmentRows = []
+        filenames = []
+        for m in range(1, messages + 1):
+            chatId = rand.randint(1, chats)
+            isFromMe = rand.random() < 0.4
+            handleId = 0 if isFromMe else rand.choice(members[chatId])
+            unixDate = START_TIME + m * 30
+            hasAttachment = attachmentEvery and m % attachmentEvery == 0
+            text = '￼' if hasAttachment else 'Message {} {}'.format(
+                m, 'lorem ipsum ' * rand.randint(0, 8))
+            messageRows.append(
+                (m, 'MSG-{:08d}-0000-0000-0000-000000000000'.format(m), text,
+                 handleId, 'iMessage', toDbTime(unixDate),
+                 toDbTime(unixDate + 60) if isFromMe else 0,
+                 toDbTime(unixDate + 1), 1, 1, int(isFromMe), 1, 1,
+                 int(bool(hasAttachment))))
+            chatMessageRows.append((chatId, m))
+            updateRows.append((m, unixDate))
+            if hasAttachment:
+                attachmentId = len(attachmentRows) + 1
+                if filenames and rand.random() < duplicateAttachments:
+                    filename, size = rand.choice(filenames)
+                else:
+                    filename = ('~/Library/Messages/Attachments/{:02x}/'
+                                'IMG_{:05d}.png'.format(attachmentId % 256,
+                                                        attachmentId))
+                    size = rand.randint(20000, 400000)
+                    filenames.append((filename, size))
+                attachmentRows.append(
+                    (attachmentId,
+                     'ATT-{:08d}-0000-0000-0000-000000000000'.format(
+                         attachmentId),
+                     filename, 'public.png', size))
+                messageAttachmentRows.append((m, attachmentId))
+
+        conn.executemany(
+            'INSERT INTO message (ROWID, guid, text, handle_id, service, '
+            'date, date_read, date_delivered, is_delivered, is_finished, '
+            'is_from_me, is_read, is_sent, cache_has_attachments) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', messageRows)
+        conn.executemany(
+            'INSERT INTO chat_message_join (chat_id, message_id) '
+            'VALUES (?, ?)', chatMessageRows)
+        conn.executemany(
+            'INSERT INTO message_update_date_join '
+            '(message_id, message_update_date) VALUES (?, ?)', updateRows)
+        conn.executemany(
+            'INSERT INTO attachment (ROWID, guid, filename, uti, '
+            'total_bytes) VALUES (?, ?, ?, ?, ?)', attachmentRows)
+        conn.executemany(
+            'INSERT INTO message_attachment_join (message_id, attachment_id) '
+            'VALUES (?, ?)', messageAttachmentRows)
+    return conn
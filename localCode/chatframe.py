@@ -1,5 +1,4 @@
 import tkinter as tk
-import threading
 from datetime import datetime, timedelta
 from verticalscrolledframe import VerticalScrolledFrame
 
@@ -41,7 +40,6 @@ class ChatFrame(VerticalScrolledFrame):
                                        *args, **kw)
         self.chatButtons = []
         self.chats = {}
-        self.lock = threading.Lock()
         self.configure(bg='black', pady=1)
         self.interior.configure(bg='black')
         self.debug = False
@@ -151,6 +149,8 @@ class ChatButton(tk.Frame):
         self.lastMessageId = self.chat.getMostRecentMessage().rowid
 
         name = self.truncate(self.chat.getName(), 20)
+        if self.chat.unreadCount > 0:
+            name = '{} ({})'.format(name, self.chat.unreadCount)
         text = self.truncate(self.chat.getMostRecentMessage().getText(), 50)
         # TODO 4: Need to grab the type of message and set the text to that.
         # Perhaps this should be implemented on message load.
@@ -2,50 +2,66 @@ import tkinter as tk
 from tkinter import ttk
 import threading
 import os
+import time
 import simpleaudio as sa
 from responseframe import ResponseFrame
 from chatframe import LeftFrame
 import messageApi.api as api
-
-
-def updateFrames(chatFrame, responseFrame, lastAccessTime,
-                 lastSoundTime, currentThread):
-    if currentThread._stopevent.isSet():
-        chatFrame.master.quit()
-        # chatFrame.master.destroy()
-        return
-
-    db = api.MessageDatabase()
-    chatIds, newLastAccessTime = db.getChatsToUpdate(lastAccessTime,
-                                                     chatFrame.chats)
-    chatFrame.lock.acquire()
-    newMessageFlag = False
+import scheduler
+import thumbnails
+
+
+# Seconds between pings of the remote machine, and the fewest seconds
+# between two new message sounds.
+PING_INTERVAL = 1
+SOUND_INTERVAL = 5
+
+
+def readChatUpdates(db, chats, lastAccessTime):
+    """Read the chats that changed since lastAccessTime, without touching
+    any widgets. Returns a list of (chatId, chat, recentMessage,
+    unreadCount), where chat is a new api.Chat for chats not in chats and
+    None otherwise, and the lastAccessTime for the next call. unreadCount is
+    None if the database doesn't keep one."""
+    chatIds, newLastAccessTime = db.getChatsToUpdate(lastAccessTime, chats)
+    recentMessages = db.getMostRecentMessages(chatIds)
+    unreadCounts = db.getUnreadCounts(chatIds)
+    updates = []
     for chatId in chatIds:
-        try:
-            for chatButton in chatFrame.chatButtons:
-                if chatId == chatButton.chat.chatId:
-                    recentMessage = db.getMostRecentMessage(
-                        chatButton.chat.chatId)
-                    chatButton.chat.addMessage(recentMessage)
-                    if chatButton.update():
-                        newMessageFlag = True
-
-            if chatId == responseFrame.currentChat.chatId:
-                (responseFrame.messageFrame
-                 .addMessages(responseFrame.currentChat))
-
-            if chatId not in chatFrame.chatButtons:
-                row = db.getChat(chatId)
-                chat = api.Chat(**row)
-                chat.addRecipients(db.getRecipients(chat.chatId))
-                recentMessage = db.getMostRecentMessage(chat.chatId)
-                chat.addMessage(recentMessage)
-                chatFrame.addChat(chat, responseFrame)
-                if lastAccessTime == 0:
-                    newMessageFlag = False
-
-        except api.ChatDeletedException as e:
-            continue
+        recentMessage = recentMessages.get(chatId)
+        unreadCount = unreadCounts.get(chatId)
+        chat = None
+        if chatId not in chats:
+            try:
+                chat = api.Chat(**db.getChat(chatId))
+            except api.ChatDeletedException as e:
+                continue
+            chat.addRecipients(db.getRecipients(chat.chatId))
+            chat.addMessage(recentMessage)
+            chat.unreadCount = unreadCount or 0
+        updates.append((chatId, chat, recentMessage, unreadCount))
+    return updates, newLastAccessTime
+
+
+def updateFrames(chatFrame, responseFrame, updates):
+    """Show updates read by readChatUpdates. Must run on the Tk thread.
+    Returns whether a chat that isn't open got a new message."""
+    newMessageFlag = False
+    for chatId, chat, recentMessage, unreadCount in updates:
+        for chatButton in chatFrame.chatButtons:
+            if chatId == chatButton.chat.chatId:
+                chatButton.chat.addMessage(recentMessage)
+                if unreadCount is not None:
+                    chatButton.chat.unreadCount = unreadCount
+                if chatButton.update():
+                    newMessageFlag = True
+
+        if chatId == responseFrame.currentChat.chatId:
+            (responseFrame.messageFrame
+             .addMessages(responseFrame.currentChat))
+
+        if chat is not None:
+            chatFrame.addChat(chat, responseFrame)
 
     sortedChats = sorted(chatFrame.chatButtons, key=lambda chatButton:
                          chatButton.lastMessageTimeValue, reverse=True)
@@ -55,21 +71,62 @@ def updateFrames(chatFrame, responseFrame, lastAccessTime,
             chatFrame.chatButtons = sortedChats
             chatFrame.packChatButtons()
             break
+    return newMessageFlag
 
-    if newMessageFlag and lastSoundTime == 0:
-        lastSoundTime = 5
-        threading.Thread(target=lambda: soundObject.play().wait_done()).start()
 
-    chatFrame.lock.release()
+def pollFrames(chatFrame, lastAccessTime, currentThread):
+    # Polling from one long-lived thread lets every tick reuse the same
+    # database connection. A tick runs as soon as the updater applies an
+    # update, and at least once a second for local changes. What it reads is
+    # posted to the Tk thread to be shown.
+    eventScheduler = currentThread.scheduler
+    while True:
+        currentThread._wakeevent.wait(1)
+        currentThread._wakeevent.clear()
+        if currentThread._stopevent.is_set():
+            break
+        # Copy the loaded chats, since the Tk thread adds to them.
+        updates, lastAccessTime = readChatUpdates(
+            api.MessageDatabase(), chatFrame.chats.copy(), lastAccessTime)
+        for update in updates:
+            eventScheduler.post(scheduler.CHAT_UPDATED, update[0], update)
+
+
+def pingRemote(mp, currentThread):
+    # Pinging from its own thread keeps a slow or unreachable remote machine
+    # from holding up the polls.
+    while True:
+        currentThread.scheduler.post(scheduler.CONNECTION_STATE,
+                                     value=mp.ping())
+        if currentThread._stopevent.wait(PING_INTERVAL):
+            break
 
-    threading.Thread(target=lambda sendFrame=responseFrame.sendFrame:
-                     sendFrame.setIsConnected(sendFrame.mp.ping())).start()
-    lastSoundTime = 0 if lastSoundTime == 0 else lastSoundTime - 1
-    threading.Timer(1, lambda chatFrame=chatFrame, responseFrame=responseFrame,
-                    lastAccessTime=newLastAccessTime,
-                    lastSoundTime=lastSoundTime, currentThread=currentThread:
-                        updateFrames(chatFrame, responseFrame, lastAccessTime,
-                                     lastSoundTime, currentThread)).start()
+
+class SoundPlayer:
+    """Plays the new message sound, at most once every SOUND_INTERVAL
+    seconds."""
+
+    def __init__(self, path):
+        self.waveObject = sa.WaveObject.from_wave_file(path)
+        self.lastPlayed = None
+
+    def play(self, values=None):
+        now = time.monotonic()
+        if self.lastPlayed is None or now - self.lastPlayed >= SOUND_INTERVAL:
+            self.lastPlayed = now
+            # play() returns once playback starts, so no thread is needed.
+            self.waveObject.play()
+
+
+def logThreadCount(root, threadCounter):
+    print('Threads started in the last minute:',
+          threadCounter.perMinute())
+    root.after(60 * 1000, logThreadCount, root, threadCounter)
+
+
+def logViewCache(root, views):
+    print('Chat views kept:', views.stats())
+    root.after(60 * 1000, logViewCache, root, views)
 
 
 def runGui(debug, currentThread):
@@ -99,9 +156,39 @@ def runGui(debug, currentThread):
     root.columnconfigure(1, weight=1)
     root.rowconfigure(0, weight=1)
 
-    global soundObject
-    soundObject = sa.WaveObject.from_wave_file('bing.wav')
-    updateFrames(chatFrame, responseFrame, 0, 0, currentThread)
+    eventScheduler = currentThread.scheduler
+    soundPlayer = SoundPlayer('bing.wav')
+    sendFrame = responseFrame.sendFrame
+
+    def onChatsUpdated(updates):
+        if updateFrames(chatFrame, responseFrame, updates):
+            eventScheduler.post(scheduler.PLAY_SOUND)
+
+    eventScheduler.handle(scheduler.CHAT_UPDATED, onChatsUpdated)
+    eventScheduler.handle(scheduler.CONNECTION_STATE,
+                          lambda states: sendFrame.setIsConnected(states[-1]))
+    eventScheduler.handle(scheduler.PLAY_SOUND, soundPlayer.play)
+    eventScheduler.handle(scheduler.QUIT, lambda values: root.quit())
+    thumbnails.getCache().start(eventScheduler)
+
+    # Paint the chat list from the chat summaries, so the first update only
+    # has to look at what changed since they were written.
+    db = api.MessageDatabase()
+    chats, lastAccessTime = db.getChatSummaries()
+    for chat in chats:
+        chatFrame.addChat(chat, responseFrame)
+    updates, lastAccessTime = readChatUpdates(db, chatFrame.chats,
+                                              lastAccessTime)
+    updateFrames(chatFrame, responseFrame, updates)
+    eventScheduler.start(root)
+    threading.Thread(target=pollFrames, name='PollThread', daemon=True,
+                     args=(chatFrame, lastAccessTime,
+                           currentThread)).start()
+    threading.Thread(target=pingRemote, name='PingThread', daemon=True,
+                     args=(responseFrame.mp, currentThread)).start()
+    if debug:
+        logThreadCount(root, currentThread.threadCounter)
+        logViewCache(root, responseFrame.views)
 
     while True:
         try:
@@ -109,12 +196,18 @@ def runGui(debug, currentThread):
             break
         except UnicodeDecodeError:
             pass
+    thumbnails.getCache().shutdown()
 
 
 class GuiThread(threading.Thread):
 
     def __init__(self, debug=False, name='GuiThread'):
         self._stopevent = threading.Event()
+        self._wakeevent = threading.Event()
+        self.scheduler = scheduler.Scheduler()
+        self.threadCounter = scheduler.ThreadCounter()
+        if debug:
+            self.threadCounter.install()
         threading.Thread.__init__(self, name=name)
 
         dirname = os.path.dirname(__file__)
@@ -127,8 +220,14 @@ class GuiThread(threading.Thread):
     def run(self):
         runGui(self.debug, self)
 
+    def wake(self):
+        """Refresh the frames now rather than on the next tick."""
+        self._wakeevent.set()
+
     def stopThread(self):
         self._stopevent.set()
+        self._wakeevent.set()
+        self.scheduler.post(scheduler.QUIT)
 
 
 if __name__ == '__main__':
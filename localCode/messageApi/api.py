@@ -7,12 +7,31 @@ import subprocess
 import threading
 import requests
 import functools
+import bisect
 from . import sqlcommands
-from typing import List, Type, Dict, Any, Optional, Tuple
+from . import session
+from . import connections
+from collections.abc import ItemsView, KeysView, ValuesView
+from typing import List, Type, Dict, Any, Optional, Tuple, Iterator
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 
 
+# The number of values bound to a single IN (...) list
+SQL_CHUNK_SIZE = 500
+
+
+class _PollState(threading.local):
+    """The (connection, data version, update time) each thread's last
+    getChatsToUpdate left off at, by database path."""
+
+    def __init__(self):
+        self.lastPolls = {}
+
+
+_pollState = _PollState()
+
+
 def initialize(pathToDb, secretsFile):
     global dbPath, user, ip, serverCrt, clientCrt, clientKey
 
@@ -23,6 +42,120 @@ def initialize(pathToDb, secretsFile):
     serverCrt = secrets['serverCrt']
     clientCrt = secrets['clientCrt']
     clientKey = secrets['clientKey']
+    session.initialize(secrets)
+
+
+class SortedMessageDict(dict):
+    """
+    A dictionary of messages keyed on ROWID that iterates in date order.
+    Alongside the dictionary, a sorted list of (date, ROWID) keys is kept up to
+    date with bisect, so lookups by ROWID stay O(1) while ordered insertion,
+    range slicing and "last n" queries only need a binary search.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._index = []
+        self._sortKeys = {}
+
+    def __setitem__(self, rowid: int, message: 'Received') -> None:
+        if rowid in self:
+            self._removeSortKey(rowid)
+        super().__setitem__(rowid, message)
+        sortKey = (message.date, rowid)
+        bisect.insort(self._index, sortKey)
+        self._sortKeys[rowid] = sortKey
+
+    def __delitem__(self, rowid: int) -> None:
+        super().__delitem__(rowid)
+        self._removeSortKey(rowid)
+
+    def __iter__(self) -> Iterator[int]:
+        return (rowid for (_, rowid) in self._index)
+
+    def __reversed__(self) -> Iterator[int]:
+        return (rowid for (_, rowid) in reversed(self._index))
+
+    def keys(self) -> KeysView:
+        return KeysView(self)
+
+    def values(self) -> ValuesView:
+        return ValuesView(self)
+
+    def items(self) -> ItemsView:
+        return ItemsView(self)
+
+    def pop(self, rowid: int, *default: Any) -> Any:
+        if rowid not in self:
+            return super().pop(rowid, *default)
+        message = super().pop(rowid)
+        self._removeSortKey(rowid)
+        return message
+
+    def popitem(self) -> Tuple[int, 'Received']:
+        """Remove and return the newest message."""
+        if not self._index:
+            raise KeyError('popitem(): dictionary is empty')
+        rowid = self._index[-1][1]
+        return rowid, self.pop(rowid)
+
+    def setdefault(self, rowid: int, message: 'Received') -> 'Received':
+        # Unlike dict, there is no None default, since it has no date to
+        # sort on.
+        if rowid not in self:
+            self[rowid] = message
+        return self[rowid]
+
+    def copy(self) -> 'SortedMessageDict':
+        other = SortedMessageDict()
+        dict.update(other, self)
+        other._index = list(self._index)
+        other._sortKeys = dict(self._sortKeys)
+        return other
+
+    def clear(self) -> None:
+        super().clear()
+        self._index = []
+        self._sortKeys = {}
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        for rowid, message in dict(*args, **kwargs).items():
+            self[rowid] = message
+
+    def reindex(self, rowid: int) -> None:
+        """Move a message to its correct position if its date has changed."""
+        message = self[rowid]
+        if self._sortKeys[rowid] != (message.date, rowid):
+            self[rowid] = message
+
+    def lastKeys(self, count: int) -> List[int]:
+        """Return the ROWIDs of the newest count messages, oldest first."""
+        if count <= 0:
+            return []
+        return [rowid for (_, rowid) in self._index[-count:]]
+
+    def keysBetween(self,
+                    start: Tuple[int, int],
+                    end: Tuple[int, int]) -> List[int]:
+        """Return the ROWIDs of messages with start <= (date, ROWID) < end."""
+        lo = bisect.bisect_left(self._index, start)
+        hi = bisect.bisect_left(self._index, end)
+        return [rowid for (_, rowid) in self._index[lo:hi]]
+
+    def keysBefore(self, end: Tuple[int, int], count: int) -> List[int]:
+        """Return up to count ROWIDs of messages older than end, oldest
+        first."""
+        hi = bisect.bisect_left(self._index, end)
+        lo = max(0, hi - count)
+        return [rowid for (_, rowid) in self._index[lo:hi]]
+
+    def sortKey(self, rowid: int) -> Tuple[int, int]:
+        return self._sortKeys[rowid]
+
+    def _removeSortKey(self, rowid: int) -> None:
+        sortKey = self._sortKeys.pop(rowid)
+        i = bisect.bisect_left(self._index, sortKey)
+        del self._index[i]
 
 
 class MessageList(dict):
@@ -34,34 +167,34 @@ class MessageList(dict):
       important if a user doesn't delete messages
     2 allows sorting to happen at insertion in order to save time when printing
       messages and fetching older ones
-    Dictionary order is guaranteed (insertion order) in python 3.7+
+    Both are provided by SortedMessageDict, which keeps a bisect-maintained
+    (date, ROWID) index next to the ROWID dictionary. Inserting a message
+    anywhere in the history is O(log n) to locate, rather than popping and
+    re-inserting every newer message.
+
+    Chats are loaded newest first a page at a time, and a reaction is always
+    newer than its message, so reactions can arrive before the message they
+    belong to. Those are held in pendingReactions until it does.
     """
 
     def __init__(self):
-        self.messages = {}
+        self.messages = SortedMessageDict()
+        self.pendingReactions = {}
         self.mostRecentMessage = None
         self.writeLock = threading.Lock()
 
-    # Sorting on insertion is likely faster than inserting all messages with
-    # one sort.
-    # The assumption is that messages will be inserted near the end,
-    # requiring fewer checks than looking at the entire list.
     def append(self, message: 'Received') -> None:
         self.writeLock.acquire()
-        updatedMessages = self.messages
 
-        # If the message is just being updated, no need to worry about ordering
-        # (assumption that date should never change)
-        if message.rowid in updatedMessages:
-            updatedMessages[message.rowid].update(message)
+        # If the message is just being updated, the ordering only needs to
+        # change if the date of the message changed.
+        if message.rowid in self.messages:
+            self.messages[message.rowid].update(message)
+            self.messages.reindex(message.rowid)
         else:
-            keys = list(updatedMessages)
-            if keys:
-                self._insert(message, updatedMessages, keys)
-            # If the list is empty we end up here
-            else:
-                updatedMessages[message.rowid] = message
-        self.messages = updatedMessages
+            self._insert(message, self.messages)
+            for reaction in self.pendingReactions.pop(message.rowid, []):
+                message.addReaction(reaction)
 
         self._updateMostRecentMessage(message)
 
@@ -69,43 +202,19 @@ class MessageList(dict):
 
     def _insert(self,
                 message: 'Received',
-                messageList: Dict[int,
-                                  'Received'],
-                keys: List[int]) -> None:
-        # Here we need to check the dates near the end of the dictionary
-        # We assume that the dictionary will be sorted at this point
-        # by induction.
-        # Avoid using reverse here since it has complexity O(n)
-        i = 0
-        # If i == -1, we know that this message is older than all
-        # other messages in the list.
-        for i in range(len(keys) - 1, -2, -1):
-            #
-            if i == -1:
-                break
-            key = keys[i]
-            if message.isNewer(messageList[key]):
-                break
-
-        # Find the keys that will need to come after this new message
-        keysToRemove = [k for k in keys[i + 1:]]
-        # Remove the keys, but save messages
-        poppedMessages = []
-        for key in keysToRemove:
-            poppedMessages.append(messageList.pop(key))
-        # Add in the new message
+                messageList: SortedMessageDict) -> None:
+        # The sorted index places the message by (date, ROWID), so newer
+        # messages never need to be moved.
         messageList[message.rowid] = message
-        # Add back the messages we removed from the list
-        poppedMessages.reverse()
-        for _ in range(len(poppedMessages)):
-            p = poppedMessages.pop()
-            messageList[p.rowid] = p
 
     def addReaction(self, reaction: 'Reaction') -> None:
 
         self.writeLock.acquire()
-        if reaction.associatedMessageId in self.messages.keys():
+        if reaction.associatedMessageId in self.messages:
             self.messages[reaction.associatedMessageId].addReaction(reaction)
+        else:
+            self.pendingReactions.setdefault(
+                reaction.associatedMessageId, []).append(reaction)
 
         self._updateMostRecentMessage(reaction)
 
@@ -119,6 +228,14 @@ class MessageList(dict):
     def getMostRecentMessage(self) -> 'Received':
         return self.mostRecentMessage
 
+    def getLastIds(self, count: int) -> List[int]:
+        return self.messages.lastKeys(count)
+
+    def getIdsBetween(self,
+                      start: Tuple[int, int],
+                      end: Tuple[int, int]) -> List[int]:
+        return self.messages.keysBetween(start, end)
+
 
 @dataclass
 class Attachment:
@@ -361,6 +478,13 @@ class Message(Received):
         self.service = updatedMessage.service
         self.removedTempId = (updatedMessage.removedTempId if
                               self.removedTempId == 0 else self.removedTempId)
+        # An attachment's file moves into the blob store once it has been
+        # downloaded.
+        for part, updatedPart in zip(self._messageParts,
+                                     updatedMessage.messageParts):
+            if (part.kind == 'image' and updatedPart.kind == 'image' and
+                    updatedPart.attachment is not None):
+                part.attachment = updatedPart.attachment
 
 
 @dataclass
@@ -504,6 +628,10 @@ class Chat:
         self.messagePreviewId = -1
         self.isTemporaryChat = False
         self.recipientList = []
+        self.unreadCount = 0
+        # The (date, ROWID) key the next page of older messages is read
+        # before, or None if there are none left to read.
+        self.olderMessagesKey = None
 
     @property
     def chatId(self) -> int:
@@ -564,6 +692,20 @@ class Chat:
         if lastAccessTime > self.lastAccessTime:
             self.lastAccessTime = lastAccessTime
 
+    def addOlderMessages(
+            self,
+            messageList: List['Received'],
+            lastAccessTime: int = 0) -> None:
+        """Add a page of messages older than any loaded, oldest first. The
+        next page is read before the oldest of them. An empty page means
+        there are no more."""
+        self.addMessages(messageList, lastAccessTime)
+        if messageList:
+            self.olderMessagesKey = (messageList[0].date,
+                                     messageList[0].rowid)
+        else:
+            self.olderMessagesKey = None
+
     def _addMessage(
             self,
             message: Optional['Received']) -> None:
@@ -577,6 +719,20 @@ class Chat:
                 self.removeTemporaryMessage(
                     self.messageList.messages[message.rowid])
 
+    def unloadMessages(self) -> None:
+        """Forget the messages read from the database, and the reactions
+        waiting on messages not read yet, keeping the most recent message
+        and any still being sent. The next read starts again from the
+        newest page."""
+        mostRecentMessage = self.getMostRecentMessage()
+        self.messageList = MessageList()
+        for message in self.outgoingList.messages.values():
+            self.messageList.append(message)
+        if mostRecentMessage is not None:
+            self.messageList._updateMostRecentMessage(mostRecentMessage)
+        self.lastAccessTime = 0
+        self.olderMessagesKey = None
+
     def removeTemporaryMessage(self, message: 'Received') -> None:
         self.messageList.writeLock.acquire()
         self.outgoingList.writeLock.acquire()
@@ -640,58 +796,228 @@ class MessageDatabase:
 
     def __init__(self):
         self.dbPath = dbPath
-        self.conn = sqlite3.connect(self.dbPath)
-        self.conn.row_factory = sqlite3.Row
+        # The connection is shared with every MessageDatabase made on this
+        # thread, so its caches outlast a single poll.
+        self.conn = connections.connect(self.dbPath)
 
     def getMessagesForChat(
             self,
             chatId: int,
-            lastAccessTime: int = 0) -> Tuple[List['Received'], int]:
-        messages = []
-        tempLastAccess = lastAccessTime
+            lastAccessTime: int = 0,
+            since: Tuple[int, int] = None) -> Tuple[List['Received'], int]:
+        """Return the chat's messages updated after lastAccessTime and the
+        lastAccessTime for the next call. If since is given, only messages
+        from that (date, ROWID) key on are read, which is quick however long
+        the chat is."""
         columns = self._getFormattedColumns()
-        sql = sqlcommands.LOAD_MESSAGES_SQL.format(columns)
-        cursor = self.conn.execute(sql, (chatId, tempLastAccess))
-
-        for row in cursor:
-            if row['message_update_date'] > tempLastAccess:
-                tempLastAccess = row['message_update_date']
-
-            message = self._parseMessage(row)
+        if since is None or not self._hasPages():
+            sql = sqlcommands.LOAD_MESSAGES_SQL.format(columns)
+            params = (chatId, lastAccessTime)
+        else:
+            sql = sqlcommands.LOAD_MESSAGES_SINCE_SQL.format(columns)
+            params = (chatId, lastAccessTime, since[0], since[1])
+        rows = self.conn.execute(sql, params).fetchall()
+        for row in rows:
+            if row['message_update_date'] > lastAccessTime:
+                lastAccessTime = row['message_update_date']
+        return (self._parseMessages(rows), lastAccessTime)
+
+    def getLatestMessages(
+            self,
+            chatId: int,
+            count: int) -> Tuple[List['Received'], int]:
+        """Return up to count of the chat's newest messages, oldest first,
+        and the lastAccessTime to read updates to them from."""
+        if not self._hasPages():
+            return self.getMessagesForChat(chatId)
+        # Read the update time first, so that anything written in between
+        # is read again rather than missed.
+        lastAccessTime = self.conn.execute(
+            sqlcommands.LAST_UPDATE_TIME_SQL).fetchone()[0] or 0
+        columns = self._getFormattedColumns(exclude=['message_update_date'])
+        sql = sqlcommands.LOAD_LATEST_MESSAGES_SQL.format(columns)
+        rows = self.conn.execute(sql, (chatId, count)).fetchall()
+        rows.reverse()
+        return (self._parseMessages(rows), lastAccessTime)
+
+    def getMessagesBefore(
+            self,
+            chatId: int,
+            before: Tuple[int, int],
+            count: int) -> List['Received']:
+        """Return up to count of the chat's messages older than the
+        (date, ROWID) key before, oldest first."""
+        if not self._hasPages():
+            return []
+        columns = self._getFormattedColumns(exclude=['message_update_date'])
+        sql = sqlcommands.LOAD_MESSAGES_BEFORE_SQL.format(columns)
+        rows = self.conn.execute(sql, (chatId, before[0], before[1],
+                                       count)).fetchall()
+        rows.reverse()
+        return self._parseMessages(rows)
+
+    def _parseMessages(self, rows: List[sqlite3.Row]) -> List['Received']:
+        # Handles, attachments and reaction targets are loaded for every row
+        # at once rather than with a query per message.
+        handleNames = self._getHandleNames(
+            {row['handle_id'] for row in rows})
+        attachments = self._getAttachmentsForMessages(
+            [row['ROWID'] for row in rows
+             if not row['associated_message_guid']])
+        assocMessageIds = self._getMessageIdsForGuids(
+            {row['associated_message_guid'][-36:] for row in rows
+             if row['associated_message_guid']})
 
-            handleName = self._getHandleName(row['handle_id'])
+        messages = []
+        for row in rows:
+            message = self._parseMessage(row, attachments, assocMessageIds)
             if message is not None:
-                message.handleName = handleName
+                message.handleName = handleNames.get(row['handle_id'], '')
                 messages.append(message)
-
-        lastAccessTime = max(lastAccessTime, tempLastAccess)
-        return (messages, lastAccessTime)
+        return messages
 
     def getMostRecentMessage(self, chatId: int) -> Optional['Received']:
-        cursor = self.conn.execute(sqlcommands.RECENT_MESSAGE_SQL, (chatId, ))
-        for row in cursor:
-            message = self._parseMessage(row)
-            handleName = self._getHandleName(row['handle_id'])
+        return self.getMostRecentMessages([chatId]).get(chatId)
+
+    def getMostRecentMessages(
+            self,
+            chatIds: List[int]) -> Dict[int, 'Received']:
+        """Return the most recent message of each chat that has one.
+
+        Messages are read from the chat_last_message table the migrations
+        keep, a single lookup per chat. Chats it can't answer for, such as
+        one whose latest row is a reaction to a message that isn't stored,
+        fall back to reading the chat newest first.
+        """
+        rows = []
+        # Databases the migrations haven't been run on don't have the table.
+        if self._hasTable('chat_last_message'):
+            rows = [dict(row) for row in self._executeForValues(
+                sqlcommands.CHAT_LAST_MESSAGES_SQL, chatIds)]
+        return self._parseLastMessages(rows, chatIds)
+
+    def _parseLastMessages(
+            self,
+            rows: List[Dict[str, Any]],
+            chatIds: List[int]) -> Dict[int, 'Received']:
+        """Build the most recent message of each chat in chatIds from rows
+        of message columns and a chat_id, reading any chat the rows can't
+        answer for newest first."""
+        messages = {}
+        handleNames = self._getHandleNames(
+            {row['handle_id'] for row in rows})
+        attachments = self._getAttachmentsForMessages(
+            [row['ROWID'] for row in rows
+             if not row['associated_message_guid']])
+        assocMessageIds = self._getMessageIdsForGuids(
+            {row['associated_message_guid'][-36:] for row in rows
+             if row['associated_message_guid']})
+        for row in rows:
+            chatId = row.pop('chat_id')
+            message = self._parseMessage(row, attachments, assocMessageIds)
             if message is not None:
-                message.handleName = handleName
-                return message
-        return None
+                message.handleName = handleNames.get(row['handle_id'], '')
+                messages[chatId] = message
+
+        for chatId in chatIds:
+            if chatId not in messages:
+                message = self._readMostRecentMessage(chatId)
+                if message is not None:
+                    messages[chatId] = message
+        return messages
+
+    def getChatSummaries(self) -> Tuple[List['Chat'], int]:
+        """Return every chat that has messages, with its recipients, unread
+        count and most recent message, from the chat_summary table, along
+        with the update time they are current to.
+
+        Databases without the table return no chats and a time of 0, so the
+        chat list is loaded through getChatsToUpdate instead.
+        """
+        if not self._hasTable('chat_summary'):
+            return ([], 0)
+        # Read the time first. An update applied between the two reads is
+        # then reported again by getChatsToUpdate rather than missed.
+        lastUpdateTime = self.conn.execute(
+            sqlcommands.LAST_UPDATE_TIME_SQL).fetchone()[0] or 0
+        chatColumns = ('chat_identifier', 'display_name', 'style',
+                       'service_name')
+        chats = {}
+        rows = []
+        for row in self.conn.execute(sqlcommands.CHAT_SUMMARIES_SQL):
+            row = dict(row)
+            chat = Chat(ROWID=row['chat_id'],
+                        **{column: row.pop(column) for column in chatColumns})
+            chat.addRecipients(json.loads(row.pop('recipients')))
+            chat.unreadCount = row.pop('unread_count')
+            chats[chat.chatId] = chat
+            rows.append(row)
+
+        messages = self._parseLastMessages(rows, list(chats))
+        for chatId, chat in chats.items():
+            chat.addMessage(messages.get(chatId))
+        return ([chat for chat in chats.values()
+                 if chat.getMostRecentMessage() is not None],
+                lastUpdateTime)
+
+    def getUnreadCounts(self, chatIds: List[int]) -> Dict[int, int]:
+        """Return the number of unread messages in each chat, from the
+        chat_summary table. Databases without it return no counts."""
+        if not self._hasTable('chat_summary'):
+            return {}
+        return {row['chat_id']: row['unread_count'] for row in
+                self._executeForValues(sqlcommands.UNREAD_COUNTS_SQL,
+                                       chatIds)}
+
+    def _hasTable(self, name: str) -> bool:
+        return self.conn.execute(sqlcommands.HAS_TABLE_SQL,
+                                 (name, )).fetchone() is not None
+
+    def _hasPages(self) -> bool:
+        # Databases made before chat_message_date are read whole, as one
+        # page.
+        return self._hasTable('chat_message_date')
+
+    def _readMostRecentMessage(self, chatId: int) -> Optional['Received']:
+        # Reactions to messages that aren't here are skipped by the query,
+        # so the first row always parses.
+        row = self.conn.execute(sqlcommands.RECENT_MESSAGE_SQL,
+                                (chatId, )).fetchone()
+        if row is None:
+            return None
+        message = self._parseMessage(row)
+        message.handleName = self._getHandleName(row['handle_id'])
+        return message
 
-    def _parseMessage(self, row: sqlite3.Row) -> 'Message':
+    def _parseMessage(
+            self,
+            row: sqlite3.Row,
+            attachments: Dict[int, List['Attachment']] = None,
+            assocMessageIds: Dict[str, int] = None) -> 'Message':
+        """Build a Message or Reaction from a row of the message table.
+
+        attachments and assocMessageIds are the results of
+        _getAttachmentsForMessages and _getMessageIdsForGuids for a batch of
+        rows. If they are not given, they are looked up for this row alone.
+        """
 
         message = None
         # If there are no associated messages
         if not row['associated_message_guid']:
             message = Message(**row)
-            self._getAttachments(message)
+            if attachments is None:
+                attachments = self._getAttachmentsForMessages([message.rowid])
+            count = 0
+            for attachment in attachments.get(message.rowid, []):
+                message.addAttachment(attachment, count)
+                count += 1
 
         else:
-            assocMessageId = (self.conn
-                              .execute(sqlcommands.ASSOC_MESSAGE_SQL,
-                                       (row['associated_message_guid']
-                                           [-36:], )).fetchone())
-            if assocMessageId:
-                assocMessageId = assocMessageId[0]
+            assocGuid = row['associated_message_guid'][-36:]
+            if assocMessageIds is None:
+                assocMessageIds = self._getMessageIdsForGuids([assocGuid])
+            if assocGuid in assocMessageIds:
+                assocMessageId = assocMessageIds[assocGuid]
                 ind = self._getAttachmentIndex(row['associated_message_guid'])
 
                 message = Reaction(associated_message_id=assocMessageId,
@@ -706,15 +1032,33 @@ class MessageDatabase:
             ind = 0
         return ind
 
-    def _getAttachments(self, message: 'Received') -> None:
-        cursor = self.conn.execute(
-            sqlcommands.ATTACHMENTS_SQL, (message.rowid, ))
-        count = 0
-        for row in cursor:
-            attachment = Attachment(**row)
-            if attachment is not None:
-                message.addAttachment(attachment, count)
-                count += 1
+    def _executeForValues(self, sql: str,
+                          values: List[Any]) -> Iterator[sqlite3.Row]:
+        """Run sql, which has an IN ({}) placeholder, for a list of values.
+
+        The values are split into chunks so that older versions of SQLite,
+        which only allow 999 parameters per statement, are not overrun.
+        """
+        values = list(values)
+        for i in range(0, len(values), SQL_CHUNK_SIZE):
+            chunk = values[i:i + SQL_CHUNK_SIZE]
+            placeholders = ', '.join('?' * len(chunk))
+            yield from self.conn.execute(sql.format(placeholders), chunk)
+
+    def _getAttachmentsForMessages(
+            self,
+            messageIds: List[int]) -> Dict[int, List['Attachment']]:
+        attachments = {}
+        for row in self._executeForValues(sqlcommands.MESSAGE_ATTACHMENTS_SQL,
+                                          messageIds):
+            attachment = Attachment(ROWID=row['ROWID'], guid=row['guid'],
+                                    filename=row['filename'], uti=row['uti'])
+            attachments.setdefault(row['message_id'], []).append(attachment)
+        return attachments
+
+    def _getMessageIdsForGuids(self, guids: List[str]) -> Dict[str, int]:
+        return {row['guid']: row['ROWID'] for row in
+                self._executeForValues(sqlcommands.ASSOC_MESSAGES_SQL, guids)}
 
     def _getHandleName(self, handleId: int) -> str:
         handleName = self.conn.execute(sqlcommands.HANDLE_SQL,
@@ -726,7 +1070,11 @@ class MessageDatabase:
 
         return handleName
 
-    def _getFormattedColumns(self) -> str:
+    def _getHandleNames(self, handleIds: List[int]) -> Dict[int, str]:
+        return {row['ROWID']: row['id'] for row in
+                self._executeForValues(sqlcommands.HANDLES_SQL, handleIds)}
+
+    def _getFormattedColumns(self, exclude: List[str] = ()) -> str:
         neededColumnsMessage = ['ROWID', 'guid', 'text', 'handle_id',
                                 'service', 'error', 'date', 'date_read',
                                 'date_delivered', 'is_delivered',
@@ -739,7 +1087,8 @@ class MessageDatabase:
                                 'message_update_date',
                                 'associated_message_range_location',
                                 'associated_message_range_length']
-        columns = ', '.join(neededColumnsMessage)
+        columns = ', '.join(column for column in neededColumnsMessage
+                            if column not in exclude)
         return columns
 
     def getRecipients(self, chatId: int) -> List[str]:
@@ -758,6 +1107,12 @@ class MessageDatabase:
 
         return dict(row)
 
+    def dataVersion(self) -> int:
+        """Return a number that changes whenever another connection commits
+        to the database. Reading it doesn't touch the database file."""
+        return self.conn.execute(
+            sqlcommands.DATA_VERSION_SQL).fetchone()[0]
+
     def getChatsToUpdate(self,
                          lastAccessTime: int,
                          chats: Dict[int,
@@ -766,14 +1121,20 @@ class MessageDatabase:
         if chats is None:
             chats = {}
 
-        cursor = self.conn.execute(
-            sqlcommands.CHATS_TO_UPDATE_SQL, (lastAccessTime, ))
         chatIds = []
         maxUpdate = lastAccessTime
-        for row in cursor.fetchall():
-            chatIds.append(row['chat_id'])
-            if row['max(message_update_date)'] > maxUpdate:
-                maxUpdate = row['max(message_update_date)']
+        # data_version only changes when another connection commits, so if
+        # the last call on this connection started from the time it returned
+        # and nothing has been written since, the query would find nothing.
+        poll = (self.conn, self.dataVersion(), lastAccessTime)
+        if _pollState.lastPolls.get(self.dbPath) != poll:
+            cursor = self.conn.execute(
+                sqlcommands.CHATS_TO_UPDATE_SQL, (lastAccessTime, ))
+            for row in cursor.fetchall():
+                chatIds.append(row['chat_id'])
+                if row['max(message_update_date)'] > maxUpdate:
+                    maxUpdate = row['max(message_update_date)']
+        _pollState.lastPolls[self.dbPath] = poll[:2] + (maxUpdate, )
         for _, chat in chats.items():
             if chat.localUpdate:
                 chat.localUpdate = False
@@ -811,7 +1172,8 @@ class HttpMessagePasser():
             def wrapper(*args, **kwargs):
                 try:
                     return func(*args, **kwargs)
-                except requests.exceptions.ConnectionError as e:
+                except (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout) as e:
                     return False
             return wrapper
 
@@ -821,8 +1183,7 @@ class HttpMessagePasser():
                 'chat_id': chatId,
                 'text': messageText
             }
-            r = requests.post('https://{}:3000/message'.format(ip), json=data,
-                              verify=serverCrt, cert=(clientCrt, clientKey))
+            r = session.getSession().post('/message', json=data)
             return r
 
         @connectionErrorDecorator
@@ -831,8 +1192,7 @@ class HttpMessagePasser():
                 'recipient_string': recipient_string,
                 'text': text
             }
-            r = requests.post('https://{}:3000/chat'.format(ip), json=data,
-                              verify=serverCrt, cert=(clientCrt, clientKey))
+            r = session.getSession().post('/chat', json=data)
             return r
 
         @connectionErrorDecorator
@@ -843,8 +1203,7 @@ class HttpMessagePasser():
                 'associated_guid': associated_guid,
                 'associated_type': associated_type
             }
-            r = requests.post('https://{}:3000/reaction'.format(ip), json=data,
-                              verify=serverCrt, cert=(clientCrt, clientKey))
+            r = session.getSession().post('/reaction', json=data)
             return r
 
         @connectionErrorDecorator
@@ -853,14 +1212,12 @@ class HttpMessagePasser():
                 'chat_id': chatId,
                 'group_title': group_title
             }
-            r = requests.post('https://{}:3000/rename'.format(ip), json=data,
-                              verify=serverCrt, cert=(clientCrt, clientKey))
+            r = session.getSession().post('/rename', json=data)
             return r
 
         @connectionErrorDecorator
         def ping(self) -> bool:
-            r = requests.get('https://{}:3000/ping'.format(ip),
-                             verify=serverCrt, cert=(clientCrt, clientKey))
+            r = session.getSession().get('/ping')
             return r.status_code == 200
 
     instance = None
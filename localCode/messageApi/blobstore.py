@@ -0,0 +1,189 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+from typing import Dict, Optional
+
+BLOB_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS blob (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS attachment_blob (
+    attachment_id INTEGER PRIMARY KEY,
+    guid TEXT,
+    sha256 TEXT NOT NULL REFERENCES blob (sha256)
+);
+CREATE INDEX IF NOT EXISTS attachment_blob_idx_sha256
+    ON attachment_blob(sha256);
+CREATE TRIGGER IF NOT EXISTS attachment_blob_after_insert
+    AFTER INSERT ON attachment_blob BEGIN
+    UPDATE blob SET refcount = refcount + 1 WHERE sha256 = NEW.sha256;
+END;
+CREATE TRIGGER IF NOT EXISTS attachment_blob_after_delete
+    AFTER DELETE ON attachment_blob BEGIN
+    UPDATE blob SET refcount = refcount - 1 WHERE sha256 = OLD.sha256;
+END;
+CREATE TRIGGER IF NOT EXISTS attachment_blob_after_update
+    AFTER UPDATE OF sha256 ON attachment_blob BEGIN
+    UPDATE blob SET refcount = refcount - 1 WHERE sha256 = OLD.sha256;
+    UPDATE blob SET refcount = refcount + 1 WHERE sha256 = NEW.sha256;
+END;
+"""
+
+DEFAULT_ROOT = './attachments/blobs'
+PART_SUFFIX = '.part'
+# Keep IN lists under SQLite's bound parameter limit.
+SQL_CHUNK_SIZE = 500
+
+
+def createTables(conn) -> None:
+    conn.executescript(BLOB_TABLES_SQL)
+
+
+def sha256File(path: str, blockSize: int = 64 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(blockSize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """
+    Attachment files stored once per distinct content.
+
+    Each file is named by its SHA-256 under root, fanned out by the first two
+    hex digits. The blob table records every stored file along with how many
+    attachments refer to it through attachment_blob. The refcount is kept up
+    to date by triggers, so collectGarbage only has to delete blobs whose
+    count has dropped to zero.
+    """
+
+    def __init__(self, root: str = DEFAULT_ROOT) -> None:
+        self.root = root
+
+    def blobPath(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def partPath(self, sha256: str) -> str:
+        return self.blobPath(sha256) + PART_SUFFIX
+
+    def has(self, sha256: str, size: int) -> bool:
+        path = self.blobPath(sha256)
+        return os.path.isfile(path) and os.path.getsize(path) == size
+
+    def commit(self, partPath: str, sha256: str) -> str:
+        """Move a verified file into the store and return its blob path."""
+        path = self.blobPath(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(partPath, path)
+        return path
+
+    def linkedPaths(self, conn, attachmentIds) -> Dict[int, str]:
+        """Return the blob path of each attachment that has been stored."""
+        attachmentIds = list(attachmentIds)
+        paths = {}
+        for i in range(0, len(attachmentIds), SQL_CHUNK_SIZE):
+            chunk = attachmentIds[i:i + SQL_CHUNK_SIZE]
+            rows = conn.execute(
+                'SELECT attachment_id, sha256 FROM attachment_blob '
+                'WHERE attachment_id IN ({})'.format(
+                    ', '.join('?' * len(chunk))), chunk)
+            for attachmentId, sha256 in rows:
+                paths[attachmentId] = self.blobPath(sha256)
+        return paths
+
+    def link(self, conn, attachmentId: int, guid: Optional[str],
+             sha256: str, size: int) -> str:
+        """Point an attachment at a stored blob and return the blob's path.
+
+        Must be called inside a transaction on conn.
+        """
+        path = self.blobPath(sha256)
+        conn.execute('INSERT OR IGNORE INTO blob (sha256, size) '
+                     'VALUES (?, ?)', (sha256, size))
+        conn.execute('INSERT INTO attachment_blob (attachment_id, guid, '
+                     'sha256) VALUES (?, ?, ?) ON CONFLICT (attachment_id) '
+                     'DO UPDATE SET sha256 = excluded.sha256 '
+                     'WHERE sha256 != excluded.sha256',
+                     (attachmentId, guid, sha256))
+        conn.execute('UPDATE attachment SET filename = ? WHERE ROWID = ?',
+                     (path, attachmentId))
+        return path
+
+    def collectGarbage(self, conn, dryRun: bool = False) -> Dict[str, int]:
+        """Drop links to attachments that no longer exist, then delete every
+        blob no attachment refers to. Returns how many blobs were removed
+        and how many bytes they held."""
+        try:
+            conn.execute('DELETE FROM attachment_blob WHERE attachment_id '
+                         'NOT IN (SELECT ROWID FROM attachment)')
+            unused = conn.execute('SELECT sha256, size FROM blob '
+                                  'WHERE refcount <= 0').fetchall()
+            conn.execute('DELETE FROM blob WHERE refcount <= 0')
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        if dryRun:
+            conn.rollback()
+        else:
+            conn.commit()
+
+        # Files are removed after the rows, so an interrupted collection
+        # leaves stray files behind rather than rows without files.
+        freed = 0
+        for sha256, size in unused:
+            freed += size
+            if not dryRun:
+                try:
+                    os.remove(self.blobPath(sha256))
+                except FileNotFoundError:
+                    pass
+        return {'blobs': len(unused), 'bytes': freed}
+
+    def stats(self, conn) -> Dict[str, int]:
+        """Return the bytes held by the store and the bytes it would take to
+        store every attachment separately."""
+        (blobs, stored), = conn.execute(
+            'SELECT count(*), coalesce(sum(size), 0) FROM blob')
+        (links, referenced), = conn.execute(
+            'SELECT count(*), coalesce(sum(blob.size), 0) '
+            'FROM attachment_blob JOIN blob USING (sha256)')
+        return {
+            'blobs': blobs,
+            'attachments': links,
+            'storedBytes': stored,
+            'referencedBytes': referenced,
+            'savedBytes': referenced - stored
+        }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(
+        description='Inspect or garbage collect the attachment store.')
+    parser.add_argument('command', choices=('gc', 'stats'))
+    parser.add_argument('--db', default='sms.db')
+    parser.add_argument('--root', default=DEFAULT_ROOT)
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report what gc would remove without removing it')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    createTables(conn)
+    store = BlobStore(args.root)
+    if args.command == 'gc':
+        result = store.collectGarbage(conn, dryRun=args.dry_run)
+        print('{} {} unreferenced blobs ({} bytes)'.format(
+            'Would remove' if args.dry_run else 'Removed', result['blobs'],
+            result['bytes']))
+    else:
+        for key, value in store.stats(conn).items():
+            print('{}: {}'.format(key, value))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,74 @@
+import sqlite3
+import threading
+from typing import Dict
+
+# Negative sizes are in KiB, so this is a 32 MiB page cache per connection.
+DEFAULT_CACHE_SIZE = -32 * 1024
+DEFAULT_MMAP_SIZE = 256 * 2 ** 20
+
+
+class ConnectionManager:
+    """
+    Hands out one long-lived, read-only connection to each database per
+    thread.
+
+    The GUI reads sms.db every second. Reusing a connection keeps SQLite's
+    page cache and the sqlite3 module's statement cache warm between reads,
+    where a new connection would start both from nothing. Connections can't
+    be shared between threads, so each thread gets its own. opened counts
+    the connections made, across all threads.
+    """
+
+    def __init__(self,
+                 cacheSize: int = DEFAULT_CACHE_SIZE,
+                 mmapSize: int = DEFAULT_MMAP_SIZE,
+                 queryOnly: bool = True):
+        self.cacheSize = cacheSize
+        self.mmapSize = mmapSize
+        self.queryOnly = queryOnly
+        self.opened = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _connections(self) -> Dict[str, sqlite3.Connection]:
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+        return self._local.connections
+
+    def connect(self, path: str) -> sqlite3.Connection:
+        """Return this thread's connection to path, opening it if needed."""
+        connections = self._connections()
+        conn = connections.get(path)
+        if conn is None:
+            conn = self._open(path)
+            connections[path] = conn
+        return conn
+
+    def _open(self, path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA cache_size = {:d}'.format(self.cacheSize))
+        conn.execute('PRAGMA mmap_size = {:d}'.format(self.mmapSize))
+        if self.queryOnly:
+            conn.execute('PRAGMA query_only = ON')
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    def close(self) -> None:
+        """Close this thread's connections."""
+        connections = self._connections()
+        for conn in connections.values():
+            conn.close()
+        connections.clear()
+
+
+_manager = ConnectionManager()
+
+
+def getManager() -> ConnectionManager:
+    return _manager
+
+
+def connect(path: str) -> sqlite3.Connection:
+    return _manager.connect(path)
@@ -0,0 +1,340 @@
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+import requests
+from . import blobstore
+from . import migrations
+from . import session
+
+PENDING = 'pending'
+FAILED = 'failed'
+
+DEFAULT_WORKERS = 4
+CHUNK_SIZE = 64 * 1024
+MAX_ATTEMPTS = 5
+# Seconds before the first retry, doubled after every failed attempt.
+RETRY_DELAY = 15
+# Seconds of transfers bytesPerSecond is averaged over.
+RATE_WINDOW = 5
+# Times a dropped transfer is resumed straight away before leaving it to the
+# retry backoff.
+RESUME_ATTEMPTS = 3
+
+
+class DownloadError(Exception):
+    pass
+
+
+def createTable(conn) -> None:
+    conn.execute(migrations.DOWNLOAD_TABLE_SQL)
+
+
+def _contentRangeTotal(headers) -> int:
+    match = re.search(r'/(\d+)$', headers.get('Content-Range', ''))
+    return int(match.group(1)) if match else -1
+
+
+def _fileSize(path: str) -> int:
+    return os.path.getsize(path) if os.path.isfile(path) else 0
+
+
+class AttachmentDownloader:
+    """
+    Downloads attachments into a BlobStore in the background so that a large
+    file never holds up writing the messages that reference it.
+
+    Downloads are recorded in the attachment_download table of the local
+    database as pending until the attachment is linked to a blob, so
+    unfinished downloads survive a restart. The digest of each attachment is
+    asked for first, and the body is only fetched if the store doesn't
+    already hold it, so an image forwarded to several chats is fetched once.
+
+    Bodies are streamed to a .part file in the store and only moved into
+    place once their size and checksum have been verified. An interrupted
+    transfer resumes from the end of its .part file with a Range request,
+    both straight away and on later attempts.
+
+    Only the thread that owns the database connection calls enqueue and
+    poll; workers report back through a queue that poll drains.
+    """
+
+    def __init__(self,
+                 store: Optional[blobstore.BlobStore] = None,
+                 workers: int = DEFAULT_WORKERS,
+                 chunkSize: int = CHUNK_SIZE,
+                 maxAttempts: int = MAX_ATTEMPTS,
+                 retryDelay: int = RETRY_DELAY) -> None:
+        self.store = store if store is not None else blobstore.BlobStore()
+        self.chunkSize = chunkSize
+        self.maxAttempts = maxAttempts
+        self.retryDelay = retryDelay
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='AttachmentDownloader')
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        # Submitted to the pool and not yet finished, so shutdown can cancel
+        # the ones that haven't started.
+        self.futures = set()
+        # Attachments submitted to the pool whose result poll has not seen.
+        self.inFlight = set()
+        # Held while a blob is fetched, so two attachments with the same
+        # content don't both fetch it. Each is kept with the number of
+        # downloads using it and dropped when the last one finishes.
+        self.blobLocks = {}
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.deduplicated = 0
+        self.totalBytes = 0
+        self.transfers = deque()
+
+    def enqueue(self, conn, downloads: Iterable[Tuple[int, str]]) -> None:
+        """Record each (attachment ROWID, guid) as pending and start
+        downloading it."""
+        downloads = list(downloads)
+        if not downloads:
+            return
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO attachment_download '
+                '(attachment_id, guid, status) VALUES (?, ?, ?)',
+                [(rowid, guid, PENDING) for rowid, guid in downloads])
+        for rowid, guid in downloads:
+            self._submit(rowid, guid)
+
+    def poll(self, conn) -> List[int]:
+        """Link finished downloads to their blobs and resubmit pending ones
+        that are due, including any left over from a previous run. Returns
+        the ROWIDs of the attachments linked."""
+        now = int(time.time())
+        finished = []
+        retries = []
+        while True:
+            try:
+                rowid, guid, error, blob = self.results.get_nowait()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.inFlight.discard(rowid)
+            if error is None:
+                finished.append((rowid, guid, blob))
+            else:
+                retries.append((error, now, self.retryDelay,
+                                self.maxAttempts, FAILED, rowid))
+
+        with conn:
+            for rowid, guid, (sha256, size) in finished:
+                self.store.link(conn, rowid, guid, sha256, size)
+            conn.executemany(
+                'DELETE FROM attachment_download WHERE attachment_id = ?',
+                [(rowid, ) for rowid, _, _ in finished])
+            # The delay doubles with every attempt: retryDelay << attempts.
+            conn.executemany(
+                'UPDATE attachment_download SET attempts = attempts + 1, '
+                'error = ?, next_attempt = ? + (? << attempts), '
+                'status = CASE WHEN attempts + 1 >= ? THEN ? ELSE status END '
+                'WHERE attachment_id = ?', retries)
+        due = conn.execute(
+            'SELECT attachment_id, guid FROM attachment_download '
+            'WHERE status = ? AND next_attempt <= ?', (PENDING, now))
+        for rowid, guid in due.fetchall():
+            self._submit(rowid, guid)
+        return [rowid for rowid, _, _ in finished]
+
+    def _submit(self, rowid: int, guid: str) -> None:
+        with self.lock:
+            if rowid in self.inFlight:
+                return
+            self.inFlight.add(rowid)
+            self.waiting += 1
+        future = self.executor.submit(self._run, rowid, guid)
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self._forget)
+
+    def _forget(self, future) -> None:
+        with self.lock:
+            self.futures.discard(future)
+
+    def _run(self, rowid: int, guid: str) -> None:
+        with self.lock:
+            self.waiting -= 1
+            self.active += 1
+        error = None
+        blob = None
+        # Every attempt has to post a result, or the attachment would stay
+        # in flight and never be retried.
+        try:
+            blob = self.download(rowid)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        with self.lock:
+            self.active -= 1
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+        self.results.put((rowid, guid, error, blob))
+
+    def download(self, rowid: int) -> Tuple[str, int]:
+        """Make sure the store holds an attachment's content and return its
+        (sha256, size)."""
+        expected = self._digest(rowid)
+        if expected is None:
+            # Without a digest the content is only known once it's fetched.
+            partPath = os.path.join(self.store.root, 'incoming',
+                                    '{}{}'.format(rowid,
+                                                  blobstore.PART_SUFFIX))
+            return self._fetchBlob(rowid, partPath, None)
+
+        sha256, size = expected['sha256'], expected['size']
+        with self.lock:
+            blobLock, users = self.blobLocks.get(sha256,
+                                                 (threading.Lock(), 0))
+            self.blobLocks[sha256] = (blobLock, users + 1)
+        try:
+            with blobLock:
+                if self.store.has(sha256, size):
+                    with self.lock:
+                        self.deduplicated += 1
+                    return (sha256, size)
+                return self._fetchBlob(rowid, self.store.partPath(sha256),
+                                       expected)
+        finally:
+            with self.lock:
+                blobLock, users = self.blobLocks.pop(sha256)
+                if users > 1:
+                    self.blobLocks[sha256] = (blobLock, users - 1)
+
+    def _digest(self, rowid: int) -> Optional[Dict]:
+        resp = session.getSession().get(
+            '/sent/attachment/{}/digest'.format(rowid))
+        if resp.status_code == 200:
+            return resp.json()
+        # A server without the digest endpoint is checked by size alone.
+        return None
+
+    def _fetchBlob(self, rowid: int, partPath: str,
+                   expected: Optional[Dict]) -> Tuple[str, int]:
+        os.makedirs(os.path.dirname(partPath), exist_ok=True)
+        for attempt in range(RESUME_ATTEMPTS + 1):
+            before = _fileSize(partPath)
+            try:
+                size = self._fetch(rowid, partPath)
+                break
+            except (requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ConnectionError):
+                # Only resume straight away if the dropped attempt got
+                # anywhere.
+                if attempt == RESUME_ATTEMPTS or _fileSize(partPath) <= before:
+                    raise
+        if expected is not None:
+            size = expected['size']
+        sha256 = self._verify(rowid, partPath, size, expected)
+        if self.store.has(sha256, size):
+            os.remove(partPath)
+        else:
+            self.store.commit(partPath, sha256)
+        return (sha256, size)
+
+    def _fetch(self, rowid: int, partPath: str) -> int:
+        """Fetch the rest of an attachment into partPath and return the size
+        the server reported for the whole file."""
+        offset = _fileSize(partPath)
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        resp = session.getSession().get(
+            '/sent/attachment/{}'.format(rowid), headers=headers,
+            stream=True)
+        with resp:
+            if resp.status_code == 416:
+                # Nothing left past offset: either the .part file is already
+                # complete or it is longer than the file now on the server.
+                total = _contentRangeTotal(resp.headers)
+                if total == offset:
+                    return total
+                os.remove(partPath)
+                raise DownloadError('Partial download of attachment {} is '
+                                    'longer than the file'.format(rowid))
+            if resp.status_code == 206:
+                total = _contentRangeTotal(resp.headers)
+                mode = 'ab'
+            elif resp.status_code == 200:
+                # The server ignored the range, so start again.
+                total = int(resp.headers.get('Content-Length', -1))
+                mode = 'wb'
+            else:
+                raise DownloadError('Attachment {} returned status {}'
+                                    .format(rowid, resp.status_code))
+            with open(partPath, mode) as outfile:
+                for chunk in resp.iter_content(self.chunkSize):
+                    outfile.write(chunk)
+                    self._recordBytes(len(chunk))
+        return total
+
+    def _verify(self, rowid: int, partPath: str, size: int,
+                expected: Optional[Dict]) -> str:
+        """Check a finished .part file against the expected size and digest,
+        discarding it if they don't match, and return its SHA-256."""
+        actualSize = os.path.getsize(partPath)
+        if size >= 0 and actualSize < size:
+            raise DownloadError('Attachment {} is incomplete: {} of {} bytes'
+                                .format(rowid, actualSize, size))
+        if size >= 0 and actualSize != size:
+            os.remove(partPath)
+            raise DownloadError('Attachment {} has {} bytes, expected {}'
+                                .format(rowid, actualSize, size))
+        sha256 = blobstore.sha256File(partPath, self.chunkSize)
+        if expected is not None and sha256 != expected['sha256']:
+            os.remove(partPath)
+            raise DownloadError('Attachment {} failed its checksum'
+                                .format(rowid))
+        return sha256
+
+    def _recordBytes(self, count: int) -> None:
+        now = time.monotonic()
+        with self.lock:
+            self.totalBytes += count
+            self.transfers.append((now, count))
+            self._trimTransfers(now)
+
+    def _trimTransfers(self, now: float) -> None:
+        while self.transfers and self.transfers[0][0] < now - RATE_WINDOW:
+            self.transfers.popleft()
+
+    def queueDepth(self) -> int:
+        """Return the number of downloads waiting for or using a worker."""
+        with self.lock:
+            return self.waiting + self.active
+
+    def bytesPerSecond(self) -> float:
+        now = time.monotonic()
+        with self.lock:
+            self._trimTransfers(now)
+            return sum(count for _, count in self.transfers) / RATE_WINDOW
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            stats = {
+                'queued': self.waiting,
+                'active': self.active,
+                'completed': self.completed,
+                'failed': self.failed,
+                'deduplicated': self.deduplicated,
+                'bytes': self.totalBytes
+            }
+        stats['bytesPerSecond'] = self.bytesPerSecond()
+        return stats
+
+    def shutdown(self, wait: bool = True) -> None:
+        # ThreadPoolExecutor.shutdown only takes cancel_futures from 3.9.
+        with self.lock:
+            futures = list(self.futures)
+        for future in futures:
+            future.cancel()
+        self.executor.shutdown(wait=wait)
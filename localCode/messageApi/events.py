@@ -0,0 +1,133 @@
+import queue
+import socket
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator
+import requests
+from . import session
+
+# The server sends a comment at least this often, so a read that takes much
+# longer means the connection is gone.
+READ_TIMEOUT = 20
+MAX_BACKOFF = 30
+EVENT_STREAM_TYPE = 'text/event-stream'
+
+
+class StreamRefused(Exception):
+    pass
+
+
+@dataclass
+class Event:
+
+    event: str = 'message'
+    id: str = None
+    data: str = ''
+
+
+def parseEvents(lines: Iterable[str]) -> Iterator[Event]:
+    """Turn the lines of a text/event-stream body into Events. Comments,
+    which the server sends as heartbeats, are skipped."""
+    event = Event()
+    data = []
+    for line in lines:
+        if not line:
+            if data:
+                event.data = '\n'.join(data)
+                yield event
+            event = Event()
+            data = []
+            continue
+        if line.startswith(':'):
+            continue
+        field, _, value = line.partition(':')
+        if value.startswith(' '):
+            value = value[1:]
+        if field == 'data':
+            data.append(value)
+        elif field == 'event':
+            event.event = value
+        elif field == 'id':
+            event.id = value
+
+
+class EventStream(threading.Thread):
+    """
+    Reads server-sent events from the remote machine on a background thread
+    and puts them on the events queue.
+
+    The connection is reopened with backoff whenever it drops, asking params()
+    for the query string each time so that it resumes from the caller's
+    latest cursor. If the server doesn't have the endpoint, supported is set
+    to False and the thread exits so that the caller can fall back to
+    polling.
+    """
+
+    def __init__(self, path: str, params: Callable[[], Dict],
+                 name: str = 'EventStream') -> None:
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.path = path
+        self.params = params
+        self.events = queue.Queue()
+        self.supported = True
+        self.connected = threading.Event()
+        self._stopevent = threading.Event()
+        self._response = None
+
+    def run(self) -> None:
+        backoff = 1
+        while not self._stopevent.is_set():
+            try:
+                httpSession = session.getSession()
+                self._response = httpSession.get(
+                    self.path, params=self.params(), stream=True,
+                    timeout=(httpSession.connectTimeout, READ_TIMEOUT))
+                with self._response:
+                    if self._response.status_code == 404:
+                        self.supported = False
+                        return
+                    # Anything else that isn't an event stream, such as an
+                    # error or a proxy's page, is retried like a drop.
+                    contentType = self._response.headers.get(
+                        'Content-Type', '')
+                    if (self._response.status_code != 200 or
+                            not contentType.startswith(EVENT_STREAM_TYPE)):
+                        raise StreamRefused('{} {}'.format(
+                            self._response.status_code, contentType))
+                    self.connected.set()
+                    # Event streams are always UTF-8. With no chunk size,
+                    # each chunk the server writes is read as soon as it
+                    # arrives instead of waiting for a full buffer.
+                    self._response.encoding = 'utf-8'
+                    lines = self._response.iter_lines(chunk_size=None,
+                                                      decode_unicode=True)
+                    # The backoff is only reset once an event arrives, as
+                    # a server that can't export closes each stream
+                    # straight away.
+                    for event in parseEvents(lines):
+                        backoff = 1
+                        self.events.put(event)
+            except StreamRefused as e:
+                print('Event stream refused: {}'.format(e))
+            except (requests.exceptions.RequestException, OSError):
+                pass
+            self.connected.clear()
+            if self._stopevent.wait(backoff):
+                break
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def stopThread(self) -> None:
+        self._stopevent.set()
+        response = self._response
+        if response is None:
+            return
+        # Closing the response would wait for the blocked read to finish,
+        # which can take until the next heartbeat, so shut the socket down
+        # underneath it instead.
+        connection = getattr(response.raw, 'connection', None)
+        sock = getattr(connection, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
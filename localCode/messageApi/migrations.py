@@ -0,0 +1,443 @@
+"""
+Create and version the schema of the local sms.db mirror.
+
+Each migration is a list of scripts applied in one transaction, and the
+number of migrations applied is kept in PRAGMA user_version, so opening a
+database runs only the ones it hasn't seen. Migrations are only ever appended.
+
+Usage:
+    python -m messageApi.migrations [sms.db]
+"""
+import sqlite3
+import sys
+from typing import List
+from . import blobstore
+
+# The tables and indexes of the Messages chat.db that the mirror is
+# written from, as created by INSTALL before migrations existed.
+BASE_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS _SqliteDatabaseProperties (key TEXT, value TEXT,
+    UNIQUE(key));
+CREATE TABLE IF NOT EXISTS handle (ROWID INTEGER PRIMARY KEY AUTOINCREMENT
+    UNIQUE, id TEXT NOT NULL, country TEXT, service TEXT NOT NULL,
+    uncanonicalized_id TEXT, UNIQUE (id, service) );
+CREATE TABLE IF NOT EXISTS deleted_messages (ROWID INTEGER PRIMARY KEY
+    AUTOINCREMENT UNIQUE, guid TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_message_join (chat_id INTEGER REFERENCES
+    chat (ROWID) ON DELETE CASCADE, message_id INTEGER REFERENCES message
+    (ROWID) ON DELETE CASCADE, PRIMARY KEY (chat_id, message_id));
+CREATE TABLE IF NOT EXISTS chat_handle_join (chat_id INTEGER REFERENCES
+    chat (ROWID) ON DELETE CASCADE, handle_id INTEGER REFERENCES handle
+    (ROWID) ON DELETE CASCADE, UNIQUE(chat_id, handle_id));
+CREATE TABLE IF NOT EXISTS message (ROWID INTEGER PRIMARY KEY
+    AUTOINCREMENT, guid TEXT UNIQUE NOT NULL, text TEXT, replace INTEGER
+    DEFAULT 0, service_center TEXT, handle_id INTEGER DEFAULT 0, subject
+    TEXT, country TEXT, attributedBody BLOB, version INTEGER DEFAULT 0,
+    type INTEGER DEFAULT 0, service TEXT, account TEXT, account_guid TEXT,
+    error INTEGER DEFAULT 0, date INTEGER, date_read INTEGER,
+    date_delivered INTEGER, is_delivered INTEGER DEFAULT 0, is_finished
+    INTEGER DEFAULT 0, is_emote INTEGER DEFAULT 0, is_from_me INTEGER
+    DEFAULT 0, is_empty INTEGER DEFAULT 0, is_delayed INTEGER DEFAULT 0,
+    is_auto_reply INTEGER DEFAULT 0, is_prepared INTEGER DEFAULT 0, is_read
+    INTEGER DEFAULT 0, is_system_message INTEGER DEFAULT 0, is_sent INTEGER
+    DEFAULT 0, has_dd_results INTEGER DEFAULT 0, is_service_message INTEGER
+    DEFAULT 0, is_forward INTEGER DEFAULT 0, was_downgraded INTEGER DEFAULT
+    0, is_archive INTEGER DEFAULT 0, cache_has_attachments INTEGER DEFAULT
+    0, cache_roomnames TEXT, was_data_detected INTEGER DEFAULT 0,
+    was_deduplicated INTEGER DEFAULT 0, is_audio_message INTEGER DEFAULT 0,
+    is_played INTEGER DEFAULT 0, date_played INTEGER, item_type INTEGER
+    DEFAULT 0, other_handle INTEGER DEFAULT 0, group_title TEXT,
+    group_action_type INTEGER DEFAULT 0, share_status INTEGER DEFAULT 0,
+    share_direction INTEGER DEFAULT 0, is_expirable INTEGER DEFAULT 0,
+    expire_state INTEGER DEFAULT 0, message_action_type INTEGER DEFAULT 0,
+    message_source INTEGER DEFAULT 0, associated_message_guid TEXT,
+    associated_message_type INTEGER DEFAULT 0, balloon_bundle_id TEXT,
+    payload_data BLOB, expressive_send_style_id TEXT,
+    associated_message_range_location INTEGER DEFAULT 0,
+    associated_message_range_length INTEGER DEFAULT 0,
+    time_expressive_send_played INTEGER, message_summary_info BLOB);
+CREATE TABLE IF NOT EXISTS chat (ROWID INTEGER PRIMARY KEY AUTOINCREMENT,
+    guid TEXT UNIQUE NOT NULL, style INTEGER, state INTEGER, account_id
+    TEXT, properties BLOB, chat_identifier TEXT, service_name TEXT,
+    room_name TEXT, account_login TEXT, is_archived INTEGER DEFAULT 0,
+    last_addressed_handle TEXT, display_name TEXT, group_id TEXT,
+    is_filtered INTEGER, successful_query INTEGER);
+CREATE INDEX IF NOT EXISTS message_idx_is_read ON message(is_read,
+    is_from_me, is_finished);
+CREATE INDEX IF NOT EXISTS message_idx_date ON message(date);
+CREATE INDEX IF NOT EXISTS chat_idx_chat_identifier_service_name ON
+    chat(chat_identifier, service_name);
+CREATE INDEX IF NOT EXISTS chat_idx_chat_identifier ON chat(chat_identifier);
+CREATE INDEX IF NOT EXISTS message_idx_failed ON message(is_finished,
+    is_from_me, error);
+CREATE INDEX IF NOT EXISTS message_idx_was_downgraded ON
+    message(was_downgraded);
+CREATE INDEX IF NOT EXISTS chat_idx_chat_room_name_service_name ON
+    chat(room_name, service_name);
+CREATE INDEX IF NOT EXISTS chat_message_join_idx_message_id ON
+    chat_message_join(message_id, chat_id);
+CREATE INDEX IF NOT EXISTS chat_handle_join_idx_handle_id ON
+    chat_handle_join(handle_id);
+CREATE INDEX IF NOT EXISTS message_idx_handle ON message(handle_id, date);
+CREATE INDEX IF NOT EXISTS message_idx_handle_id ON message(handle_id);
+CREATE INDEX IF NOT EXISTS chat_message_join_idx_chat_id ON
+    chat_message_join(chat_id);
+CREATE INDEX IF NOT EXISTS message_idx_other_handle ON message(other_handle);
+CREATE INDEX IF NOT EXISTS message_idx_expire_state ON message(expire_state);
+CREATE INDEX IF NOT EXISTS chat_message_join_idx_message_id_only ON
+    chat_message_join(message_id);
+CREATE INDEX IF NOT EXISTS message_idx_associated_message ON
+    message(associated_message_guid);
+CREATE INDEX IF NOT EXISTS chat_idx_is_archived ON chat(is_archived);
+CREATE TRIGGER IF NOT EXISTS after_delete_on_chat AFTER DELETE ON chat
+    BEGIN DELETE FROM chat_message_join WHERE chat_id = OLD.ROWID; END;
+CREATE TRIGGER IF NOT EXISTS
+    delete_associated_messages_after_delete_on_message AFTER DELETE ON
+    message BEGIN DELETE FROM message WHERE (OLD.associated_message_guid IS
+    NULL AND associated_message_guid IS NOT NULL AND guid =
+    OLD.associated_message_guid); END;
+CREATE TRIGGER IF NOT EXISTS add_to_deleted_messages AFTER DELETE ON
+    message BEGIN INSERT INTO deleted_messages (guid) VALUES (OLD.guid);
+    END;
+CREATE TRIGGER IF NOT EXISTS after_delete_on_chat_message_join AFTER DELETE
+    ON chat_message_join BEGIN UPDATE message SET cache_roomnames = (SELECT
+    group_concat(c.room_name) FROM chat c INNER JOIN chat_message_join j ON
+    c.ROWID = j.chat_id WHERE j.message_id = OLD.message_id) WHERE
+    message.ROWID = OLD.message_id; DELETE FROM message WHERE message.ROWID
+    = OLD.message_id AND OLD.message_id NOT IN (SELECT
+    chat_message_join.message_id from chat_message_join WHERE
+    chat_message_join.message_id = OLD.message_id LIMIT 1); END;
+CREATE TRIGGER IF NOT EXISTS after_delete_on_chat_handle_join AFTER DELETE
+    ON chat_handle_join BEGIN DELETE FROM handle WHERE handle.ROWID =
+    OLD.handle_id AND (SELECT 1 from chat_handle_join WHERE handle_id =
+    OLD.handle_id LIMIT 1) IS NULL AND (SELECT 1 from message WHERE
+    handle_id = OLD.handle_id LIMIT 1) IS NULL AND (SELECT 1 from message
+    WHERE other_handle = OLD.handle_id LIMIT 1) IS NULL; END;
+CREATE TRIGGER IF NOT EXISTS after_delete_on_message AFTER DELETE ON
+    message BEGIN DELETE FROM handle WHERE handle.ROWID = OLD.handle_id AND
+    (SELECT 1 from chat_handle_join WHERE handle_id = OLD.handle_id LIMIT
+    1) IS NULL AND (SELECT 1 from message WHERE handle_id = OLD.handle_id
+    LIMIT 1) IS NULL AND (SELECT 1 from message WHERE other_handle =
+    OLD.handle_id LIMIT 1) IS NULL; END;
+CREATE TRIGGER IF NOT EXISTS after_insert_on_chat_message_join AFTER INSERT
+    ON chat_message_join BEGIN UPDATE message SET cache_roomnames = (SELECT
+    group_concat(c.room_name) FROM chat c INNER JOIN chat_message_join j ON
+    c.ROWID = j.chat_id WHERE j.message_id = NEW.message_id) WHERE
+    message.ROWID = NEW.message_id; END;
+CREATE TABLE IF NOT EXISTS attachment (ROWID INTEGER PRIMARY KEY
+    AUTOINCREMENT, guid TEXT UNIQUE NOT NULL, created_date INTEGER DEFAULT
+    0, start_date INTEGER DEFAULT 0, filename TEXT, uti TEXT, mime_type
+    TEXT, transfer_state INTEGER DEFAULT 0, is_outgoing INTEGER DEFAULT 0,
+    user_info BLOB, transfer_name TEXT, total_bytes INTEGER DEFAULT 0,
+    is_sticker INTEGER DEFAULT 0, sticker_user_info BLOB, attribution_info
+    BLOB, hide_attachment INTEGER DEFAULT 0);
+CREATE TRIGGER IF NOT EXISTS before_delete_on_attachment BEFORE DELETE ON
+    attachment BEGIN SELECT before_delete_attachment_path(OLD.ROWID,
+    OLD.guid); END;
+CREATE TRIGGER IF NOT EXISTS after_delete_on_attachment AFTER DELETE ON
+    attachment BEGIN SELECT delete_attachment_path(OLD.filename); END;
+CREATE TABLE IF NOT EXISTS message_attachment_join (message_id INTEGER
+    REFERENCES message (ROWID) ON DELETE CASCADE, attachment_id INTEGER
+    REFERENCES attachment (ROWID) ON DELETE CASCADE, UNIQUE(message_id,
+    attachment_id));
+CREATE INDEX IF NOT EXISTS message_attachment_join_idx_message_id ON
+    message_attachment_join(message_id);
+CREATE INDEX IF NOT EXISTS message_attachment_join_idx_attachment_id ON
+    message_attachment_join(attachment_id);
+CREATE TRIGGER IF NOT EXISTS after_delete_on_message_attachment_join AFTER
+    DELETE ON message_attachment_join BEGIN DELETE FROM attachment WHERE
+    attachment.ROWID = OLD.attachment_id AND (SELECT 1 from
+    message_attachment_join WHERE attachment_id = OLD.attachment_id LIMIT
+    1) IS NULL; END;
+CREATE TRIGGER IF NOT EXISTS after_insert_on_message_attachment_join AFTER
+    INSERT ON message_attachment_join BEGIN UPDATE message SET
+    cache_has_attachments = 1 WHERE message.ROWID = NEW.message_id; END;
+CREATE TABLE IF NOT EXISTS message_update_date_join (message_id INTEGER
+    REFERENCES message (ROWID) ON DELETE CASCADE, message_update_date
+    INTEGER DEFAULT 0, PRIMARY KEY (message_id, message_update_date));
+CREATE TRIGGER IF NOT EXISTS insert_last_update_date AFTER INSERT ON
+    message BEGIN INSERT INTO message_update_date_join (message_id,
+    message_update_date) VALUES ( NEW.ROWID, strftime('%s','now') ); END;
+CREATE TRIGGER IF NOT EXISTS update_last_update_date AFTER UPDATE ON
+    message BEGIN UPDATE message_update_date_join SET message_update_date =
+    strftime('%s','now') WHERE message_id = OLD.ROWID; END;
+"""
+
+SYNC_STATE_SQL = """
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+)
+"""
+
+# The attachments downloader.py still has to fetch, kept here so that
+# migrating doesn't import the downloader and its HTTP session.
+DOWNLOAD_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS attachment_download (
+    attachment_id INTEGER PRIMARY KEY,
+    guid TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0,
+    next_attempt INTEGER DEFAULT 0,
+    error TEXT
+)
+"""
+
+# Indexes for the queries in sqlcommands.py. The chat.db indexes in
+# BASE_SCHEMA_SQL cover lookups by chat_id, guid and message_id; the
+# update date index lets CHATS_TO_UPDATE_SQL and LOAD_MESSAGES_SQL start
+# from the messages changed since the last load rather than every join row.
+QUERY_INDEXES_SQL = """
+CREATE INDEX IF NOT EXISTS message_update_date_join_idx_message_update_date
+    ON message_update_date_join(message_update_date, message_id);
+"""
+
+# The latest message of each chat, by date then ROWID, kept up to date as
+# updates are applied so the chat list doesn't sort a chat's history to
+# find it. Messages and their chat_message_join rows can arrive in either
+# order, so both insert triggers offer the message to its chats.
+CHAT_LAST_MESSAGE_SQL = """
+CREATE TABLE IF NOT EXISTS chat_last_message (
+    chat_id INTEGER PRIMARY KEY,
+    message_id INTEGER NOT NULL,
+    date INTEGER
+);
+CREATE INDEX IF NOT EXISTS chat_last_message_idx_message_id
+    ON chat_last_message(message_id);
+CREATE TRIGGER IF NOT EXISTS chat_last_message_after_insert_on_message
+    AFTER INSERT ON message BEGIN
+    DELETE FROM chat_last_message
+        WHERE chat_id IN (SELECT chat_id FROM chat_message_join
+                          WHERE message_id = NEW.ROWID)
+        AND (date, message_id) <= (NEW.date, NEW.ROWID);
+    INSERT INTO chat_last_message (chat_id, message_id, date)
+        SELECT chat_id, NEW.ROWID, NEW.date FROM chat_message_join AS CMJ
+        WHERE message_id = NEW.ROWID AND NOT EXISTS (
+            SELECT 1 FROM chat_last_message WHERE chat_id = CMJ.chat_id);
+END;
+CREATE TRIGGER IF NOT EXISTS chat_last_message_after_update_on_message
+    AFTER UPDATE OF date ON message BEGIN
+    DELETE FROM chat_last_message
+        WHERE chat_id IN (SELECT chat_id FROM chat_message_join
+                          WHERE message_id = NEW.ROWID)
+        AND (message_id = NEW.ROWID
+             OR (date, message_id) <= (NEW.date, NEW.ROWID));
+    INSERT INTO chat_last_message (chat_id, message_id, date)
+        SELECT chat_id, ROWID, date FROM (
+            SELECT CMJ.chat_id, message.ROWID, message.date,
+                   row_number() OVER (PARTITION BY CMJ.chat_id
+                                      ORDER BY message.date DESC,
+                                               message.ROWID DESC) AS rank
+            FROM chat_message_join AS CMJ
+                INNER JOIN message ON message.ROWID = CMJ.message_id
+            WHERE CMJ.chat_id IN (SELECT chat_id FROM chat_message_join
+                                  WHERE message_id = NEW.ROWID)) AS latest
+        WHERE rank = 1 AND NOT EXISTS (
+            SELECT 1 FROM chat_last_message WHERE chat_id = latest.chat_id);
+END;
+CREATE TRIGGER IF NOT EXISTS chat_last_message_after_insert_on_cmj
+    AFTER INSERT ON chat_message_join BEGIN
+    DELETE FROM chat_last_message
+        WHERE chat_id = NEW.chat_id
+        AND (date, message_id) <= (SELECT date, ROWID FROM message
+                                   WHERE ROWID = NEW.message_id);
+    INSERT INTO chat_last_message (chat_id, message_id, date)
+        SELECT NEW.chat_id, ROWID, date FROM message
+        WHERE ROWID = NEW.message_id AND NOT EXISTS (
+            SELECT 1 FROM chat_last_message WHERE chat_id = NEW.chat_id);
+END;
+CREATE TRIGGER IF NOT EXISTS chat_last_message_after_delete_on_message
+    AFTER DELETE ON message BEGIN
+    DELETE FROM chat_last_message WHERE message_id = OLD.ROWID;
+    INSERT INTO chat_last_message (chat_id, message_id, date)
+        SELECT chat_id, ROWID, date FROM (
+            SELECT CMJ.chat_id, message.ROWID, message.date,
+                   row_number() OVER (PARTITION BY CMJ.chat_id
+                                      ORDER BY message.date DESC,
+                                               message.ROWID DESC) AS rank
+            FROM chat_message_join AS CMJ
+                INNER JOIN message ON message.ROWID = CMJ.message_id
+            WHERE CMJ.chat_id IN (SELECT chat_id FROM chat_message_join
+                                  WHERE message_id = OLD.ROWID)) AS latest
+        WHERE rank = 1 AND NOT EXISTS (
+            SELECT 1 FROM chat_last_message WHERE chat_id = latest.chat_id);
+END;
+CREATE TRIGGER IF NOT EXISTS chat_last_message_after_delete_on_cmj
+    AFTER DELETE ON chat_message_join BEGIN
+    DELETE FROM chat_last_message
+        WHERE chat_id = OLD.chat_id AND message_id = OLD.message_id;
+    INSERT INTO chat_last_message (chat_id, message_id, date)
+        SELECT OLD.chat_id, message.ROWID, message.date
+        FROM chat_message_join AS CMJ
+            INNER JOIN message ON message.ROWID = CMJ.message_id
+        WHERE CMJ.chat_id = OLD.chat_id AND NOT EXISTS (
+            SELECT 1 FROM chat_last_message WHERE chat_id = OLD.chat_id)
+        ORDER BY message.date DESC, message.ROWID DESC
+        LIMIT 1;
+END;
+INSERT OR REPLACE INTO chat_last_message (chat_id, message_id, date)
+    SELECT chat_id, ROWID, date FROM (
+        SELECT CMJ.chat_id, message.ROWID, message.date,
+               row_number() OVER (PARTITION BY CMJ.chat_id
+                                  ORDER BY message.date DESC,
+                                           message.ROWID DESC) AS rank
+        FROM chat_message_join AS CMJ
+            INNER JOIN message ON message.ROWID = CMJ.message_id)
+    WHERE rank = 1;
+"""
+
+# What the chat list shows for each chat, so it can be painted from one
+# query at startup. updater rewrites the rows of the chats an update touches
+# with SUMMARIZE_CHATS_SQL, in the transaction that applies it. recipients
+# is a JSON array of handle ids.
+CHAT_SUMMARY_SQL = """
+CREATE TABLE IF NOT EXISTS chat_summary (
+    chat_id INTEGER PRIMARY KEY,
+    chat_identifier TEXT,
+    display_name TEXT,
+    style INTEGER,
+    service_name TEXT,
+    recipients TEXT NOT NULL DEFAULT '[]',
+    last_message_id INTEGER,
+    last_date INTEGER,
+    unread_count INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+# Takes a WHERE clause on chat, or an empty string for every chat.
+SUMMARIZE_CHATS_SQL = """
+INSERT OR REPLACE INTO chat_summary (chat_id, chat_identifier, display_name,
+                                     style, service_name, recipients,
+                                     last_message_id, last_date, unread_count)
+SELECT chat.ROWID, chat.chat_identifier, chat.display_name, chat.style,
+       chat.service_name,
+       (SELECT json_group_array(id) FROM (
+            SELECT H.id FROM chat_handle_join AS CHJ
+                INNER JOIN handle AS H ON H.ROWID = CHJ.handle_id
+            WHERE CHJ.chat_id = chat.ROWID
+            ORDER BY CHJ.handle_id)),
+       CLM.message_id, CLM.date,
+       (SELECT count(*) FROM message
+            INNER JOIN chat_message_join AS CMJ
+                ON CMJ.message_id = message.ROWID
+                AND CMJ.chat_id = chat.ROWID
+            WHERE message.is_read = 0 AND message.is_from_me = 0)
+FROM chat
+    LEFT JOIN chat_last_message AS CLM
+        ON CLM.chat_id = chat.ROWID
+{}
+"""
+
+# chat_message_join with each message's date, like the message_date column
+# chat.db has and the exported rows don't, so a chat's messages can be read
+# a page at a time in date order straight from the index. REPLACE doesn't
+# fire delete triggers, so the insert triggers clear any stale row first.
+CHAT_MESSAGE_DATE_SQL = """
+CREATE TABLE IF NOT EXISTS chat_message_date (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    message_date INTEGER,
+    PRIMARY KEY (chat_id, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS chat_message_date_idx_chat_id_message_date
+    ON chat_message_date(chat_id, message_date);
+CREATE INDEX IF NOT EXISTS chat_message_date_idx_message_id
+    ON chat_message_date(message_id);
+CREATE TRIGGER IF NOT EXISTS chat_message_date_after_insert_on_message
+    AFTER INSERT ON message BEGIN
+    DELETE FROM chat_message_date WHERE message_id = NEW.ROWID;
+    INSERT INTO chat_message_date (chat_id, message_id, message_date)
+        SELECT chat_id, NEW.ROWID, NEW.date FROM chat_message_join
+        WHERE message_id = NEW.ROWID;
+END;
+CREATE TRIGGER IF NOT EXISTS chat_message_date_after_update_on_message
+    AFTER UPDATE OF date ON message BEGIN
+    UPDATE chat_message_date SET message_date = NEW.date
+        WHERE message_id = NEW.ROWID;
+END;
+CREATE TRIGGER IF NOT EXISTS chat_message_date_after_insert_on_cmj
+    AFTER INSERT ON chat_message_join BEGIN
+    DELETE FROM chat_message_date
+        WHERE chat_id = NEW.chat_id AND message_id = NEW.message_id;
+    INSERT INTO chat_message_date (chat_id, message_id, message_date)
+        SELECT NEW.chat_id, ROWID, date FROM message
+        WHERE ROWID = NEW.message_id;
+END;
+CREATE TRIGGER IF NOT EXISTS chat_message_date_after_delete_on_message
+    AFTER DELETE ON message BEGIN
+    DELETE FROM chat_message_date WHERE message_id = OLD.ROWID;
+END;
+CREATE TRIGGER IF NOT EXISTS chat_message_date_after_delete_on_cmj
+    AFTER DELETE ON chat_message_join BEGIN
+    DELETE FROM chat_message_date
+        WHERE chat_id = OLD.chat_id AND message_id = OLD.message_id;
+END;
+INSERT OR REPLACE INTO chat_message_date (chat_id, message_id, message_date)
+    SELECT CMJ.chat_id, message.ROWID, message.date
+    FROM chat_message_join AS CMJ
+        INNER JOIN message ON message.ROWID = CMJ.message_id;
+"""
+
+# Version n of the schema is reached by running the scripts of MIGRATIONS[n-1].
+MIGRATIONS = [
+    [BASE_SCHEMA_SQL],
+    # Tables of the mirror's own: the sync cursor, attachment downloads and
+    # the content addressed attachment store.
+    [SYNC_STATE_SQL, DOWNLOAD_TABLE_SQL, blobstore.BLOB_TABLES_SQL],
+    [QUERY_INDEXES_SQL],
+    [CHAT_LAST_MESSAGE_SQL],
+    [CHAT_SUMMARY_SQL, SUMMARIZE_CHATS_SQL.format('')],
+    [CHAT_MESSAGE_DATE_SQL],
+]
+
+# The triggers use row_number() OVER (3.25) and row values (3.15), and
+# blobstore.link an upsert (3.24).
+MIN_SQLITE_VERSION = (3, 25, 0)
+
+
+def currentVersion(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def checkSqliteVersion() -> None:
+    """Raise NotSupportedError if the SQLite Python is linked against is too
+    old for the schema."""
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        raise sqlite3.NotSupportedError(
+            'SQLite {} is too old for the sms.db schema, which needs {} or '
+            'newer'.format(sqlite3.sqlite_version,
+                           '.'.join(map(str, MIN_SQLITE_VERSION))))
+
+
+def migrate(conn: sqlite3.Connection) -> List[int]:
+    """Apply every migration the database hasn't seen, oldest first, and
+    return the versions applied."""
+    checkSqliteVersion()
+    applied = []
+    for version in range(currentVersion(conn) + 1, len(MIGRATIONS) + 1):
+        # user_version can't be bound as a parameter, but version is an int.
+        script = 'BEGIN;\n{};\nPRAGMA user_version = {:d};\nCOMMIT;'.format(
+            ';\n'.join(MIGRATIONS[version - 1]), version)
+        try:
+            conn.executescript(script)
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def main(path: str = 'sms.db') -> None:
+    conn = sqlite3.connect(path)
+    try:
+        applied = migrate(conn)
+    finally:
+        conn.close()
+    if applied:
+        print('Migrated {} to version {}'.format(path, applied[-1]))
+    else:
+        print('{} is up to date'.format(path))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
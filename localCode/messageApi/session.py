@@ -0,0 +1,114 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Any, Dict, Optional
+
+DEFAULT_PORT = 3000
+DEFAULT_POOL_SIZE = 4
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (5, 30)
+DEFAULT_RETRIES = 2
+
+
+class HttpSession:
+    """
+    A keep-alive HTTPS session to the remote machine.
+
+    Connections are pooled and reused, so only the first request on a
+    connection pays for the TCP and mutual TLS handshake. Failed connection
+    attempts are retried with backoff. Reads are only retried for idempotent
+    methods so that a message is never posted twice.
+    """
+
+    def __init__(self,
+                 ip: str,
+                 serverCrt: str,
+                 clientCrt: str,
+                 clientKey: str,
+                 port: int = DEFAULT_PORT,
+                 poolSize: int = DEFAULT_POOL_SIZE,
+                 timeout: Any = DEFAULT_TIMEOUT,
+                 retries: int = DEFAULT_RETRIES) -> None:
+        self.baseUrl = 'https://{}:{}'.format(ip, port)
+        # A single number or a (connect, read) pair, as requests expects.
+        self.timeout = (timeout if isinstance(timeout, (int, float))
+                        else tuple(timeout))
+
+        retry = Retry(total=retries, connect=retries, read=retries,
+                      status=retries, status_forcelist=(502, 503, 504),
+                      backoff_factor=0.2, raise_on_status=False)
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize,
+                                   max_retries=retry)
+        self.serverCrt = serverCrt
+        self.session = requests.Session()
+        self.session.cert = (clientCrt, clientKey)
+        self.session.mount('https://', self.adapter)
+
+    @property
+    def connectTimeout(self) -> float:
+        if isinstance(self.timeout, tuple):
+            return self.timeout[0]
+        return self.timeout
+
+    def request(self, method: str, path: str,
+                **kwargs: Any) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        # Passed per request since REQUESTS_CA_BUNDLE takes precedence over
+        # Session.verify.
+        kwargs.setdefault('verify', self.serverCrt)
+        return self.session.request(method, self.baseUrl + path, **kwargs)
+
+    def get(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request('POST', path, **kwargs)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of requests sent, connections opened (each one
+        a full TLS handshake) and requests that reused an open connection."""
+        requestCount = 0
+        connectionCount = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            requestCount += pool.num_requests
+            connectionCount += pool.num_connections
+        return {
+            'requests': requestCount,
+            'connections': connectionCount,
+            'reused': requestCount - connectionCount
+        }
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_session = None
+_sessionLock = threading.Lock()
+
+
+def initialize(secrets: Dict[str, Any]) -> HttpSession:
+    """Create the session shared by the message passer and the updater.
+
+    Port, pool size, timeout and retry count can be set with the optional
+    port, poolSize, timeout and retries keys of secrets.json. Only the first
+    call creates a session; later calls return the existing one.
+    """
+    global _session
+
+    with _sessionLock:
+        if _session is None:
+            _session = HttpSession(
+                secrets['ip'], secrets['serverCrt'], secrets['clientCrt'],
+                secrets['clientKey'],
+                port=secrets.get('port', DEFAULT_PORT),
+                poolSize=secrets.get('poolSize', DEFAULT_POOL_SIZE),
+                timeout=secrets.get('timeout', DEFAULT_TIMEOUT),
+                retries=secrets.get('retries', DEFAULT_RETRIES))
+    return _session
+
+
+def getSession() -> Optional[HttpSession]:
+    return _session
@@ -14,23 +14,59 @@ FROM message
         ON message.ROWID = message_update_date_join.message_id
         AND message_update_date_join.message_update_date > ?"""
 
+# Takes the column list. The newest messages of a chat older than a
+# (date, ROWID) key, newest first.
+LOAD_MESSAGES_BEFORE_SQL = """SELECT {}
+FROM chat_message_date AS CMD
+    INNER JOIN message
+        ON message.ROWID = CMD.message_id
+    WHERE CMD.chat_id = ?
+        AND (CMD.message_date, CMD.message_id) < (?, ?)
+    ORDER BY CMD.message_date DESC, CMD.message_id DESC
+    LIMIT ?"""
+
+# Takes the column list. The newest messages of a chat, newest first.
+LOAD_LATEST_MESSAGES_SQL = """SELECT {}
+FROM chat_message_date AS CMD
+    INNER JOIN message
+        ON message.ROWID = CMD.message_id
+    WHERE CMD.chat_id = ?
+    ORDER BY CMD.message_date DESC, CMD.message_id DESC
+    LIMIT ?"""
+
+# Takes the column list. The messages of a chat updated since a time, from a
+# (date, ROWID) key on. Like CHATS_TO_UPDATE_SQL, it starts from the
+# messages updated since then rather than every message of the chat.
+LOAD_MESSAGES_SINCE_SQL = """SELECT {}
+FROM message_update_date_join AS MUDJ
+    CROSS JOIN chat_message_date AS CMD
+        ON CMD.chat_id = ?
+        AND CMD.message_id = MUDJ.message_id
+    INNER JOIN message
+        ON message.ROWID = MUDJ.message_id
+    WHERE MUDJ.message_update_date > ?
+        AND (CMD.message_date, CMD.message_id) >= (?, ?)"""
+
 HANDLE_SQL = """SELECT id
 FROM handle
     WHERE ROWID = ?"""
 
-ATTACHMENTS_SQL = """SELECT ROWID, guid, filename, uti
-FROM message_attachment_join
-    INNER JOIN attachment
-        ON attachment.ROWID = attachment_id
-    WHERE message_id = ?"""
+HANDLES_SQL = """SELECT ROWID, id
+FROM handle
+    WHERE ROWID IN ({})"""
 
-ATTACHMENT_SQL = """SELECT ROWID, guid, filename, uti
-FROM attachment
-    WHERE ROWID = ?"""
+MESSAGE_ATTACHMENTS_SQL = """SELECT MAJ.message_id, attachment.ROWID,
+                             attachment.guid, attachment.filename,
+                             attachment.uti
+FROM message_attachment_join AS MAJ
+    INNER JOIN attachment
+        ON attachment.ROWID = MAJ.attachment_id
+    WHERE MAJ.message_id IN ({})
+    ORDER BY MAJ.message_id, MAJ.rowid"""
 
-ASSOC_MESSAGE_SQL = """SELECT ROWID
+ASSOC_MESSAGES_SQL = """SELECT ROWID, guid
 FROM message
-    WHERE guid = ?"""
+    WHERE guid IN ({})"""
 
 RECENT_MESSAGE_SQL = """SELECT ROWID, guid, handle_id, text, date, is_from_me,
                         associated_message_guid, associated_message_type,
@@ -39,9 +75,42 @@ FROM message
     INNER JOIN chat_message_join AS CMJ
         ON message.ROWID = CMJ.message_id
         AND CMJ.chat_id = ?
-    LEFT JOIN message_attachment_join
-        ON message.ROWID = message_attachment_join.message_id
-    ORDER BY date DESC, ROWID DESC"""
+    WHERE IFNULL(associated_message_guid, '') = ''
+        OR substr(associated_message_guid, -36) IN (SELECT guid FROM message)
+    ORDER BY date DESC, ROWID DESC
+    LIMIT 1"""
+
+CHAT_LAST_MESSAGES_SQL = """SELECT CLM.chat_id, ROWID, guid, handle_id, text,
+                            message.date, is_from_me, associated_message_guid,
+                            associated_message_type, is_delivered, item_type,
+                            group_title
+FROM chat_last_message AS CLM
+    INNER JOIN message
+        ON message.ROWID = CLM.message_id
+    WHERE CLM.chat_id IN ({})"""
+
+CHAT_SUMMARIES_SQL = """SELECT CS.chat_id, CS.chat_identifier, CS.display_name,
+                        CS.style, CS.service_name, CS.recipients,
+                        CS.unread_count, ROWID, guid, handle_id, text,
+                        message.date, is_from_me, associated_message_guid,
+                        associated_message_type, is_delivered, item_type,
+                        group_title
+FROM chat_summary AS CS
+    INNER JOIN message
+        ON message.ROWID = CS.last_message_id"""
+
+UNREAD_COUNTS_SQL = """SELECT chat_id, unread_count
+FROM chat_summary
+    WHERE chat_id IN ({})"""
+
+LAST_UPDATE_TIME_SQL = """SELECT max(message_update_date)
+FROM message_update_date_join"""
+
+DATA_VERSION_SQL = """PRAGMA data_version"""
+
+HAS_TABLE_SQL = """SELECT 1
+FROM sqlite_master
+    WHERE type = 'table' AND name = ?"""
 
 LOAD_CHAT_SQL = """SELECT ROWID, chat_identifier, display_name, style,
                    service_name
@@ -51,11 +120,14 @@ FROM chat
 LOAD_CHATS_SQL = """SELECT ROWID, chat_identifier, display_name, style
 FROM chat"""
 
+# CROSS JOIN keeps MUDJ first, so only the messages updated since the last
+# check are read. Without table statistics SQLite would rather walk every row
+# of chat_message_join.
 CHATS_TO_UPDATE_SQL = """SELECT chat_id, max(message_update_date), text
-FROM message
-    INNER JOIN chat_message_join as CMJ
-        ON message.ROWID = CMJ.message_id
-    INNER JOIN message_update_date_join as MUDJ
+FROM message_update_date_join AS MUDJ
+    CROSS JOIN chat_message_join AS CMJ
+        ON MUDJ.message_id = CMJ.message_id
+    INNER JOIN message
         ON message.ROWID = MUDJ.message_id
-        AND MUDJ.message_update_date > ?
+    WHERE MUDJ.message_update_date > ?
     GROUP BY chat_id"""
@@ -1,5 +1,6 @@
 import tkinter as tk
 from tkinter import ttk
+import collections
 import os
 import threading
 import json
@@ -7,10 +8,27 @@ from datetime import datetime, timedelta
 
 from PIL import Image, ImageTk
 from verticalscrolledframe import VerticalScrolledFrame
+import thumbnails
 from constants import LINUX, MACOS
 
 dirname = os.path.dirname(__file__)
 
+# The number of messages read when a chat is first opened, and when
+# scrolling reaches the top of it.
+FIRST_PAGE_SIZE = 40
+PAGE_SIZE = 20
+# Sort before and after the (date, ROWID) key of every message.
+FIRST_KEY = (float('-inf'), 0)
+LAST_KEY = (float('inf'), 0)
+# The most chat views kept, and the most memory they are estimated to take,
+# before the least recently shown is destroyed.
+MAX_CACHED_VIEWS = 8
+MAX_CACHED_BYTES = 64 * 2 ** 20
+# A rough size of the Tk widgets that make up one bubble or header.
+PART_SIZE = 16 * 2 ** 10
+# Shown where an image will be until it has been decoded.
+PLACEHOLDER_COLOR = 'gray85'
+
 
 def getTimeText(timeStamp):
     currentTime = datetime.now(tz=datetime.now().astimezone().tzinfo)
@@ -25,12 +43,77 @@ def getTimeText(timeStamp):
     return timeText
 
 
+class ViewCache:
+    """
+    Keeps the views of recently shown chats by chatId, so that switching back
+    to a chat raises its view instead of rebuilding its widgets.
+
+    When there are more than maxViews views, or their estimateSize() adds up
+    to more than maxBytes, the least recently used are destroyed. The view
+    just put is never evicted, since it is the one being shown. Only that
+    view can have changed since it was last put, so the others' sizes are
+    kept rather than estimated again.
+    """
+
+    def __init__(self, maxViews=MAX_CACHED_VIEWS, maxBytes=MAX_CACHED_BYTES):
+        self.maxViews = maxViews
+        self.maxBytes = maxBytes
+        self.views = collections.OrderedDict()
+        self.sizes = {}
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evictedBytes = 0
+
+    def get(self, chatId):
+        view = self.views.get(chatId)
+        if view is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return view
+
+    def put(self, chatId, view):
+        """Add or refresh a view as the most recently used, then evict."""
+        self.views[chatId] = view
+        self.views.move_to_end(chatId)
+        size = view.estimateSize()
+        self.total += size - self.sizes.get(chatId, 0)
+        self.sizes[chatId] = size
+        for key in list(self.views):
+            if (len(self.views) <= self.maxViews and
+                    self.total <= self.maxBytes):
+                break
+            if key == chatId:
+                continue
+            self.views.pop(key).destroy()
+            size = self.sizes.pop(key)
+            self.total -= size
+            self.evictions += 1
+            self.evictedBytes += size
+
+    def remove(self, chatId):
+        view = self.views.pop(chatId, None)
+        if view is not None:
+            self.total -= self.sizes.pop(chatId)
+            view.destroy()
+
+    def stats(self):
+        return {'views': len(self.views), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'evictedBytes': self.evictedBytes}
+
+
 # The part of the right half where messages are displayed
 class MessageFrame(VerticalScrolledFrame):
 
     def __init__(self, parent, minHeight, minWidth, mp, messageDatabase):
         VerticalScrolledFrame.__init__(self, parent, minHeight, minWidth)
         self.messageBubbles = {}
+        self.timeLabels = {}
+        # The oldest message shown. Older pages are added above it.
+        self.firstMessageId = None
         self.canvas.bind('<Configure>', self._configure_messages_canvas)
         self.lock = threading.Lock()
         self.canvas.configure(yscrollcommand=self.checkScroll)
@@ -45,6 +128,10 @@ class MessageFrame(VerticalScrolledFrame):
         self.messageDatabase = messageDatabase
         self.reactionWindow = None
         self._currentChat = None
+        # Every kept view shares one grid cell, so a hidden one still gets
+        # <Configure>. Its bubbles are resized when it is shown instead.
+        self.hidden = False
+        self.pendingResize = None
 
     @property
     def currentChat(self):
@@ -54,41 +141,86 @@ class MessageFrame(VerticalScrolledFrame):
     def currentChat(self, chat: 'api.Chat'):
         self._currentChat = chat
 
-    # This probably has some nasty race conditions.
-    # This also has unfortunate recursion issues that should be fixed
+    # Called whenever the view scrolls. When it nears the top, the next page
+    # of older messages is added above the ones already shown.
     def checkScroll(self, x, y):
         self.vscrollbar.set(x, y)
         (top, bottom) = self.vscrollbar.get()
         if top < 0.05 and self.addedMessages is True:
             self.addedMessages = False
-            self.messageLimit += 20
-            oldHeight = self.interior.winfo_height()
-            for widget in self.interior.winfo_children():
-                widget.destroy()
-            self.messageBubbles = {}
-            hitLimit = self.addMessages(self.currentChat)
-            self._configure_message_scrollbars()
-            self.addedMessages = not hitLimit
-            newHeight = self.interior.winfo_reqheight()
-
-            newY = (top * oldHeight + (newHeight - oldHeight)) / newHeight
+            self.addedMessages = self.addOlderMessages(self.currentChat)
+
+    def addOlderMessages(self, chat):
+        """Add the page of messages before the first one shown, reading it
+        from the database if the chat hasn't loaded it yet. Only the new
+        messages get widgets, and the view stays on the messages it was
+        showing. Returns whether there may be more to add."""
+        messageDict = chat.getMessages()
+        if self.firstMessageId not in messageDict:
+            return False
+        firstKey = messageDict.sortKey(self.firstMessageId)
+        subList = messageDict.keysBefore(firstKey, PAGE_SIZE)
+        if len(subList) < PAGE_SIZE and chat.olderMessagesKey is not None:
+            db = self.messageDatabase()
+            chat.addOlderMessages(db.getMessagesBefore(
+                chat.chatId, chat.olderMessagesKey, PAGE_SIZE))
+            subList = messageDict.keysBefore(firstKey, PAGE_SIZE)
+        if not subList:
+            return False
+
+        # Note where the top widget is in the view before adding above it.
+        slaves = self.interior.pack_slaves()
+        anchor = slaves[0] if slaves else None
+        anchorOffset = (anchor.winfo_y() - self.canvas.canvasy(0)
+                        if anchor else 0)
+
+        previousIds = messageDict.keysBefore(messageDict.sortKey(subList[0]),
+                                             1)
+        prevMessage = messageDict[previousIds[0]] if previousIds else None
+        for i in range(len(subList)):
+            message = messageDict[subList[i]]
+            # The read receipt is always on a newer message.
+            self.addMessage(chat, i, message, prevMessage, -1,
+                            before=anchor)
+            prevMessage = message
+
+        # The old first message was shown with nothing before it.
+        firstMessage = messageDict[self.firstMessageId]
+        if (self.firstMessageId in self.timeLabels and
+                not self.needTimeLabel(firstMessage, prevMessage)):
+            timeLabel = self.timeLabels.pop(self.firstMessageId)
+            self.messageBubbles[self.firstMessageId].remove(timeLabel)
+            timeLabel.destroy()
+        if not self.needSenderLabel(chat, firstMessage, prevMessage):
+            for part in self.messageBubbles[self.firstMessageId]:
+                if getattr(part, 'senderLabel', None) is not None:
+                    part.senderLabel.destroy()
+                    part.senderLabel = None
+        self.firstMessageId = subList[0]
+
+        self._configure_message_scrollbars()
+        if anchor:
+            newY = ((anchor.winfo_y() - anchorOffset) /
+                    max(1, self.interior.winfo_reqheight()))
             self.canvas.yview_moveto(newY)
+        return True
 
     # To change chats (ie display messages of a new chat)
     # we need to delete all the MessageBubbles of the old chat
     # and then add the messages of the new chat.
-    #
-    # This could probably be changed so that there are frames for each chat
-    # and when a chat is opened, that frame is lifted. That should help
-    # avoid stutter by buffering.
-    # However, this probably needs to follow restricting chats to their first x
-    # messages without scrolling up to avoid consuming too much memory.
+    # ResponseFrame keeps a MessageFrame for each recently shown chat, so this
+    # only runs the first time a chat is shown in a while.
     def changeChat(self, chat):
+        # Whatever the chat picked up while it had no view, such as
+        # reactions to messages that were never read, is read again.
+        chat.unloadMessages()
         self.currentChat = chat
         self.addedMessages = False
         for widget in self.interior.winfo_children():
             widget.destroy()
         self.messageBubbles = {}
+        self.timeLabels = {}
+        self.firstMessageId = None
         # Reset the message limit before opening a new chat
         self.messageLimit = 15
         hitLimit = self.addMessages(chat)
@@ -107,6 +239,34 @@ class MessageFrame(VerticalScrolledFrame):
 
         self._destroyReactionWindow()
 
+    def showChat(self, chat):
+        """Show the chat again after it was hidden, adding only what changed
+        while it was."""
+        self.currentChat = chat
+        self.hidden = False
+        if self.pendingResize is not None:
+            event, self.pendingResize = self.pendingResize, None
+            self._configure_messages_canvas(event)
+        self.addMessages(chat)
+
+    def hide(self):
+        self.hidden = True
+
+    # A chat whose view is dropped doesn't need its messages until it is
+    # shown again, which reads them afresh.
+    def destroy(self):
+        unloadMessages = getattr(self.currentChat, 'unloadMessages', None)
+        if unloadMessages is not None:
+            unloadMessages()
+        VerticalScrolledFrame.destroy(self)
+
+    def estimateSize(self):
+        """A rough estimate of the memory taken by the widgets and images
+        shown, in bytes."""
+        return sum(part.estimateSize()
+                   for parts in self.messageBubbles.values()
+                   for part in parts)
+
     def needSenderLabel(self, chat, message, prevMessage):
         """Return whether or not a sender label needs to be added.
 
@@ -156,10 +316,10 @@ class MessageFrame(VerticalScrolledFrame):
 
         return False
 
-    def createTimeLabel(self, messageDate):
+    def createTimeLabel(self, messageDate, before=None):
         timeLabel = MessageHeader(self.interior,
                                   getTimeText(messageDate))
-        timeLabel.pack(fill=tk.X)
+        timeLabel.pack(fill=tk.X, before=before)
         return timeLabel
 
     def needReadReceipt(self, chat, message, lastFromMeId):
@@ -201,14 +361,17 @@ class MessageFrame(VerticalScrolledFrame):
                 readReceiptId in self.messageBubbles):
             self.messageBubbles[readReceiptId][-1].removeReadReceipt()
 
-    def addMessage(self, chat, i, message, prevMessage, lastFromMeId):
+    # Widgets are packed at the bottom, or above the widget before.
+    def addMessage(self, chat, i, message, prevMessage, lastFromMeId,
+                   before=None):
 
         addLabel = self.needSenderLabel(chat, message, prevMessage)
 
         messageParts = []
         if (self.needTimeLabel(message, prevMessage)):
-            timeLabel = self.createTimeLabel(message.date)
+            timeLabel = self.createTimeLabel(message.date, before)
             messageParts.append(timeLabel)
+            self.timeLabels[message.rowid] = timeLabel
 
         addReceipt = self.needReadReceipt(chat, message, lastFromMeId)
         if addReceipt:
@@ -221,7 +384,7 @@ class MessageFrame(VerticalScrolledFrame):
         if message.item_type == 2:
             text = message.getText()
             nameChange = MessageHeader(self.interior, text)
-            nameChange.pack(fill=tk.X)
+            nameChange.pack(fill=tk.X, before=before)
             messageParts.append(nameChange)
 
         for i in range(len(message.messageParts)):
@@ -245,9 +408,9 @@ class MessageFrame(VerticalScrolledFrame):
 
         for msg in messageParts:
             if message.isFromMe:
-                msg.pack(anchor=tk.E, expand=tk.FALSE)
+                msg.pack(anchor=tk.E, expand=tk.FALSE, before=before)
             else:
-                msg.pack(anchor=tk.W, expand=tk.FALSE)
+                msg.pack(anchor=tk.W, expand=tk.FALSE, before=before)
         # If this message is replacing a temporary message,
         # get rid of that old message.
         if (message.removedTempId < 0 and message.removedTempId in
@@ -255,6 +418,7 @@ class MessageFrame(VerticalScrolledFrame):
             for bubble in self.messageBubbles[message.removedTempId]:
                 bubble.destroy()
             del self.messageBubbles[message.removedTempId]
+            self.timeLabels.pop(message.removedTempId, None)
         self.messageBubbles[message.rowid] = messageParts
 
     # Add the chat's messages to the MessageFrame as MessageBubbles
@@ -267,17 +431,33 @@ class MessageFrame(VerticalScrolledFrame):
             self.lock.release()
             return None
 
+        # The first time, only the newest page is read. After that, only
+        # the updates to messages from the oldest one read on.
         db = self.messageDatabase()
-        messageList, lastAccessTime = db.getMessagesForChat(
-            chat.chatId, chat.lastAccessTime)
-        chat.addMessages(messageList, lastAccessTime)
+        if chat.lastAccessTime == 0:
+            messageList, lastAccessTime = db.getLatestMessages(
+                chat.chatId, FIRST_PAGE_SIZE)
+            chat.addOlderMessages(messageList, lastAccessTime)
+        else:
+            messageList, lastAccessTime = db.getMessagesForChat(
+                chat.chatId, chat.lastAccessTime,
+                chat.olderMessagesKey or FIRST_KEY)
+            chat.addMessages(messageList, lastAccessTime)
 
         messageDict = chat.getMessages()
 
         # For each message in messageDict
         # Update the message bubble if it exists
         # Add a new one if it does not exist
-        subList = self.getMessagesUpToLimit(messageDict, self.messageLimit)
+        # Once messages are shown, everything from the first one on is.
+        if self.firstMessageId in messageDict:
+            subList = messageDict.keysBetween(
+                messageDict.sortKey(self.firstMessageId), LAST_KEY)
+        else:
+            subList = self.getMessagesUpToLimit(messageDict,
+                                                self.messageLimit)
+            if subList:
+                self.firstMessageId = subList[0]
 
         lastFromMeId = -1
         for i in reversed(subList):
@@ -304,14 +484,16 @@ class MessageFrame(VerticalScrolledFrame):
         if bottom >= 0.99:
             self.canvas.update()
             self.canvas.yview_moveto(self.interior.winfo_reqheight())
-        if self.messageLimit > len(list(messageDict.keys())):
+        # Whether every message is shown.
+        if chat.olderMessagesKey is None and (
+                not subList or subList[0] == next(iter(messageDict))):
             return True
         return False
 
     # Iterate backwards through the list and chop off when there are more
     # message parts than messageLimit.
     def getMessagesUpToLimit(self, messageDict, messageLimit):
-        subList = list(messageDict.keys())[-self.messageLimit:]
+        subList = messageDict.lastKeys(self.messageLimit)
         messagePartCount = 0
         for i in range(len(subList) - 1, -1, -1):
             messagePartCount += len(messageDict[subList[i]].messageParts)
@@ -338,6 +520,9 @@ class MessageFrame(VerticalScrolledFrame):
     # When the window changes size, this keeps the scrollbar's bottom location
     # locked in place so the most recent messages stay in view.
     def _configure_messages_canvas(self, event):
+        if self.hidden:
+            self.pendingResize = event
+            return
         (top, bottom) = self.vscrollbar.get()
         for messageBubble in self.messageBubbles:
             for bubble in self.messageBubbles[messageBubble]:
@@ -438,6 +623,9 @@ class MessageHeader(tk.Frame):
     def resize(self, event):
         self.label.configure(width=event.width)
 
+    def estimateSize(self):
+        return PART_SIZE
+
 
 class MessageBubble(tk.Frame):
 
@@ -565,6 +753,9 @@ class MessageBubble(tk.Frame):
     def resize(self, event):
         pass
 
+    def estimateSize(self):
+        return PART_SIZE
+
 
 class ReactionBubbleBadMessageTypeException(Exception):
     pass
@@ -628,51 +819,74 @@ class ImageMessageBubble(MessageBubble):
                                  highlightthickness=0)
         self.display.grid(row=0, sticky='nsew')
         self.body = tk.Label(self.display)
-        try:
-            self.body.original = Image.open(os.path
-                                            .expanduser(messagePart
-                                                        .attachment.filename))
-            newSize = self.getNewSize(self.body.original,
-                                      self.master.master.winfo_width(),
-                                      self.master.master.winfo_height())
-            self.body.image = ImageTk.PhotoImage(self.body.original
-                                                 .resize(newSize,
-                                                         Image.ANTIALIAS))
-            self.body.configure(image=self.body.image)
-            self.display.configure(width=newSize[0], height=newSize[1])
+        self.body.image = None
+        self.box = None
+        self.pending = False
+        self.initBody()
+        self.loadImage()
 
+    # Attachments are downloaded in the background, so the file may not be
+    # there yet. update() tries again once the message changes.
+    def loadImage(self):
+        try:
+            self.setImage(self.getBox(self.master.master.winfo_width(),
+                                      self.master.master.winfo_height()))
+            self.pending = False
+        except FileNotFoundError:
+            self.pending = True
+            self.display.configure(bg=PLACEHOLDER_COLOR)
+            self.body.configure(text='Downloading image...',
+                                bg=PLACEHOLDER_COLOR)
             self.body.grid(row=0, sticky='nsew')
-            self.initBody()
 
-        except FileNotFoundError as e:
-            print(e)
-            self.body.original = None
+    def update(self):
+        MessageBubble.update(self)
+        if self.pending:
+            self.loadImage()
+
+    # The box the image is fitted inside, rounded to a thumbnail size bucket.
+    def getBox(self, winWidth, winHeight):
+        return thumbnails.bucketBox(3 * winWidth // 4, 4 * winHeight // 5)
+
+    # Until the first image is decoded, an empty display the size it will
+    # have stands in for it. After that, the old image stays up until the
+    # new one is ready.
+    def setImage(self, box):
+        cache = thumbnails.getCache()
+        if self.body.image is None:
+            width, height = cache.fittedSize(self.messagePart.attachment,
+                                             box)
+            self.display.configure(width=width, height=height,
+                                   bg=PLACEHOLDER_COLOR)
+        self.box = box
+        cache.request(self.messagePart.attachment, box,
+                      lambda photo: self.showImage(photo, box))
+
+    def showImage(self, photo, box):
+        # The bubble may have been destroyed or resized since the image was
+        # requested.
+        if box != self.box or not self.winfo_exists():
+            return
+        if photo is None:
+            self.box = None
             self.body.configure(text='Image not found')
+        else:
+            self.body.image = photo
+            self.body.configure(image=photo)
+            self.display.configure(width=photo.width(),
+                                   height=photo.height())
+        self.body.grid(row=0, sticky='nsew')
 
-    def getNewSize(self, im, winWidth, winHeight):
-        maxWidth = 3 * winWidth // 4
-        maxHeight = 4 * winHeight // 5
-
-        resized = im
-        size = (im.width, im.height)
-
-        if im.height > maxHeight or im.width > maxWidth:
-            h = int(im.height * (maxWidth / im.width))
-            if h > maxHeight:
-                w = int(im.width * (maxHeight / im.height))
-                size = (w, maxHeight)
-            else:
-                size = (maxWidth, h)
-        return size
-
+    # Only a new size bucket needs a new image.
     def resize(self, event):
-        if self.body.original:
-            newSize = self.getNewSize(self.body.original,
-                                      event.width, event.height)
-            resized = self.body.original.resize(newSize, Image.ANTIALIAS)
-
-            self.body.image = ImageTk.PhotoImage(resized)
-            self.body.configure(image=self.body.image)
-            self.display.configure(width=newSize[0], height=newSize[1])
+        if self.box is not None:
+            box = self.getBox(event.width, event.height)
+            if box != self.box:
+                self.setImage(box)
         else:
             self.body.configure(width=3 * event.width // 5)
+
+    def estimateSize(self):
+        if self.body.image:
+            return PART_SIZE + thumbnails.photoSize(self.body.image)
+        return PART_SIZE
@@ -1,6 +1,6 @@
 # The entire right half of the app
 import tkinter as tk
-from messageframe import MessageFrame
+from messageframe import MessageFrame, ViewCache
 from recipientframe import RecipientFrame
 from sendframe import SendFrame
 
@@ -10,9 +10,12 @@ class ResponseFrame(tk.Frame):
         tk.Frame.__init__(self, parent, *args, **kw)
 
         self.mp = api.HttpMessagePasser()
-        self.messageFrame = MessageFrame(self, 0, minWidth,
-                                         self.mp, api.MessageDatabase)
-        self.messageFrame.grid(row=1, column=0, sticky='nsew', pady=(1, 0))
+        self.minWidth = minWidth
+        self.api = api
+        # A MessageFrame is kept for each recently shown chat. They share
+        # one grid cell and the current chat's is raised above the others.
+        self.views = ViewCache()
+        self.messageFrame = self.createMessageFrame()
 
         self.columnconfigure(0, weight=1)
         self.rowconfigure(1, weight=1)
@@ -25,7 +28,7 @@ class ResponseFrame(tk.Frame):
 
         # Hold a dummy chat with an invalid id initially
         self.currentChat = api.DummyChat(-1)
-        self.api = api
+        self.views.put(self.currentChat.chatId, self.messageFrame)
 
         self.configure(bg='black')
 
@@ -35,9 +38,35 @@ class ResponseFrame(tk.Frame):
             self.currentChat.lastAccess = 0
             self.recipientFrame.clearWindow()
             self.recipientFrame.addRecipients(chat)
-            self.messageFrame.changeChat(chat)
+            self.showMessageFrame(chat)
             self.sendFrame.updateSendButton(self.mp, chat)
 
+    def createMessageFrame(self):
+        messageFrame = MessageFrame(self, 0, self.minWidth,
+                                    self.mp, self.api.MessageDatabase)
+        messageFrame.grid(row=1, column=0, sticky='nsew', pady=(1, 0))
+        return messageFrame
+
+    # Raise the chat's MessageFrame, bringing it up to date if it was kept,
+    # or build a new one.
+    def showMessageFrame(self, chat):
+        previous = self.messageFrame
+        previous._destroyReactionWindow()
+        messageFrame = self.views.get(chat.chatId)
+        if messageFrame is None:
+            messageFrame = self.createMessageFrame()
+            messageFrame.changeChat(chat)
+        else:
+            messageFrame.showChat(chat)
+        if messageFrame is not previous:
+            previous.hide()
+        messageFrame.tkraise()
+        self.messageFrame = messageFrame
+        self.views.put(chat.chatId, messageFrame)
+        # New chats get a new id each time, so they are never shown again.
+        if getattr(previous.currentChat, 'isTemporaryChat', False):
+            self.views.remove(previous.currentChat.chatId)
+
     def isCurrentChat(self, chatToCompare):
         if chatToCompare.chatId == self.currentChat.chatId:
             return True
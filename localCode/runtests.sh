@@ -1,4 +1,4 @@
-FILES=('messageApi/api.py' 'messageApi/sqlcommands.py' 'sendframe.py' 'chatframe.py' 'constants.py' 'gui.py' 'messageframe.py' 'recipientframe.py' 'responseframe.py' 'updater.py' 'verticalscrolledframe.py')
+FILES=('messageApi/api.py' 'messageApi/session.py' 'messageApi/downloader.py' 'messageApi/blobstore.py' 'messageApi/events.py' 'messageApi/sqlcommands.py' 'messageApi/migrations.py' 'messageApi/connections.py' 'scheduler.py' 'thumbnails.py' 'sendframe.py' 'chatframe.py' 'constants.py' 'gui.py' 'messageframe.py' 'recipientframe.py' 'responseframe.py' 'updater.py' 'verticalscrolledframe.py')
 
 EXITSTATUS=0
 for filename in ${FILES[@]}; do
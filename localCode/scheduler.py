@@ -0,0 +1,117 @@
+import collections
+import queue
+import sys
+import threading
+import time
+
+# Event kinds background threads post to the GUI.
+CHAT_UPDATED = 'chatUpdated'
+CONNECTION_STATE = 'connectionState'
+PLAY_SOUND = 'playSound'
+IMAGE_DECODED = 'imageDecoded'
+QUIT = 'quit'
+
+# About one frame at 60 Hz.
+FRAME_INTERVAL = 16
+
+
+class Scheduler:
+    """
+    Runs event handlers on the Tk thread.
+
+    Tk widgets may only be touched from the thread running the mainloop, so
+    other threads post typed events here instead. Once a frame the queue is
+    drained on the Tk thread with after(). Events with the same kind and key
+    posted within a frame are coalesced, keeping the last value, and each
+    kind's handler is called once with the values in the order their keys
+    were first posted.
+    """
+
+    def __init__(self, interval=FRAME_INTERVAL):
+        self.interval = interval
+        self.handlers = {}
+        self._queue = queue.Queue()
+        self._root = None
+
+    def handle(self, kind, handler):
+        self.handlers[kind] = handler
+
+    def post(self, kind, key=None, value=None):
+        """Queue an event. Safe to call from any thread."""
+        self._queue.put((kind, key, value))
+
+    def start(self, root):
+        self._root = root
+        self._root.after(self.interval, self._tick)
+
+    def drain(self):
+        """Handle every queued event. Returns the number of events read."""
+        pending = collections.OrderedDict()
+        count = 0
+        while True:
+            try:
+                kind, key, value = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            pending.setdefault(kind, collections.OrderedDict())[key] = value
+            count += 1
+        for kind, values in pending.items():
+            handler = self.handlers.get(kind)
+            if handler is not None:
+                handler(list(values.values()))
+        return count
+
+    def _tick(self):
+        try:
+            self.drain()
+        finally:
+            self._root.after(self.interval, self._tick)
+
+
+def getThreadTrace():
+    """Return the trace hook threading sets on new threads."""
+    # threading.gettrace is new in 3.10.
+    if hasattr(threading, 'gettrace'):
+        return threading.gettrace()
+    return getattr(threading, '_trace_hook', None)
+
+
+class ThreadCounter:
+    """
+    Counts the threads started after install(), so that a regression back to
+    a thread per tick shows up in perMinute().
+
+    threading calls the trace hook once at the start of every new thread.
+    Any hook installed before, such as a debugger's or coverage's, is still
+    called.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self._starts = collections.deque()
+        self._lock = threading.Lock()
+        self._previous = None
+
+    def install(self):
+        self._previous = getThreadTrace()
+        threading.settrace(self._trace)
+
+    def uninstall(self):
+        threading.settrace(self._previous)
+
+    def _trace(self, frame, event, arg):
+        with self._lock:
+            self.total += 1
+            self._starts.append(time.monotonic())
+        sys.settrace(self._previous)
+        if self._previous is not None:
+            return self._previous(frame, event, arg)
+        return None
+
+    def perMinute(self):
+        """The number of threads started in the last minute."""
+        cutoff = time.monotonic() - 60
+        with self._lock:
+            while self._starts and self._starts[0] < cutoff:
+                self._starts.popleft()
+            return len(self._starts)
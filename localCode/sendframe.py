@@ -51,8 +51,7 @@ class SendFrame(tk.Frame):
         self.consecutiveMissedPings = 0
 
     # Sets the status of isConnected and updates the send button accordingly.
-    # consecutiveMissedPings counted may not be thread safe. This is a fairly
-    # small issue that may need to be addressed in the future.
+    # Pings are posted to the Tk thread, so this is only called from there.
     def setIsConnected(self, isConnected):
         if isConnected:
             self.consecutiveMissedPings = 0
@@ -31,6 +31,7 @@ if __name__ == '__main__':
     t1 = updater.UpdaterThread()
     t1.start()
     t2 = gui.GuiThread(debug=debug)
+    updater.addApplyListener(t2.wake)
     t2.daemon = True
     t2.start()
     t2.join()
@@ -0,0 +1,216 @@
+import collections
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageTk
+import scheduler
+
+DEFAULT_ROOT = './attachments/thumbnails'
+# Bounding boxes are rounded down to a multiple of this many pixels, so that
+# resizing the window by a few pixels keeps using the same thumbnail.
+SIZE_BUCKET = 64
+THUMBNAIL_QUALITY = 90
+DEFAULT_MAX_BYTES = 64 * 2 ** 20
+DEFAULT_WORKERS = 2
+
+
+def bucketBox(width, height):
+    """Round a bounding box down to its size bucket."""
+    return (max(SIZE_BUCKET, width // SIZE_BUCKET * SIZE_BUCKET),
+            max(SIZE_BUCKET, height // SIZE_BUCKET * SIZE_BUCKET))
+
+
+class ThumbnailCache:
+    """
+    Downscaled attachment images, shared by every ImageMessageBubble.
+
+    An image is decoded and downscaled once per bounding box bucket. The
+    thumbnail is saved under root, named by the attachment's guid and box, so
+    later runs read the small file instead of the original. Thumbnails are
+    JPEGs, or PNGs if they have transparency, since PNG is much slower to
+    encode. The PhotoImages made from them are kept in memory, least recently
+    used first out once they take more than maxBytes. No full-resolution
+    image is kept.
+
+    thumbnail() only uses PIL, so it can run on any thread. Everything else
+    makes or hands out Tk images, so it must run on the Tk thread. Once
+    start() is called, request() decodes on a pool of workers and hands the
+    images back through the scheduler, so large photos don't hold up the
+    mainloop. Before that it decodes straight away.
+    """
+
+    def __init__(self, root=DEFAULT_ROOT, maxBytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.maxBytes = maxBytes
+        self.photos = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.diskHits = 0
+        self.decodes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.executor = None
+        self.scheduler = None
+        # Callbacks waiting on each image the workers are decoding.
+        self.waiting = {}
+        # Decodes submitted to the workers that haven't finished, so that
+        # shutdown() can cancel those not started.
+        self.futures = set()
+
+    def start(self, eventScheduler, workers=DEFAULT_WORKERS):
+        self.scheduler = eventScheduler
+        self.scheduler.handle(scheduler.IMAGE_DECODED, self._onDecoded)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='ThumbnailDecoder')
+
+    def shutdown(self):
+        if self.executor is not None:
+            # ThreadPoolExecutor.shutdown only takes cancel_futures from 3.9.
+            with self._lock:
+                futures = list(self.futures)
+            for future in futures:
+                future.cancel()
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def thumbnailPath(self, guid, box):
+        return os.path.join(self.root, '{}-{}x{}'.format(guid, *box))
+
+    def thumbnail(self, attachment, box):
+        """Return the attachment's image fitted inside box, as a PIL image.
+        Raises FileNotFoundError if the attachment hasn't been downloaded."""
+        path = (self.thumbnailPath(attachment.guid, box)
+                if attachment.guid else None)
+        if path and os.path.isfile(path):
+            with self._lock:
+                self.diskHits += 1
+            with Image.open(path) as image:
+                image.load()
+                return image
+        with Image.open(os.path.expanduser(attachment.filename)) as image:
+            # Palette images would only be resampled with NEAREST.
+            if image.mode in ('1', 'P'):
+                image = image.convert('RGBA')
+            # JPEGs are decoded at the smallest fraction of their size that
+            # is still larger than box.
+            image.thumbnail(box, Image.LANCZOS, reducing_gap=1.0)
+            image.load()
+        if image.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+            image = image.convert('RGB')
+        with self._lock:
+            self.decodes += 1
+        if path:
+            os.makedirs(self.root, exist_ok=True)
+            partPath = '{}.{}.part'.format(path, threading.get_ident())
+            if 'A' in image.mode:
+                image.save(partPath, 'PNG')
+            else:
+                image.save(partPath, 'JPEG', quality=THUMBNAIL_QUALITY)
+            os.replace(partPath, path)
+        return image
+
+    def fittedSize(self, attachment, box):
+        """Return the size of the attachment's thumbnail for box, reading
+        only the image's header. Raises FileNotFoundError if the attachment
+        hasn't been downloaded."""
+        path = (self.thumbnailPath(attachment.guid, box)
+                if attachment.guid else None)
+        if path and os.path.isfile(path):
+            with Image.open(path) as image:
+                return image.size
+        with Image.open(os.path.expanduser(attachment.filename)) as image:
+            width, height = image.size
+        scale = min(box[0] / width, box[1] / height, 1)
+        return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    def cachedPhoto(self, key):
+        photo = self.photos.get(key)
+        if photo is not None:
+            self.hits += 1
+            self.photos.move_to_end(key)
+        return photo
+
+    def photo(self, attachment, box):
+        """Return a PhotoImage of the attachment fitted inside box."""
+        key = (attachment.filename, box)
+        photo = self.cachedPhoto(key)
+        if photo is not None:
+            return photo
+        return self.add(key, ImageTk.PhotoImage(
+            self.thumbnail(attachment, box)))
+
+    def request(self, attachment, box, callback):
+        """Call callback with a PhotoImage of the attachment fitted inside
+        box, or with None if it can't be read. The callback runs on the Tk
+        thread, either now or once a worker has decoded the image."""
+        key = (attachment.filename, box)
+        photo = self.cachedPhoto(key)
+        if photo is not None:
+            callback(photo)
+        elif self.executor is None:
+            try:
+                photo = self.photo(attachment, box)
+            except Exception as e:
+                print(e)
+            callback(photo)
+        elif key in self.waiting:
+            self.waiting[key].append(callback)
+        else:
+            self.waiting[key] = [callback]
+            future = self.executor.submit(self._decode, key, attachment, box)
+            with self._lock:
+                self.futures.add(future)
+            future.add_done_callback(self._forget)
+
+    def _forget(self, future):
+        with self._lock:
+            self.futures.discard(future)
+
+    def _decode(self, key, attachment, box):
+        image = None
+        try:
+            image = self.thumbnail(attachment, box)
+        except Exception as e:
+            print(e)
+        self.scheduler.post(scheduler.IMAGE_DECODED, key, (key, image))
+
+    def _onDecoded(self, results):
+        for key, image in results:
+            photo = (self.add(key, ImageTk.PhotoImage(image))
+                     if image is not None else None)
+            for callback in self.waiting.pop(key, []):
+                callback(photo)
+
+    def add(self, key, photo):
+        previous = self.photos.pop(key, None)
+        if previous is not None:
+            self.bytes -= photoSize(previous)
+        self.photos[key] = photo
+        self.bytes += photoSize(photo)
+        while self.bytes > self.maxBytes and len(self.photos) > 1:
+            _, oldPhoto = self.photos.popitem(last=False)
+            self.bytes -= photoSize(oldPhoto)
+            self.evictions += 1
+        return photo
+
+    def stats(self):
+        return {'photos': len(self.photos), 'bytes': self.bytes,
+                'hits': self.hits, 'diskHits': self.diskHits,
+                'decodes': self.decodes, 'evictions': self.evictions}
+
+
+# Tk keeps 4 bytes a pixel for a photo image.
+def photoSize(photo):
+    return photo.width() * photo.height() * 4
+
+
+_cache = None
+
+
+def getCache():
+    """Return the process-wide ThumbnailCache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        _cache = ThumbnailCache()
+    return _cache
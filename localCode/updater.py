@@ -3,19 +3,63 @@ import json
 import time
 import sqlite3
 import os
+import functools
+import queue
 import requests
+from messageApi import session
+from messageApi import events
+from messageApi import blobstore
+from messageApi import downloader
+from messageApi import migrations
 
 dirname = os.path.dirname(__file__)
 secretsFile = os.path.join(dirname, 'secrets.json')
-secrets = json.load(open(secretsFile))
+dataFile = os.path.join(dirname, 'data.json')
+# The change cursor from the last update applied, kept in the sync_state
+# table of the local database. None until a server that has one answers.
+syncCursor = None
 
-user = secrets['user']
-ip = secrets['ip']
-scriptPath = secrets['scriptPath']
-retrieveScriptPath = secrets['retrieveScriptPath']
-serverCrt = secrets['serverCrt']
-clientCrt = secrets['clientCrt']
-clientKey = secrets['clientKey']
+# Changes asked for per response, which keeps memory bounded on both ends
+# during an initial sync of years of history.
+PAGE_SIZE = 5000
+# Rows of a streamed update written with each executemany.
+STREAM_BATCH_SIZE = 500
+# Chat ids bound to a single IN (...) list when summarizing chats.
+SQL_CHUNK_SIZE = 500
+NDJSON_TYPE = 'application/x-ndjson'
+# Seconds between polls of /update, doubled after each failed one up to
+# UPDATE_BACKOFF_MAX.
+UPDATE_INTERVAL = 1
+UPDATE_BACKOFF_MAX = 60
+
+
+# Called with no arguments, on the updater's thread, after each update is
+# committed to the local database.
+applyListeners = []
+
+
+def addApplyListener(listener):
+    applyListeners.append(listener)
+
+
+def notifyApplied():
+    for listener in list(applyListeners):
+        listener()
+
+
+def initialize(secretsFile):
+    global user, ip, scriptPath, retrieveScriptPath, serverCrt, clientCrt
+    global clientKey
+
+    secrets = json.load(open(secretsFile))
+    user = secrets['user']
+    ip = secrets['ip']
+    scriptPath = secrets['scriptPath']
+    retrieveScriptPath = secrets['retrieveScriptPath']
+    serverCrt = secrets['serverCrt']
+    clientCrt = secrets['clientCrt']
+    clientKey = secrets['clientKey']
+    session.initialize(secrets)
 
 
 def updateLastAccess(newTime):
@@ -25,7 +69,7 @@ def updateLastAccess(newTime):
 
 def readLastAccess():
     try:
-        with open(os.path.join(dirname, 'data.json')) as infile:
+        with open(dataFile) as infile:
             data = json.load(infile)
             updateLastAccess(data['lastAccess'])
     except FileNotFoundError as e:
@@ -34,7 +78,7 @@ def readLastAccess():
 
 
 def writeLastAccess():
-    with open(os.path.join(dirname, 'data.json'), 'w+') as outfile:
+    with open(dataFile, 'w+') as outfile:
         try:
             data = json.load(outfile)
             data['lastAccess'] = lastAccess
@@ -44,6 +88,28 @@ def writeLastAccess():
     print('Wrote last access time of {}'.format(lastAccess))
 
 
+def updateSyncCursor(newCursor):
+    global syncCursor
+    syncCursor = newCursor
+
+
+def readSyncCursor(conn):
+    row = conn.execute(
+        "SELECT value FROM sync_state WHERE key = 'cursor'").fetchone()
+    updateSyncCursor(row[0] if row else None)
+
+
+def updateParams():
+    """Return the cursor to ask the server for updates after: the exact
+    change cursor if there is one, otherwise the last access time."""
+    # Messages are asked for in columns, which servers without them ignore.
+    if syncCursor is not None:
+        return {'since_seq': syncCursor, 'page_size': PAGE_SIZE,
+                'columnar': 1}
+    return {'last_update_time': lastAccess, 'page_size': PAGE_SIZE,
+            'columnar': 1}
+
+
 def translatePath(filename):
     (head, rightPath) = os.path.split(filename)
     rightFolder = os.path.basename(head).replace(' ', '_')
@@ -53,66 +119,364 @@ def translatePath(filename):
     return (rightFolder, rightPath)
 
 
-def retrieveUpdates():
-    oldTime = lastAccess
+def isComplete(path, totalBytes):
+    # Files written before downloads were verified may have been cut short.
+    if not os.path.isfile(path):
+        return False
+    return not totalBytes or os.path.getsize(path) == totalBytes
+
+
+def openDatabase(path='sms.db'):
+    conn = sqlite3.connect(path)
+    # WAL lets the GUI keep reading while an update is being applied, and
+    # with WAL, synchronous=NORMAL only syncs at checkpoints.
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    migrations.migrate(conn)
+    return conn
+
+
+@functools.lru_cache(maxsize=None)
+def _insertSql(table, columns):
+    placeholders = ', '.join('?' * len(columns))
+    return ('INSERT OR REPLACE INTO {} ({}) VALUES ({})'
+            .format(table, ', '.join(columns), placeholders))
+
+
+# The rows whose changes can show up in the chat list, as (id column, kind).
+SUMMARIZED_TABLES = {
+    'chat': ('ROWID', 'chat'),
+    'chat_message_join': ('chat_id', 'chat'),
+    'chat_handle_join': ('chat_id', 'chat'),
+    'message': ('ROWID', 'message'),
+    'handle': ('ROWID', 'handle'),
+}
+
+
+def noteTouched(touched, table, columns, rows):
+    """Add the ids of the chats, messages and handles the rows change to
+    touched, a dict of sets keyed on kind."""
+    if table not in SUMMARIZED_TABLES:
+        return
+    column, kind = SUMMARIZED_TABLES[table]
+    if column in columns:
+        i = columns.index(column)
+        touched.setdefault(kind, set()).update(row[i] for row in rows)
+
+
+def _chunks(values):
+    values = list(values)
+    for i in range(0, len(values), SQL_CHUNK_SIZE):
+        chunk = values[i:i + SQL_CHUNK_SIZE]
+        yield chunk, ', '.join('?' * len(chunk))
+
+
+def summarizeChats(conn, touched):
+    """Rewrite the chat_summary rows of the chats in touched and of the
+    chats its messages and handles belong to. Databases the migrations
+    haven't been run on are left alone."""
+    if not touched or not conn.execute(
+            "SELECT 1 FROM sqlite_master "
+            "WHERE type = 'table' AND name = 'chat_summary'").fetchone():
+        return
+    chatIds = set(touched.get('chat', ()))
+    for kind, sql in (
+            ('message', 'SELECT chat_id FROM chat_message_join '
+                        'WHERE message_id IN ({})'),
+            ('handle', 'SELECT chat_id FROM chat_handle_join '
+                       'WHERE handle_id IN ({})')):
+        for chunk, placeholders in _chunks(touched.get(kind, ())):
+            chatIds.update(row[0] for row in conn.execute(
+                sql.format(placeholders), chunk))
+    for chunk, placeholders in _chunks(chatIds):
+        conn.execute(migrations.SUMMARIZE_CHATS_SQL.format(
+            'WHERE chat.ROWID IN ({})'.format(placeholders)), chunk)
+
+
+def applyUpdates(conn, output):
+    """Write every row of an update payload to the local database.
+
+    Rows are grouped by table and column set so each group is written with a
+    single executemany, and the whole payload is applied in one transaction.
+    Tables are written in the order they appear in the payload. A table may
+    also be columnar, {'columns': [...], 'rows': [[...], ...]}.
+
+    The chat summaries of the chats the rows touch are rewritten in the
+    same transaction.
+
+    Returns the number of rows written.
+    """
+    groups = {}
+    for table in output:
+        if isinstance(output[table], dict):
+            key = (table, tuple(output[table]['columns']))
+            groups.setdefault(key, []).extend(
+                tuple(values) for values in output[table]['rows'])
+            continue
+        for row in output[table]:
+            if row.keys():
+                key = (table, tuple(row.keys()))
+                groups.setdefault(key, []).append(tuple(row.values()))
+
+    rowCount = 0
+    touched = {}
+    with conn:
+        for (table, columns), rows in groups.items():
+            conn.executemany(_insertSql(table, columns), rows)
+            noteTouched(touched, table, columns, rows)
+            rowCount += len(rows)
+        summarizeChats(conn, touched)
+    return rowCount
+
+
+class UpdateStreamError(Exception):
+    pass
+
+
+def prepareAttachments(conn, store, attachments):
+    """Point each attachment row at where its file is or will be kept
+    locally and return the (ROWID, guid) of those that need downloading."""
+    attachmentPre = './attachments/{}'
+    downloads = []
+    stored = store.linkedPaths(
+        conn, [attachment['ROWID'] for attachment in attachments])
+    for attachment in attachments:
+        if not attachment['filename']:
+            continue
+        storedPath = stored.get(attachment['ROWID'])
+        if storedPath and os.path.isfile(storedPath):
+            attachment['filename'] = storedPath
+            continue
+        # Files fetched before the blob store keep their old paths.
+        (rightFolder, rightPath) = translatePath(attachment['filename'])
+        if not isComplete(attachmentPre.format(rightPath),
+                          attachment.get('total_bytes')):
+            downloads.append((attachment['ROWID'], attachment['guid']))
+        attachment['filename'] = attachmentPre.format(rightPath)
+    return downloads
+
+
+def handleUpdate(conn, attachmentDownloader, output):
+    """Apply an update document from /update or /events, queueing downloads
+    for any attachments the local machine doesn't have yet.
+
+    Returns the change cursor the document came with, or None if the server
+    doesn't send one.
+    """
+    # The cursor is saved in the same transaction as the rows it covers, so
+    # the two can't disagree after a crash and an interrupted sync resumes
+    # after the last page applied.
+    cursor = output.pop('cursor', None)
+    output.pop('more', None)
+    if cursor is not None:
+        output['sync_state'] = [{'key': 'cursor', 'value': cursor}]
+    downloads = prepareAttachments(conn, attachmentDownloader.store,
+                                   output['attachment'])
+
+    # Messages are written straight away and attachments are fetched in
+    # the background, so a large attachment doesn't hold up the sync.
+    applyUpdates(conn, output)
+    if cursor is not None:
+        updateSyncCursor(cursor)
+    notifyApplied()
+    attachmentDownloader.enqueue(conn, downloads)
+    return cursor
+
+
+def touchAttachmentMessages(conn, attachmentIds):
+    """Mark the messages of newly downloaded attachments as updated, so the
+    GUI reloads them and shows the files."""
+    with conn:
+        for chunk, placeholders in _chunks(attachmentIds):
+            conn.execute(
+                "UPDATE message_update_date_join "
+                "SET message_update_date = strftime('%s','now') "
+                "WHERE message_id IN (SELECT message_id "
+                "FROM message_attachment_join "
+                "WHERE attachment_id IN ({}))".format(placeholders), chunk)
+
+
+def readRecords(resp):
+    for line in resp.iter_lines(chunk_size=64 * 1024):
+        if line:
+            yield json.loads(line)
+
+
+def handleUpdateStream(conn, attachmentDownloader, records):
+    """Apply a streamed update from /update, writing rows in batches as
+    they arrive, so memory doesn't grow with the size of the update.
+
+    The rows are committed together once the end record arrives, and rolled
+    back if the stream stops before it. Returns the end record.
+    """
+    downloads = []
+    batches = {}
+
+    columnOrder = {}
+    touched = {}
+
+    def writeBatch(table, columns):
+        rows = batches.pop((table, columns))
+        if table == 'attachment':
+            downloads.extend(prepareAttachments(
+                conn, attachmentDownloader.store, rows))
+        rows = [tuple(row.values()) if isinstance(row, dict) else row
+                for row in rows]
+        conn.executemany(_insertSql(table, columns), rows)
+        noteTouched(touched, table, columns, rows)
+
+    end = None
+    with conn:
+        for record in records:
+            if 'end' in record:
+                end = record
+                break
+            table = record['table']
+            if 'columns' in record:
+                # The values records that follow are in this order.
+                columnOrder[table] = tuple(record['columns'])
+                continue
+            if 'values' in record:
+                key = (table, columnOrder[table])
+                row = record['values']
+            else:
+                row = record['row']
+                if not row:
+                    continue
+                key = (table, tuple(row.keys()))
+            batches.setdefault(key, []).append(row)
+            if len(batches[key]) >= STREAM_BATCH_SIZE:
+                writeBatch(*key)
+        if end is None:
+            raise UpdateStreamError('Update stream ended early')
+        if 'error' in end:
+            raise UpdateStreamError(end['error'])
+        for key in list(batches):
+            writeBatch(*key)
+        summarizeChats(conn, touched)
+        if end.get('cursor') is not None:
+            conn.execute(_insertSql('sync_state', ('key', 'value')),
+                         ('cursor', end['cursor']))
+    if end.get('cursor') is not None:
+        updateSyncCursor(end['cursor'])
+    notifyApplied()
+    attachmentDownloader.enqueue(conn, downloads)
+    return end
+
+
+def retrieveUpdates(conn, attachmentDownloader):
+    """Fetch and apply the updates since the last ones applied. Returns
+    whether they were all applied."""
     # Sub 10 seconds (likely too much) to account for possibility of
     # missing messages that come in at the same time.
     tempLastAccess = int(time.time()) - 10
+    # Servers with a change cursor only send changes after since_seq, once
+    # each, a page at a time; last_update_time is for servers without one.
+    # Servers that can stream records send application/x-ndjson, others
+    # send the whole update as one JSON document.
     try:
-        resp = requests.get(
-            'https://{}:3000/update'.format(ip),
-            json={
-                'last_update_time': lastAccess},
-            verify=serverCrt, cert=(clientCrt, clientKey))
-        output = resp.json()
-        attachmentPre = './attachments/{}'
-        for attachment in output['attachment']:
-            if not attachment['filename']:
-                continue
-            (rightFolder, rightPath) = translatePath(attachment['filename'])
-            if rightFolder:
-                if not os.path.isdir(attachmentPre.format(rightFolder)):
-                    os.mkdir(attachmentPre.format(rightFolder))
-            if not os.path.isfile(attachmentPre.format(rightPath)):
-                attachResp = requests.get('https://{}:3000/sent/attachment/{}'
-                                          .format(ip, attachment['ROWID']),
-                                          verify=serverCrt,
-                                          cert=(clientCrt, clientKey))
-                if attachResp .status_code == 200:
-                    file = open(attachmentPre.format(rightPath), 'wb+')
-                    file.write(attachResp.content)
-                    file.close()
-            attachment['filename'] = attachmentPre.format(rightPath)
-
-        conn = sqlite3.connect('sms.db')
-
-        for table in output:
-            for row in output[table]:
-                if row.keys():
-                    columns = ', '.join(row.keys())
-                    placeholders = ', '.join('?' * len(row))
-                    sql = ('INSERT OR REPLACE INTO {} ({}) VALUES ({})'
-                           .format(table, columns, placeholders))
-                    conn.execute(sql, tuple(row.values()))
-        conn.commit()
-        conn.close()
+        more = True
+        while more:
+            resp = session.getSession().get('/update', json=dict(
+                updateParams(), last_update_time=lastAccess,
+                format='ndjson'), stream=True)
+            with resp:
+                resp.raise_for_status()
+                if resp.headers.get('Content-Type', '').startswith(
+                        NDJSON_TYPE):
+                    end = handleUpdateStream(conn, attachmentDownloader,
+                                             readRecords(resp))
+                    more = end.get('more', False)
+                else:
+                    output = resp.json()
+                    if 'error' in output:
+                        raise UpdateStreamError(output['error'])
+                    more = output.get('more', False)
+                    handleUpdate(conn, attachmentDownloader, output)
         updateLastAccess(tempLastAccess)
-    except requests.exceptions.ConnectionError as e:
+        return True
+    except (requests.exceptions.ConnectionError,
+            requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.Timeout) as e:
         print('Failed to hit update endpoint...')
+    except requests.exceptions.HTTPError as e:
+        print('Update endpoint failed: {}'.format(e))
+    except UpdateStreamError as e:
+        print('Update stream failed: {}'.format(e))
+    return False
+
+
+def openUpdateStream():
+    """Start listening for pushed updates from the /events endpoint. Each
+    event resumes from the cursor of the last one applied."""
+    stream = events.EventStream('/events', updateParams)
+    stream.start()
+    return stream
+
+
+def receiveUpdates(conn, attachmentDownloader, stream, timeout=1):
+    """Apply the updates pushed since the last call, waiting up to timeout
+    seconds for the first one."""
+    try:
+        event = stream.events.get(timeout=timeout)
+        while True:
+            output = json.loads(event.data)
+            # A failed export is sent as {"error": ...}. The server then
+            # closes the stream, and it reconnects from the last cursor.
+            if 'error' in output:
+                print('Update stream failed: {}'.format(output['error']))
+            else:
+                cursor = handleUpdate(conn, attachmentDownloader, output)
+                # Without a change cursor the event id is a time.
+                if cursor is None:
+                    updateLastAccess(int(event.id))
+            event = stream.events.get_nowait()
+    except queue.Empty:
         pass
 
 
 class UpdaterThread(threading.Thread):
 
-    def __init__(self, name='UpdaterThread'):
+    def __init__(self, name='UpdaterThread', secretsPath=secretsFile,
+                 databasePath='sms.db'):
         self._stopevent = threading.Event()
         threading.Thread.__init__(self, name=name)
+        self.databasePath = databasePath
+        initialize(secretsPath)
 
     def run(self):
         readLastAccess()
+        conn = openDatabase(self.databasePath)
+        readSyncCursor(conn)
+        attachmentDownloader = downloader.AttachmentDownloader()
+        stream = openUpdateStream()
+        delay = UPDATE_INTERVAL
         while not self._stopevent.isSet():
-            retrieveUpdates()
-            time.sleep(1)
+            # An update that can't be applied is skipped, rather than
+            # stopping every later one.
+            try:
+                if stream.supported:
+                    receiveUpdates(conn, attachmentDownloader, stream)
+                    delay = UPDATE_INTERVAL
+                else:
+                    # The remote machine is running a server without
+                    # /events.
+                    if retrieveUpdates(conn, attachmentDownloader):
+                        delay = UPDATE_INTERVAL
+                    else:
+                        delay = min(delay * 2, UPDATE_BACKOFF_MAX)
+                    self._stopevent.wait(delay)
+                downloaded = attachmentDownloader.poll(conn)
+                if downloaded:
+                    touchAttachmentMessages(conn, downloaded)
+                    notifyApplied()
+            except Exception as e:
+                print('Failed to apply update: {!r}'.format(e))
+                delay = min(delay * 2, UPDATE_BACKOFF_MAX)
+                self._stopevent.wait(delay)
+        stream.stopThread()
+        attachmentDownloader.shutdown(wait=False)
+        conn.close()
         self.terminate()
 
     def terminate(self):
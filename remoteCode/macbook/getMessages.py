@@ -2,107 +2,360 @@ import sqlite3
 import sys
 import os
 import json
+import time
+from contextlib import contextmanager
 
 
-if len(sys.argv) != 2:
-	print('Not enough args')
-	exit(1)
+neededColumnsMessage = ['ROWID', 'guid', 'text', 'handle_id', 'service', 'error', 'date', 'date_read', 'date_delivered', 'is_delivered', 'is_finished', 'is_from_me', 'is_read', 'is_sent', 'cache_has_attachments', 'cache_roomnames', 'item_type', 'other_handle', 'group_title', 'group_action_type', 'associated_message_guid', 'associated_message_type', 'associated_message_range_location', 'associated_message_range_length']
+neededColumnsAttachment = ['ROWID', 'guid', 'filename', 'uti', 'total_bytes']
+neededColumnsChat = ['ROWID', 'guid', 'style', 'state', 'account_id', 'chat_identifier', 'service_name', 'room_name', 'account_login', 'display_name', 'group_id']
+neededColumnsHandle = ['ROWID', 'id', 'country', 'service', 'uncanonicalized_id']
 
-dirname = os.path.dirname(__file__)
-configFile = os.path.join(dirname, 'config.json')
-config = json.load(open(configFile))
-CHAT_DB_PATH = config['chatLocation']
+# Values bound to a single IN (...) list. Older versions of SQLite only allow
+# 999 parameters in a statement.
+CHUNK_SIZE = 500
 
-conn = sqlite3.connect(CHAT_DB_PATH)
+MESSAGES_SQL = '''SELECT {}, CMJ.chat_id, MAJ.attachment_id
+FROM message
+	INNER JOIN message_update_date_join AS MUDJ
+		ON message.ROWID = MUDJ.message_id
+		AND MUDJ.message_update_date >= ?
+	INNER JOIN chat_message_join AS CMJ
+		ON message.ROWID = CMJ.message_id
+	LEFT JOIN message_attachment_join AS MAJ
+		ON message.ROWID = MAJ.message_id'''
 
-conn.row_factory = sqlite3.Row
+# message_change holds one row per message whose seq is taken from an
+# AUTOINCREMENT counter every time the message is written, so seq is a cursor
+# that never goes backwards and never repeats. See dbChanges.txt.
+CHANGES_SQL = '''SELECT {}, CMJ.chat_id, MAJ.attachment_id
+FROM message_change AS MC
+	INNER JOIN message
+		ON message.ROWID = MC.message_id
+	INNER JOIN chat_message_join AS CMJ
+		ON message.ROWID = CMJ.message_id
+	LEFT JOIN message_attachment_join AS MAJ
+		ON message.ROWID = MAJ.message_id
+WHERE MC.seq > ? AND MC.seq <= ?'''
 
-cursor = conn.cursor()
+# The seq a page of pageSize changes ends at.
+PAGE_END_SQL = 'SELECT seq FROM message_change WHERE seq > ? ORDER BY seq LIMIT 1 OFFSET ?'
 
-# unix time 978307200 is 0 apple time
-lastTime = sys.argv[1]
+CHANGE_LOG_SQL = '''
+CREATE TABLE IF NOT EXISTS message_change (
+	seq INTEGER PRIMARY KEY AUTOINCREMENT,
+	message_id INTEGER NOT NULL UNIQUE
+);
+CREATE TRIGGER IF NOT EXISTS insert_message_change AFTER INSERT ON message BEGIN
+	DELETE FROM message_change WHERE message_id = NEW.ROWID;
+	INSERT INTO message_change (message_id) VALUES (NEW.ROWID);
+END;
+CREATE TRIGGER IF NOT EXISTS update_message_change AFTER UPDATE ON message BEGIN
+	DELETE FROM message_change WHERE message_id = NEW.ROWID;
+	INSERT INTO message_change (message_id) VALUES (NEW.ROWID);
+END;
+CREATE TRIGGER IF NOT EXISTS delete_message_change AFTER DELETE ON message BEGIN
+	DELETE FROM message_change WHERE message_id = OLD.ROWID;
+END;
+-- A message's join rows can be committed after the message itself. Its seq
+-- is taken again, so a cursor that has already passed it sends it once more
+-- with them.
+CREATE TRIGGER IF NOT EXISTS chat_message_join_message_change AFTER INSERT ON chat_message_join
+	WHEN EXISTS (SELECT 1 FROM message WHERE ROWID = NEW.message_id) BEGIN
+	DELETE FROM message_change WHERE message_id = NEW.message_id;
+	INSERT INTO message_change (message_id) VALUES (NEW.message_id);
+END;
+CREATE TRIGGER IF NOT EXISTS message_attachment_join_message_change AFTER INSERT ON message_attachment_join
+	WHEN EXISTS (SELECT 1 FROM message WHERE ROWID = NEW.message_id) BEGIN
+	DELETE FROM message_change WHERE message_id = NEW.message_id;
+	INSERT INTO message_change (message_id) VALUES (NEW.message_id);
+END;
+INSERT INTO message_change (message_id)
+	SELECT message.ROWID FROM message
+		LEFT JOIN message_update_date_join AS MUDJ
+			ON message.ROWID = MUDJ.message_id
+	WHERE message.ROWID NOT IN (SELECT message_id FROM message_change)
+	ORDER BY coalesce(MUDJ.message_update_date, 0), message.ROWID;
+'''
 
-cursor.execute('select * from message inner join message_update_date_join inner join chat_message_join on message_update_date >= ? and message.ROWID = message_update_date_join.message_id and chat_message_join.message_id = message.ROWID left join message_attachment_join on ROWID = message_attachment_join.message_id', (lastTime, ))
-messages = []
+ATTACHMENTS_SQL = 'SELECT {} FROM attachment WHERE ROWID IN ({})'
 
-neededColumnsMessage = ['ROWID', 'guid', 'text', 'handle_id', 'service', 'error', 'date', 'date_read', 'date_delivered', 'is_delivered', 'is_finished', 'is_from_me', 'is_read', 'is_sent', 'cache_has_attachments', 'cache_roomnames', 'item_type', 'other_handle', 'group_title', 'group_action_type', 'associated_message_guid', 'associated_message_type', 'associated_message_range_location', 'associated_message_range_length']
-neededColumnsAttachment = ['ROWID', 'guid', 'filename', 'uti']
-neededColumnsChat = ['ROWID', 'guid', 'style', 'state', 'account_id', 'chat_identifier', 'service_name', 'room_name', 'account_login', 'display_name', 'group_id']
-neededColumnsHandle = ['ROWID', 'id', 'country', 'service', 'uncanonicalized_id']
+CHATS_SQL = 'SELECT {} FROM chat WHERE ROWID IN ({})'
+
+CHAT_HANDLES_SQL = 'SELECT chat_id, handle_id FROM chat_handle_join WHERE chat_id IN ({})'
+
+HANDLE_CHATS_SQL = 'SELECT handle_id, chat_id FROM chat_handle_join WHERE handle_id IN ({})'
+
+HANDLES_SQL = 'SELECT {} FROM handle WHERE ROWID IN ({})'
+
+
+class ExportStats:
+	"""Query counts and durations for each phase of an export."""
+
+	def __init__(self):
+		self.phases = []
+		self._current = None
+
+	@contextmanager
+	def phase(self, name):
+		self._current = {'name': name, 'queries': 0, 'rows': 0}
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self._current['seconds'] = time.perf_counter() - start
+			self.phases.append(self._current)
+			self._current = None
+
+	def execute(self, cursor, sql, params=()):
+		if self._current is not None:
+			self._current['queries'] += 1
+		rows = cursor.execute(sql, params).fetchall()
+		if self._current is not None:
+			self._current['rows'] += len(rows)
+		return rows
+
+	def iterate(self, cursor, sql, params=()):
+		"""Like execute, but yield the rows as they are read."""
+		current = self._current
+		if current is not None:
+			current['queries'] += 1
+		for row in cursor.execute(sql, params):
+			if current is not None:
+				current['rows'] += 1
+			yield row
+
+	def report(self, out=sys.stderr):
+		totalQueries = 0
+		totalSeconds = 0
+		for p in self.phases:
+			print('{:<18} {:>4} queries {:>7} rows {:>9.2f} ms'.format(p['name'], p['queries'], p['rows'], p['seconds'] * 1000), file=out)
+			totalQueries += p['queries']
+			totalSeconds += p['seconds']
+		print('{:<18} {:>4} queries {:>12} {:>9.2f} ms'.format('total', totalQueries, '', totalSeconds * 1000), file=out)
+
+
+def selectIn(stats, cursor, sql, values, columns=None):
+	values = list(values)
+	rows = []
+	for i in range(0, len(values), CHUNK_SIZE):
+		chunk = values[i:i + CHUNK_SIZE]
+		placeholders = ', '.join('?' * len(chunk))
+		if columns is None:
+			formatted = sql.format(placeholders)
+		else:
+			formatted = sql.format(', '.join(columns), placeholders)
+		rows.extend(stats.execute(cursor, formatted, chunk))
+	return rows
+
+
+def appleTimeToUnix(value):
+	# unix time 978307200 is 0 apple time
+	return value//1000000000 + 978307200 if value != 0 else 0
+
+
+def installChangeLog(conn):
+	"""Add message_change and its triggers to chat.db, recording every
+	existing message in the order it was last updated."""
+	conn.executescript(CHANGE_LOG_SQL)
+
+
+def hasChangeLog(conn):
+	return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_change'").fetchone() is not None
+
+
+# The tables of an update document, in the order they are written.
+TABLES = ['attachment', 'message_attachment_join', 'chat', 'handle', 'message', 'chat_handle_join', 'chat_message_join']
+
+
+def getUpdates(conn, lastTime, stats=None, sinceSeq=None, pageSize=None, columnar=False):
+	"""Return every row the local database needs for messages changed after
+	the change cursor sinceSeq, or updated at or after lastTime if there is no
+	cursor, keyed by table name.
+
+	If chat.db has a change log, the result also holds a 'cursor' to send as
+	sinceSeq next time. Every query runs in one read transaction, so the
+	cursor covers exactly the changes that were read.
+
+	With a change log, pageSize limits the result to that many changes and
+	'more' is True if there are changes after the cursor, so a long history
+	can be fetched a page at a time.
 
-attachments = []
-message_attachment_joins = []
-chats = []
-handles = []
-chat_handle_joins = []
-chat_message_joins = []
-
-attachmentIdSet = set()
-chatIdSet = set()
-handleIdSet = set()
-
-for row in cursor:
-	message = {}
-	for column in neededColumnsMessage:
-		message[column] = row[column]
-	message['date'] = message['date']//1000000000 + 978307200 if message['date'] != 0 else 0
-	message['date_read'] = message['date_read']//1000000000 + 978307200 if message['date_read'] != 0 else 0
-	message['date_delivered'] = message['date_delivered']//1000000000 + 978307200 if message['date_delivered'] != 0 else 0
-	chat_message_joins.append({
-		'message_id': row['ROWID'],
-		'chat_id': row['chat_id']
-		})
-	if row['attachment_id'] != None:
-		attachmentIdSet.add(row['attachment_id'])
-		message_attachment_joins.append({
-			'message_id': row['ROWID'],
-			'attachment_id': row['attachment_id']
-			})
-	chatIdSet.add(row['chat_id'])
-	handleIdSet.add(row['handle_id'])
-	handleIdSet.add(row['other_handle'])
-
-	messages.append(message)
-
-for attachmentId in attachmentIdSet:
-	attachment = {}
-	row = cursor.execute('select * from attachment where ROWID = ?', (attachmentId, )).fetchone()
-	if row:
-		for column in neededColumnsAttachment:
-			attachment[column] = row[column]
-	attachments.append(attachment)
-
-for chatId in chatIdSet:
-	chat = {}
-	row = cursor.execute('select * from chat where ROWID = ?', (chatId, )).fetchone()
-	if row:
-		for column in neededColumnsChat:
-			chat[column] = row[column]
-		row2 = cursor.execute('select ROWID from handle inner join chat_handle_join where handle.ROWID = chat_handle_join.handle_id and chat_handle_join.chat_id = ?', (chatId, ))
-		for r in row2.fetchall():
-			handleIdSet.add(r['ROWID'])
-	chats.append(chat)
-
-for handleId in handleIdSet:
-	handle = {}
-	rows = cursor.execute('select * from handle inner join chat_handle_join where chat_handle_join.handle_id = handle.ROWID and ROWID = ?', (handleId, )).fetchall()
+	If columnar is True, messages are sent as {'columns': [...], 'rows':
+	[[...], ...]}, naming each column once instead of in every row.
+	"""
+	result = {table: [] for table in TABLES}
+	for record in streamUpdates(conn, lastTime, stats, sinceSeq, pageSize, columnar):
+		if 'end' in record:
+			del record['end']
+			result.update(record)
+		elif 'columns' in record:
+			result[record['table']] = {'columns': record['columns'], 'rows': []}
+		elif 'values' in record:
+			result[record['table']]['rows'].append(record['values'])
+		else:
+			result[record['table']].append(record['row'])
+	return result
+
+
+def streamUpdates(conn, lastTime, stats=None, sinceSeq=None, pageSize=None, columnar=False):
+	"""Yield the rows getUpdates returns one at a time as records like
+	{'table': 'message', 'row': {...}}, reading chat.db as they are
+	consumed. The last record is {'end': True} along with the cursor and
+	more, if there is a change log.
+
+	If columnar is True, messages start with a {'table': 'message',
+	'columns': [...]} record and each one is sent as {'table': 'message',
+	'values': [...]} in the same order.
+
+	Messages are yielded straight from the query, so memory doesn't grow
+	with the size of the update. Only the ids needed to look up the other
+	tables are kept.
+	"""
+	if stats is None:
+		stats = ExportStats()
+	conn.execute('BEGIN')
+	try:
+		yield from readUpdates(conn, lastTime, stats, sinceSeq, pageSize, columnar)
+	finally:
+		conn.rollback()
+
+
+def readUpdates(conn, lastTime, stats, sinceSeq, pageSize, columnar):
+	# Each table is read with a fixed number of set-based queries (IN lists
+	# over the ids found by the message scan) instead of a query per row.
+	changeLog = hasChangeLog(conn)
+	if changeLog and sinceSeq is None and not lastTime:
+		# A first sync asks for everything, which the change log can page.
+		sinceSeq = 0
+	cursor = conn.cursor()
+
+	if changeLog:
+		with stats.phase('cursor'):
+			rows = stats.execute(cursor, 'SELECT max(seq) FROM message_change')
+			lastSeq = max(rows[0][0] or 0, sinceSeq or 0)
+			endSeq = lastSeq
+			if pageSize and sinceSeq is not None:
+				rows = stats.execute(cursor, PAGE_END_SQL, (sinceSeq, pageSize - 1))
+				if rows:
+					endSeq = rows[0][0]
+
+	messageIdSet = set()
+	chatMessageSet = set()
+	messageAttachmentSet = set()
+	attachmentIdSet = set()
+	chatIdSet = set()
+	handleIdSet = set()
+
+	if columnar:
+		yield {'table': 'message', 'columns': neededColumnsMessage}
+	with stats.phase('messages'):
+		columns = ', '.join('message.' + c for c in neededColumnsMessage)
+		if sinceSeq is not None and changeLog:
+			rows = stats.iterate(cursor, CHANGES_SQL.format(columns), (sinceSeq, endSeq))
+		else:
+			rows = stats.iterate(cursor, MESSAGES_SQL.format(columns), (lastTime, ))
+		for row in rows:
+			if (row['ROWID'], row['chat_id']) not in chatMessageSet:
+				chatMessageSet.add((row['ROWID'], row['chat_id']))
+				yield {'table': 'chat_message_join', 'row': {
+					'message_id': row['ROWID'],
+					'chat_id': row['chat_id']
+					}}
+			if row['attachment_id'] != None and (row['ROWID'], row['attachment_id']) not in messageAttachmentSet:
+				messageAttachmentSet.add((row['ROWID'], row['attachment_id']))
+				attachmentIdSet.add(row['attachment_id'])
+				yield {'table': 'message_attachment_join', 'row': {
+					'message_id': row['ROWID'],
+					'attachment_id': row['attachment_id']
+					}}
+			chatIdSet.add(row['chat_id'])
+			handleIdSet.add(row['handle_id'])
+			handleIdSet.add(row['other_handle'])
+
+			# A message joined to several chats or attachments appears once per
+			# combination, but only needs to be sent once.
+			if row['ROWID'] in messageIdSet:
+				continue
+			messageIdSet.add(row['ROWID'])
+			message = {}
+			for column in neededColumnsMessage:
+				message[column] = row[column]
+			message['date'] = appleTimeToUnix(message['date'])
+			message['date_read'] = appleTimeToUnix(message['date_read'])
+			message['date_delivered'] = appleTimeToUnix(message['date_delivered'])
+			if columnar:
+				yield {'table': 'message', 'values': list(message.values())}
+			else:
+				yield {'table': 'message', 'row': message}
+	# Join rows are only needed to remove duplicates within a message.
+	chatMessageSet = messageAttachmentSet = messageIdSet = None
+
+	with stats.phase('attachments'):
+		rows = selectIn(stats, cursor, ATTACHMENTS_SQL, attachmentIdSet, neededColumnsAttachment)
+	for row in rows:
+		yield {'table': 'attachment', 'row': dict(row)}
+
+	with stats.phase('chats'):
+		rows = selectIn(stats, cursor, CHATS_SQL, chatIdSet, neededColumnsChat)
+	chatIds = set()
+	for row in rows:
+		chatIds.add(row['ROWID'])
+		yield {'table': 'chat', 'row': dict(row)}
+
+	# Every member of an updated chat is sent along with the chat.
+	with stats.phase('chat members'):
+		rows = selectIn(stats, cursor, CHAT_HANDLES_SQL, chatIds)
 	for row in rows:
-		for column in neededColumnsHandle:
-			handle[column] = row[column]
-		chat_handle_joins.append({
-			'handle_id': row['ROWID'],
-			'chat_id': row['chat_id']
-			})
-	handles.append(handle)
-
-response = {
-	'attachment': attachments,
-	'message_attachment_join': message_attachment_joins,
-	'chat': chats,
-	'handle': handles,
-	'message': messages,
-	'chat_handle_join': chat_handle_joins,
-	'chat_message_join': chat_message_joins
-}
-
-print(json.dumps(response))
+		handleIdSet.add(row['handle_id'])
+
+	with stats.phase('chat_handle_join'):
+		rows = selectIn(stats, cursor, HANDLE_CHATS_SQL, handleIdSet)
+	joinedHandleIdSet = set()
+	for row in rows:
+		joinedHandleIdSet.add(row['handle_id'])
+		yield {'table': 'chat_handle_join', 'row': {'handle_id': row['handle_id'], 'chat_id': row['chat_id']}}
+
+	# Only handles that belong to a chat are sent.
+	with stats.phase('handles'):
+		rows = selectIn(stats, cursor, HANDLES_SQL, joinedHandleIdSet, neededColumnsHandle)
+	for row in rows:
+		yield {'table': 'handle', 'row': dict(row)}
+
+	end = {'end': True}
+	if changeLog:
+		end['cursor'] = endSeq
+		end['more'] = endSeq < lastSeq
+	yield end
+
+
+def connect(chatDbPath):
+	conn = sqlite3.connect(chatDbPath)
+	conn.row_factory = sqlite3.Row
+	return conn
+
+
+def main(argv):
+	# getMessages.py <last update time> [--timing]
+	args = [a for a in argv[1:] if a != '--timing']
+	timing = len(args) != len(argv) - 1
+	if len(args) != 1:
+		print('Not enough args')
+		exit(1)
+
+	dirname = os.path.dirname(__file__)
+	configFile = os.path.join(dirname, 'config.json')
+	config = json.load(open(configFile))
+	conn = connect(config['chatLocation'])
+
+	stats = ExportStats()
+	response = getUpdates(conn, args[0], stats)
+
+	print(json.dumps(response))
+	sys.stdout.flush()
+	if timing:
+		stats.report()
+
+
+if __name__ == '__main__':
+	main(sys.argv)
@@ -0,0 +1,69 @@
+import sys
+import os
+import json
+import getMessages
+
+
+# exportDaemon.py is started once by index.js and answers update requests for
+# as long as the server runs, so the interpreter, config and chat.db
+# connection (along with its statement cache) stay warm between polls.
+#
+# Protocol: each line written to stdin is a JSON request such as
+#	{"last_update_time": 1596330123}
+# or, resuming from the cursor of an earlier response,
+#	{"since_seq": 52811, "page_size": 5000, "columnar": true}
+# and is answered by exactly one line on stdout holding the same JSON document
+# getMessages.py would print, or {"error": "..."} if the export failed.
+# Requests are answered in the order they are received.
+#
+# A request with "format": "ndjson" is instead answered with one line per
+# record of getMessages.streamUpdates, written as chat.db is read. The last
+# line starts with {"end": true and holds the cursor, or an "error" if the
+# export failed part way through.
+
+
+def exportArgs(request):
+	lastTime = request.get('last_update_time')
+	if lastTime is None:
+		lastTime = 0
+	return (lastTime, None, request.get('since_seq'), request.get('page_size'), bool(request.get('columnar')))
+
+
+def handleRequest(conn, request):
+	return getMessages.getUpdates(conn, *exportArgs(request))
+
+
+def streamRequest(conn, request, outfile):
+	try:
+		for record in getMessages.streamUpdates(conn, *exportArgs(request)):
+			outfile.write(json.dumps(record) + '\n')
+	except Exception as e:
+		outfile.write(json.dumps({'end': True, 'error': str(e)}) + '\n')
+
+
+def serve(conn, infile, outfile):
+	for line in infile:
+		if not line.strip():
+			continue
+		try:
+			request = json.loads(line)
+			if request.get('format') == 'ndjson':
+				streamRequest(conn, request, outfile)
+				outfile.flush()
+				continue
+			response = handleRequest(conn, request)
+		except Exception as e:
+			response = {'error': str(e)}
+		outfile.write(json.dumps(response) + '\n')
+		outfile.flush()
+
+
+def main():
+	from dotenv import load_dotenv
+	load_dotenv()
+	conn = getMessages.connect(os.getenv('CHAT_PATH'))
+	serve(conn, sys.stdin, sys.stdout)
+
+
+if __name__ == '__main__':
+	main()
@@ -2,9 +2,12 @@ const express = require('express')
 const sqlite = require('sqlite3')
 const bodyParser = require('body-parser')
 const spawn = require("child_process").spawn;
+const readline = require('readline')
 const path = require('path');
 const https = require('https')
 const fs = require('fs')
+const crypto = require('crypto')
+const zlib = require('zlib')
 
 require('dotenv').config();
 
@@ -159,37 +162,89 @@ app.post('/rename', (req, res) => {
   }
 })
 
+// Look up the path of an attachment in chat.db.
+// callback(err, filename) - err is an object suitable for the response body.
+function attachmentPath(rowId, callback) {
+	let db = new sqlite.Database(messageDbPath)
+	db.get('SELECT filename FROM attachment WHERE ROWID = ?', rowId, function(err, row) {
+		if (err != null)
+			return callback(err)
+		if (row == null || row.filename == null)
+			return callback('No file could be found for ROWID ' + rowId)
+		let filename = row.filename
+		if (filename[0] === '~')
+			filename = path.join(process.env.HOME, filename.slice(1));
+		return callback(null, filename)
+	})
+	db.close()
+}
+
+// Digests are cached by path, size and modification time, since hashing a
+// large video for every download would cost more than the download saves.
+var digestCache = new Map()
+
+function fileDigest(filename, callback) {
+	fs.stat(filename, (err, stat) => {
+		if (err)
+			return callback(err)
+		let key = filename + ':' + stat.size + ':' + stat.mtimeMs
+		if (digestCache.has(key))
+			return callback(null, digestCache.get(key))
+		let hash = crypto.createHash('sha256')
+		fs.createReadStream(filename)
+			.on('error', callback)
+			.on('data', (chunk) => hash.update(chunk))
+			.on('end', () => {
+				let digest = { size: stat.size, sha256: hash.digest('hex') }
+				if (digestCache.size >= 1000)
+					digestCache.delete(digestCache.keys().next().value)
+				digestCache.set(key, digest)
+				return callback(null, digest)
+			})
+	})
+}
+
+// Ranges are served so that an interrupted download can resume where it
+// stopped, e.g. "Range: bytes=1048576-" is answered with a 206.
 app.get('/sent/attachment/:id', (req, res) => {
 	var rowId = parseId(req.params.id)
 	if (isNaN(rowId))
 		return handleBadId(res)
 
-	let db = new sqlite.Database(messageDbPath)
-	db.get('SELECT filename FROM attachment WHERE ROWID = ?', rowId, function(err, row) {
-		if (err == null) {
-			if (row == null) {
+	attachmentPath(rowId, (err, filename) => {
+		if (err)
+			return res.status(400).send({
+				error: err
+			})
+		res.sendFile(filename, { acceptRanges: true }, (err) => {
+			if (err && !res.headersSent)
 				return res.status(400).send({
-					error: 'No file could be found for ROWID ' + rowId
+					error: err
 				})
-			}
-			else {
-				filename = row.filename
-				if (filename[0] === '~')
-					filename = path.join(process.env.HOME, filename.slice(1));
-				res.sendFile(filename, (err) => {
-					if (err)
-						return res.status(400).send({
-							error: err
-						})
-				})
-			}
-		}
-		else
+		})
+	})
+})
+
+// Returns the size and SHA-256 of an attachment so a finished download can be
+// verified.
+app.get('/sent/attachment/:id/digest', (req, res) => {
+	var rowId = parseId(req.params.id)
+	if (isNaN(rowId))
+		return handleBadId(res)
+
+	attachmentPath(rowId, (err, filename) => {
+		if (err)
 			return res.status(400).send({
 				error: err
 			})
-	  })
-	  db.close()
+		fileDigest(filename, (err, digest) => {
+			if (err)
+				return res.status(400).send({
+					error: err.message
+				})
+			return res.send(digest)
+		})
+	})
 })
 
 app.get('/:table/:id', (req, res) => {
@@ -234,19 +289,285 @@ app.post('/attachment', (req, res) => {
   res.send('Not implemented')
 })
 
+// exportDaemon.py is kept running and answers one JSON line per request, so
+// polls don't pay for a new python process and a fresh chat.db connection.
+// Responses come back in request order, so callbacks are kept in a queue.
+// Streamed (ndjson) requests are answered with a line per record instead,
+// the last of which starts with {"end": true.
+var exporter = null
+var pendingExports = []
+
+function startExporter() {
+	exporter = spawn('python', ['./exportDaemon.py'])
+	let lines = readline.createInterface({ input: exporter.stdout })
+	lines.on('line', (line) => {
+		let pending = pendingExports[0]
+		if (pending == null)
+			return
+		if (pending.onRecord) {
+			pending.onRecord(line)
+			if (!line.startsWith('{"end"'))
+				return
+		}
+		pendingExports.shift()
+		pending.callback(null, line)
+	})
+	exporter.stderr.on('data', (data) => {
+		console.log(data.toString())
+	})
+	exporter.on('exit', () => {
+		exporter = null
+		let failed = pendingExports
+		pendingExports = []
+		failed.forEach((pending) => pending.callback(new Error('exportDaemon.py exited')))
+	})
+}
+
+function requestExport(request, callback) {
+	if (exporter == null)
+		startExporter()
+	pendingExports.push({ callback: callback })
+	exporter.stdin.write(JSON.stringify(request) + '\n')
+}
+
+// Like requestExport for a streamed request, but onRecord is called with each
+// line as the exporter writes it.
+function requestStream(request, onRecord, callback) {
+	if (exporter == null)
+		startExporter()
+	request.format = 'ndjson'
+	pendingExports.push({ onRecord: onRecord, callback: callback })
+	exporter.stdin.write(JSON.stringify(request) + '\n')
+}
+
+// Every request shares the exporter's stdout, so it isn't paused for a slow
+// client. Its lines queue up in its own response instead, and a client that
+// falls more than MAX_BUFFERED_BYTES behind is cut off. A stream without its
+// end line is discarded, so the client just asks again.
+const MAX_BUFFERED_BYTES = 16 * 1024 * 1024
+
+// Returns false once the client has been cut off.
+function sendRecord(res, out, line) {
+	out.write(line + '\n')
+	if (out.writableLength <= MAX_BUFFERED_BYTES)
+		return true
+	res.destroy()
+	return false
+}
+
+// Update payloads repeat the same keys in every row, so they compress well.
+// Returns the stream to write the body to: a zstd or gzip encoder piped to
+// res if the client accepts one, otherwise res itself. Bodies known to be
+// smaller than COMPRESS_MIN_BYTES aren't worth compressing.
+const COMPRESS_MIN_BYTES = 1024
+
+function compressedBody(req, res, size) {
+	res.setHeader('Vary', 'Accept-Encoding')
+	if (size != null && size < COMPRESS_MIN_BYTES)
+		return res
+	let accepted = req.headers['accept-encoding'] || ''
+	let encoder = null
+	if (zlib.createZstdCompress && /\bzstd\b/.test(accepted)) {
+		res.setHeader('Content-Encoding', 'zstd')
+		encoder = zlib.createZstdCompress()
+	}
+	else if (/\bgzip\b/.test(accepted)) {
+		res.setHeader('Content-Encoding', 'gzip')
+		encoder = zlib.createGzip()
+	}
+	if (encoder == null)
+		return res
+	encoder.pipe(res)
+	return encoder
+}
+
+// Push what has been written so far through the encoder, for streams like
+// /events whose reader is waiting on each part.
+function flushBody(out) {
+	if (out.flush)
+		out.flush()
+}
+
 app.get('/update', (req, res) => {
 	var last_update_time = req.body.last_update_time
 	if (last_update_time == null)
 		last_update_time = 0
-  const pythonProcess = spawn('python', ["./getMessages.py", last_update_time]);
-  pythonProcess.stdout.on('data', (data) => {
-      res.write(data);
-  });
-  pythonProcess.stdout.on('end', () => {
-  	res.end()
-  })
+	// since_seq is the cursor from an earlier response. It is exact, so
+	// clients that have one don't need last_update_time. With page_size, a
+	// response holds at most that many changes and sets more if the client
+	// should ask again from its cursor.
+	let request = {
+		last_update_time: last_update_time,
+		since_seq: req.body.since_seq,
+		page_size: req.body.page_size,
+		columnar: req.body.columnar
+	}
+	// With format ndjson, the update is sent as one record per line while
+	// chat.db is read, ending with a line holding "end", instead of as one
+	// JSON document.
+	if (req.body.format == 'ndjson') {
+		res.type('application/x-ndjson')
+		let out = compressedBody(req, res)
+		let closed = false
+		res.on('close', () => closed = true)
+		return requestStream(request, (line) => {
+			if (!closed)
+				closed = !sendRecord(res, out, line)
+		}, (err) => {
+			if (closed)
+				return
+			// A stream cut short has no end line, so the client discards it.
+			return err ? res.destroy() : out.end()
+		})
+	}
+	requestExport(request, (err, line) => {
+		if (err)
+			return res.status(500).send({
+				error: err.message
+			})
+		res.type('json')
+		return compressedBody(req, res, line.length).end(line)
+	})
 })
 
+// Server-sent events: GET /events?since_seq=<cursor> or
+// GET /events?last_update_time=<unix seconds> holds the connection open and
+// pushes an "update" event holding the same document as /update whenever
+// chat.db changes, so an idle client sends no requests.
+// Each event's id is the cursor to reconnect with. If chat.db has the
+// message_change table this is the change sequence number from the document,
+// which covers exactly the changes sent. Otherwise it is a second before the
+// export started, so a message written in the same second as an export is
+// sent again rather than missed. If page_size is given, a long history is
+// sent as several events of at most that many changes.
+const HEARTBEAT_MS = 5000
+var subscribers = new Set()
+var watchDb = null
+var dataVersion = null
+
+function sendEvent(out, id, data) {
+	out.write('event: update\nid: ' + id + '\ndata: ' + data + '\n\n')
+	flushBody(out)
+}
+
+function messageCount(update) {
+	if (update.message == null)
+		return 0
+	// Columnar messages are an object holding rows.
+	return Array.isArray(update.message) ? update.message.length : update.message.rows.length
+}
+
+// Ends a subscriber's stream. Its client reconnects from the last id it got.
+function dropSubscriber(subscriber) {
+	clearInterval(subscriber.heartbeat)
+	subscribers.delete(subscriber)
+	subscriber.out.end()
+}
+
+function pushUpdate(subscriber, always) {
+	if (subscriber.busy) {
+		subscriber.dirty = true
+		return
+	}
+	subscriber.busy = true
+	let cursor = Math.floor(Date.now() / 1000) - 1
+	requestExport({
+		last_update_time: subscriber.cursor,
+		since_seq: subscriber.seq,
+		page_size: subscriber.pageSize,
+		columnar: subscriber.columnar
+	}, (err, line) => {
+		subscriber.busy = false
+		// The client may have gone while the export ran.
+		if (!subscribers.has(subscriber))
+			return
+		if (err)
+			return dropSubscriber(subscriber)
+		let update = JSON.parse(line)
+		// A failed export comes back as {"error": ...}, which isn't an update.
+		if (update.error != null) {
+			console.log('Export failed: ' + update.error)
+			return dropSubscriber(subscriber)
+		}
+		if (update.cursor != null)
+			subscriber.seq = update.cursor
+		if (always || messageCount(update) > 0)
+			sendEvent(subscriber.out, update.cursor != null ? update.cursor : cursor, line)
+		subscriber.cursor = cursor
+		if (update.more)
+			subscriber.dirty = true
+		if (subscriber.dirty) {
+			subscriber.dirty = false
+			pushUpdate(subscriber, false)
+		}
+	})
+}
+
+// PRAGMA data_version changes whenever another connection commits to
+// chat.db, so it tells a real change from a file event for a read.
+function checkForChanges() {
+	watchDb.get('PRAGMA data_version', (err, row) => {
+		if (err || row.data_version === dataVersion)
+			return
+		dataVersion = row.data_version
+		subscribers.forEach((subscriber) => pushUpdate(subscriber, false))
+	})
+}
+
+function startWatching() {
+	watchDb = new sqlite.Database(messageDbPath, sqlite.OPEN_READONLY)
+	checkForChanges()
+	let pending = null
+	// Messages writes to chat.db-wal, so watch the whole folder.
+	fs.watch(path.dirname(messageDbPath), (eventType, filename) => {
+		if (filename && !filename.startsWith(path.basename(messageDbPath)))
+			return
+		if (pending == null)
+			pending = setTimeout(() => {
+				pending = null
+				checkForChanges()
+			}, 50)
+	})
+	// In case a file event is missed.
+	setInterval(checkForChanges, 2000)
+}
+
+app.get('/events', (req, res) => {
+	let lastUpdateTime = parseInt(req.query.last_update_time)
+	let sinceSeq = parseInt(req.query.since_seq)
+	let pageSize = parseInt(req.query.page_size)
+	let out = compressedBody(req, res)
+	res.writeHead(200, {
+		'Content-Type': 'text/event-stream',
+		'Cache-Control': 'no-cache',
+		'Connection': 'keep-alive'
+	})
+	res.flushHeaders()
+	if (watchDb == null)
+		startWatching()
+
+	let subscriber = {
+		out: out,
+		cursor: isNaN(lastUpdateTime) ? 0 : lastUpdateTime,
+		seq: isNaN(sinceSeq) ? null : sinceSeq,
+		pageSize: isNaN(pageSize) ? null : pageSize,
+		columnar: req.query.columnar == '1' || req.query.columnar == 'true',
+		busy: false,
+		dirty: false,
+		heartbeat: null
+	}
+	subscribers.add(subscriber)
+	// Catch the client up straight away.
+	pushUpdate(subscriber, true)
+	subscriber.heartbeat = setInterval(() => {
+		out.write(': keepalive\n\n')
+		flushBody(out)
+	}, HEARTBEAT_MS)
+	req.on('close', () => {
+		clearInterval(subscriber.heartbeat)
+		subscribers.delete(subscriber)
+	})
+})
 
 var key = fs.readFileSync('./server.key', 'utf8')
 var cert = fs.readFileSync('./server.crt', 'utf8')
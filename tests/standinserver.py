@@ -0,0 +1,320 @@
+"""
+A local HTTPS stand-in for the remote node server, for tests that need to talk
+to a real server over mutual TLS.
+
+Certificates are generated with openssl the same way INSTALL does. Handlers
+are registered per path on the server and receive the BaseHTTPRequestHandler.
+"""
+import gzip
+import importlib.util
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+serverDir = os.path.join(os.path.dirname(__file__), '..', 'remoteCode',
+                         'node-server')
+
+
+def haveOpenssl():
+    return shutil.which('openssl') is not None
+
+
+def createCerts(directory):
+    """Create server.crt/key and a client.crt/key signed by the server
+    certificate in directory and return their paths."""
+    def openssl(*args):
+        subprocess.run(('openssl', ) + args, cwd=directory, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    openssl('req', '-newkey', 'rsa:2048', '-nodes', '-keyout', 'server.key',
+            '-x509', '-days', '1', '-out', 'server.crt', '-subj',
+            '/CN=localhost', '-addext',
+            'subjectAltName=DNS:localhost,IP:127.0.0.1')
+    openssl('req', '-newkey', 'rsa:2048', '-nodes', '-keyout', 'client.key',
+            '-out', 'client.csr', '-subj', '/CN=iMessageForwarderClient')
+    openssl('x509', '-req', '-in', 'client.csr', '-CA', 'server.crt',
+            '-CAkey', 'server.key', '-out', 'client.crt', '-set_serial', '01',
+            '-days', '1')
+    return {key: os.path.join(directory, filename) for key, filename in
+            (('server', 'server.crt'), ('serverKey', 'server.key'),
+             ('client', 'client.crt'), ('clientKey', 'client.key'))}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Keep-alive needs HTTP/1.1 and a Content-Length on every response.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.dispatch('GET', self)
+
+    def do_POST(self):
+        self.server.dispatch('POST', self)
+
+    def sendBody(self, body, status=200, contentType='application/json',
+                 headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def sendRange(self, body, dropAfter=None):
+        """Send body, or the part of it asked for by a Range header like
+        express does. If dropAfter is set, the connection is closed after
+        that many bytes of the response body."""
+        size = len(body)
+        start = 0
+        rangeHeader = self.headers.get('Range')
+        if rangeHeader:
+            start = int(rangeHeader.split('=')[1].split('-')[0])
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, size - 1, size))
+        else:
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(size - start))
+        self.end_headers()
+        if dropAfter is None:
+            self.wfile.write(body[start:])
+        else:
+            self.wfile.write(body[start:start + dropAfter])
+            self.close_connection = True
+
+    def startChunked(self, contentType):
+        """Start a response whose body is written with sendChunk, like
+        express does for res.write."""
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def sendChunk(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def endChunked(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def readBody(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    """An HTTPS server on a free local port that requires a client
+    certificate signed by its own certificate."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.certs = createCerts(self.tempDir.name)
+        self.routes = {}
+        self.requestCount = 0
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.certs['server'], self.certs['serverKey'])
+        context.verify_mode = ssl.CERT_REQUIRED
+        context.load_verify_locations(self.certs['server'])
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def route(self, method, path, handler):
+        self.routes[(method, path)] = handler
+
+    def dispatch(self, method, request):
+        self.requestCount += 1
+        path = request.path.split('?')[0]
+        handler = self.routes.get((method, path))
+        if handler is None:
+            # Routes ending in / match any path under them, longest first.
+            prefixes = [p for m, p in self.routes if m == method and
+                        p.endswith('/') and path.startswith(p)]
+            if prefixes:
+                handler = self.routes[(method, max(prefixes, key=len))]
+        if handler is None:
+            request.sendBody('{"error": "not found"}', status=404)
+        else:
+            handler(request)
+
+    def secrets(self, **extra):
+        secrets = {
+            'user': 'test',
+            'ip': 'localhost',
+            'serverCrt': self.certs['server'],
+            'clientCrt': self.certs['client'],
+            'clientKey': self.certs['clientKey']
+        }
+        secrets.update(extra)
+        return secrets
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+        self.tempDir.cleanup()
+
+
+def loadExporter():
+    """Import remoteCode/node-server/getMessages.py, the exporter index.js
+    runs through exportDaemon.py."""
+    spec = importlib.util.spec_from_file_location(
+        'getMessages', os.path.join(serverDir, 'getMessages.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class UpdateFeed:
+    """Serves /update and, if push is True, /events from a chat.db the way
+    index.js does, with change cursors if the chat.db has a change log and
+    streamed records if ndjson is True. Call notify() after writing to
+    chat.db, where index.js would see a file event and a new PRAGMA
+    data_version."""
+
+    def __init__(self, server, chatDbPath, push=True, heartbeat=5,
+                 ndjson=True):
+        self.exporter = loadExporter()
+        self.chatDbPath = chatDbPath
+        self.ndjson = ndjson
+        self.heartbeat = heartbeat
+        self.changed = threading.Condition()
+        self.version = 0
+        self.closed = False
+        # Messages sent in /update responses and events, overlaps included.
+        self.messagesSent = 0
+        # Bytes of /update JSON bodies, after any compression.
+        self.bytesSent = 0
+        server.route('GET', '/update', self.update)
+        if push:
+            server.route('GET', '/events', self.events)
+
+    def notify(self):
+        with self.changed:
+            self.version += 1
+            self.changed.notify_all()
+
+    def close(self):
+        with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+    def export(self, lastTime, sinceSeq=None, pageSize=None,
+               columnar=False):
+        conn = self.exporter.connect(self.chatDbPath)
+        try:
+            output = self.exporter.getUpdates(
+                conn, lastTime, sinceSeq=sinceSeq, pageSize=pageSize,
+                columnar=columnar)
+        finally:
+            conn.close()
+        messages = output['message']
+        if isinstance(messages, dict):
+            messages = messages['rows']
+        self.messagesSent += len(messages)
+        return output, len(messages)
+
+    def update(self, request):
+        body = request.readBody()
+        body = json.loads(body) if body else {}
+        if self.ndjson and body.get('format') == 'ndjson':
+            return self.stream(request, body)
+        output, _ = self.export(body.get('last_update_time') or 0,
+                                body.get('since_seq'), body.get('page_size'),
+                                bool(body.get('columnar')))
+        body = json.dumps(output).encode()
+        headers = {}
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        self.bytesSent += len(body)
+        request.sendBody(body, headers=headers)
+
+    def stream(self, request, body):
+        request.startChunked('application/x-ndjson')
+        conn = self.exporter.connect(self.chatDbPath)
+        try:
+            for record in self.exporter.streamUpdates(
+                    conn, body.get('last_update_time') or 0, None,
+                    body.get('since_seq'), body.get('page_size'),
+                    bool(body.get('columnar'))):
+                if (record.get('table') == 'message' and
+                        'columns' not in record):
+                    self.messagesSent += 1
+                request.sendChunk(json.dumps(record) + '\n')
+        finally:
+            conn.close()
+        request.endChunked()
+
+    def events(self, request):
+        query = parse_qs(urlparse(request.path).query)
+        cursor = int(query.get('last_update_time', ['0'])[0])
+        sinceSeq = query.get('since_seq')
+        sinceSeq = int(sinceSeq[0]) if sinceSeq else None
+        pageSize = query.get('page_size')
+        pageSize = int(pageSize[0]) if pageSize else None
+        columnar = query.get('columnar', ['0'])[0] in ('1', 'true')
+        request.startChunked('text/event-stream')
+        request.close_connection = True
+
+        seen = self.version
+        first = True
+        try:
+            while not self.closed:
+                newCursor = int(time.time()) - 1
+                output, messages = self.export(cursor, sinceSeq, pageSize,
+                                               columnar)
+                sinceSeq = output.get('cursor', sinceSeq)
+                if first or messages:
+                    request.sendChunk('event: update\nid: {}\ndata: {}\n\n'
+                                      .format(output.get('cursor', newCursor),
+                                              json.dumps(output)))
+                cursor = newCursor
+                first = False
+                if output.get('more'):
+                    continue
+                while True:
+                    with self.changed:
+                        self.changed.wait_for(
+                            lambda: self.version != seen or self.closed,
+                            timeout=self.heartbeat)
+                        changed = self.version != seen
+                        seen = self.version
+                    if changed or self.closed:
+                        break
+                    request.sendChunk(': keepalive\n\n')
+            request.endChunked()
+        except (BrokenPipeError, ConnectionResetError, ssl.SSLError):
+            pass
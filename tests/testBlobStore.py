@@ -0,0 +1,101 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+from localCode.messageApi import blobstore
+
+
+class TestBlobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.store = blobstore.BlobStore(self.tempDir.name)
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('CREATE TABLE attachment (ROWID INTEGER PRIMARY '
+                          'KEY, guid TEXT, filename TEXT)')
+        self.conn.executemany('INSERT INTO attachment VALUES (?, ?, ?)',
+                              [(rowid, 'ATT-{}'.format(rowid), 'old')
+                               for rowid in (1, 2, 3)])
+        blobstore.createTables(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        self.tempDir.cleanup()
+
+    def addBlob(self, body):
+        partPath = os.path.join(self.tempDir.name, 'blob.part')
+        with open(partPath, 'wb') as outfile:
+            outfile.write(body)
+        sha256 = blobstore.sha256File(partPath)
+        self.store.commit(partPath, sha256)
+        return sha256
+
+    def link(self, rowid, sha256, size):
+        with self.conn:
+            return self.store.link(self.conn, rowid, 'ATT-{}'.format(rowid),
+                                   sha256, size)
+
+    def refcounts(self):
+        return dict(self.conn.execute('SELECT sha256, refcount FROM blob'))
+
+    def test_link(self):
+        sha256 = self.addBlob(b'image')
+        path = self.link(1, sha256, 5)
+        self.link(2, sha256, 5)
+
+        self.assertEqual(path, os.path.join(self.tempDir.name, sha256[:2],
+                                            sha256))
+        self.assertTrue(self.store.has(sha256, 5))
+        self.assertFalse(self.store.has(sha256, 6))
+        self.assertEqual(self.refcounts(), {sha256: 2})
+        self.assertEqual(self.conn.execute(
+            'SELECT filename FROM attachment WHERE ROWID = 2').fetchone(),
+            (path, ))
+        self.assertEqual(self.store.linkedPaths(self.conn, [1, 2, 3]),
+                         {1: path, 2: path})
+
+    def test_relink_moves_reference(self):
+        first = self.addBlob(b'first')
+        second = self.addBlob(b'second')
+        self.link(1, first, 5)
+        self.link(1, first, 5)
+        self.assertEqual(self.refcounts(), {first: 1})
+        self.link(1, second, 6)
+        self.assertEqual(self.refcounts(), {first: 0, second: 1})
+
+    def test_collect_garbage(self):
+        kept = self.addBlob(b'kept')
+        orphaned = self.addBlob(b'orphaned')
+        self.link(1, kept, 4)
+        self.link(2, orphaned, 8)
+        with self.conn:
+            self.conn.execute('DELETE FROM attachment WHERE ROWID = 2')
+
+        dryRun = self.store.collectGarbage(self.conn, dryRun=True)
+        self.assertEqual(dryRun, {'blobs': 1, 'bytes': 8})
+        self.assertTrue(self.store.has(orphaned, 8))
+        self.assertEqual(self.refcounts(), {kept: 1, orphaned: 1})
+
+        result = self.store.collectGarbage(self.conn)
+        self.assertEqual(result, {'blobs': 1, 'bytes': 8})
+        self.assertFalse(os.path.exists(self.store.blobPath(orphaned)))
+        self.assertTrue(self.store.has(kept, 4))
+        self.assertEqual(self.refcounts(), {kept: 1})
+        self.assertEqual(self.store.collectGarbage(self.conn),
+                         {'blobs': 0, 'bytes': 0})
+
+    def test_stats(self):
+        sha256 = self.addBlob(b'image')
+        for rowid in (1, 2, 3):
+            self.link(rowid, sha256, 5)
+        self.assertEqual(self.store.stats(self.conn), {
+            'blobs': 1,
+            'attachments': 3,
+            'storedBytes': 5,
+            'referencedBytes': 15,
+            'savedBytes': 10
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -178,6 +178,52 @@ class TestChatMethods(unittest.TestCase):
 
         self.assertDictEqual(chat.messageList.messages[msg.ROWID].messageParts[0].reactions, correctReactionDict)
 
+    def test__add_message_reaction_before_message(self):
+        chat = api.Chat(ROWID=1)
+        msg = api.Message(ROWID=2)
+        reaction = api.Reaction(ROWID=3, associated_message_id=2,
+                                handle_id=1, associated_message_type=2000)
+
+        chat._addMessage(reaction)
+        chat._addMessage(msg)
+
+        self.assertEqual(chat.messageList.pendingReactions, {})
+        self.assertIs(msg.messageParts[0].reactions[1][0], reaction)
+
+    def test_unload_messages(self):
+        chat = api.Chat(ROWID=1)
+        msg = api.Message(ROWID=2, date=10)
+        reaction = api.Reaction(ROWID=3, associated_message_id=1,
+                                handle_id=1, associated_message_type=2000,
+                                date=20)
+        chat.addOlderMessages([msg, reaction], 100)
+        chat.sendMessage(self.StubMessagePasser(), 'hi', '')
+        sent = chat.getMessages()[-1]
+
+        chat.unloadMessages()
+
+        self.assertEqual(list(chat.getMessages()), [-1])
+        self.assertIs(chat.getMessages()[-1], sent)
+        self.assertEqual(chat.messageList.pendingReactions, {})
+        self.assertIs(chat.getMostRecentMessage(), sent)
+        self.assertEqual(chat.lastAccessTime, 0)
+        self.assertIsNone(chat.olderMessagesKey)
+
+    def test_add_older_messages(self):
+        chat = api.Chat(ROWID=1)
+        msgs = [api.Message(ROWID=5, date=50), api.Message(ROWID=4, date=60)]
+
+        chat.addOlderMessages(msgs, 100)
+
+        self.assertEqual(chat.olderMessagesKey, (50, 5))
+        self.assertEqual(chat.lastAccessTime, 100)
+        self.assertEqual(list(chat.getMessages()), [5, 4])
+
+        chat.addOlderMessages([])
+
+        self.assertIsNone(chat.olderMessagesKey)
+        self.assertEqual(chat.lastAccessTime, 100)
+
     def test__add_message_message(self):
         chat = api.Chat(ROWID=1)
         msg = api.Message(ROWID=1)
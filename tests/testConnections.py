@@ -0,0 +1,63 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import threading
+from localCode.messageApi import connections
+
+
+class TestConnectionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempDir.name, 'sms.db')
+        conn = sqlite3.connect(self.path)
+        conn.execute('CREATE TABLE message (ROWID INTEGER PRIMARY KEY)')
+        conn.close()
+        self.manager = connections.ConnectionManager()
+
+    def tearDown(self):
+        self.manager.close()
+        self.tempDir.cleanup()
+
+    def test_reused_on_thread(self):
+        conn = self.manager.connect(self.path)
+        self.assertIs(self.manager.connect(self.path), conn)
+        self.assertEqual(self.manager.opened, 1)
+        self.assertEqual(conn.row_factory, sqlite3.Row)
+
+    def test_one_per_thread(self):
+        conn = self.manager.connect(self.path)
+        others = []
+
+        def connect():
+            others.append(self.manager.connect(self.path))
+            others.append(self.manager.connect(self.path))
+            self.manager.close()
+
+        thread = threading.Thread(target=connect)
+        thread.start()
+        thread.join()
+        self.assertIs(others[0], others[1])
+        self.assertIsNot(others[0], conn)
+        self.assertEqual(self.manager.opened, 2)
+
+    def test_pragmas(self):
+        conn = self.manager.connect(self.path)
+        self.assertEqual(conn.execute('PRAGMA cache_size').fetchone()[0],
+                         connections.DEFAULT_CACHE_SIZE)
+        self.assertEqual(conn.execute('PRAGMA query_only').fetchone()[0], 1)
+        with self.assertRaises(sqlite3.OperationalError):
+            conn.execute('INSERT INTO message VALUES (1)')
+
+    def test_close(self):
+        conn = self.manager.connect(self.path)
+        self.manager.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute('SELECT 1')
+        self.assertIsNot(self.manager.connect(self.path), conn)
+        self.assertEqual(self.manager.opened, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
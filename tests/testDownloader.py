@@ -0,0 +1,246 @@
+import unittest
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from localCode.messageApi import blobstore, downloader, session
+from tests import standinserver
+
+BODIES = {rowid: os.urandom(300 * 1024) for rowid in (1, 2, 4, 5)}
+# The same image as attachment 1, forwarded to another chat.
+BODIES[6] = BODIES[1]
+
+
+def sha256(body):
+    return hashlib.sha256(body).hexdigest()
+
+
+@unittest.skipUnless(standinserver.haveOpenssl(), 'openssl is required')
+class TestAttachmentDownloader(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = standinserver.StandInServer()
+        cls.server.__enter__()
+        cls.ranges = []
+        cls.dropped = set()
+        cls.digests = True
+        cls.badDigests = False
+
+        def attachment(request):
+            parts = request.path.split('/')
+            rowid = int(parts[3])
+            if rowid not in BODIES:
+                return request.sendBody('Not found', status=404)
+            body = BODIES[rowid]
+            if len(parts) == 5:
+                if not cls.digests:
+                    return request.sendBody('Not found', status=404)
+                if cls.badDigests:
+                    return request.sendBody('<html>Sign in</html>')
+                digest = sha256(body) if rowid != 5 else '0' * 64
+                return request.sendBody(json.dumps({'size': len(body),
+                                                    'sha256': digest}))
+            cls.ranges.append((rowid, request.headers.get('Range')))
+            if rowid == 2:
+                # Drops every time, a little further along each time.
+                request.sendRange(body, dropAfter=2500)
+            elif rowid == 4 and rowid not in cls.dropped:
+                cls.dropped.add(rowid)
+                request.sendRange(body, dropAfter=len(body) // 2)
+            else:
+                request.sendRange(body)
+
+        cls.server.route('GET', '/sent/attachment/', attachment)
+        certs = cls.server.certs
+        session._session = session.HttpSession(
+            'localhost', certs['server'], certs['client'], certs['clientKey'],
+            port=cls.server.port, retries=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        session._session.close()
+        session._session = None
+        cls.server.__exit__()
+
+    def setUp(self):
+        self.ranges.clear()
+        type(self).digests = True
+        type(self).badDigests = False
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('CREATE TABLE attachment (ROWID INTEGER PRIMARY '
+                          'KEY, guid TEXT, filename TEXT)')
+        self.conn.executemany('INSERT INTO attachment VALUES (?, ?, ?)',
+                              [(rowid, 'ATT-{}'.format(rowid), 'old')
+                               for rowid in BODIES])
+        downloader.createTable(self.conn)
+        blobstore.createTables(self.conn)
+        self.store = blobstore.BlobStore(self.tempDir.name)
+        self.downloader = downloader.AttachmentDownloader(self.store,
+                                                          workers=2,
+                                                          chunkSize=1000,
+                                                          maxAttempts=2)
+
+    def tearDown(self):
+        self.downloader.shutdown()
+        self.conn.close()
+        self.tempDir.cleanup()
+
+    def finishDownloads(self):
+        deadline = time.monotonic() + 10
+        while self.downloader.queueDepth() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.downloader.poll(self.conn)
+
+    def enqueue(self, *rowids):
+        self.downloader.enqueue(self.conn, [(rowid, 'ATT-{}'.format(rowid))
+                                            for rowid in rowids])
+
+    def rows(self):
+        return self.conn.execute(
+            'SELECT attachment_id, status, attempts FROM attachment_download '
+            'ORDER BY attachment_id').fetchall()
+
+    def filename(self, rowid):
+        return self.conn.execute(
+            'SELECT filename FROM attachment WHERE ROWID = ?',
+            (rowid, )).fetchone()[0]
+
+    def assertStored(self, rowid):
+        path = self.store.blobPath(sha256(BODIES[rowid]))
+        self.assertEqual(self.filename(rowid), path)
+        with open(path, 'rb') as infile:
+            self.assertEqual(infile.read(), BODIES[rowid])
+
+    def storedFiles(self):
+        return sorted(name for _, _, names in os.walk(self.tempDir.name)
+                      for name in names)
+
+    def test_download(self):
+        self.enqueue(1)
+        self.assertEqual(self.rows(), [(1, 'pending', 0)])
+        self.assertEqual(self.finishDownloads(), [1])
+        self.assertStored(1)
+        self.assertEqual(self.rows(), [])
+        self.assertEqual(self.conn.execute(
+            'SELECT guid, sha256 FROM attachment_blob').fetchall(),
+            [('ATT-1', sha256(BODIES[1]))])
+        stats = self.downloader.stats()
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['bytes'], len(BODIES[1]))
+        self.assertGreater(stats['bytesPerSecond'], 0)
+        self.assertEqual(self.downloader.queueDepth(), 0)
+
+    def test_shutdown_cancels_queued_downloads(self):
+        self.downloader = downloader.AttachmentDownloader(self.store,
+                                                          workers=1)
+        # Keep the only worker busy so the downloads stay queued.
+        busy = threading.Event()
+        self.downloader.executor.submit(busy.wait, 10)
+        self.enqueue(1, 4)
+        futures = list(self.downloader.futures)
+
+        self.downloader.shutdown(wait=False)
+        busy.set()
+
+        self.assertEqual(len(futures), 2)
+        self.assertTrue(all(future.cancelled() for future in futures))
+        self.assertTrue(self.downloader.results.empty())
+
+    def test_duplicate_fetched_once(self):
+        self.enqueue(1, 6)
+        self.finishDownloads()
+        self.assertStored(1)
+        self.assertStored(6)
+        self.assertEqual(len(self.ranges), 1)
+        self.assertEqual(self.storedFiles(), [sha256(BODIES[1])])
+        self.assertEqual(self.conn.execute(
+            'SELECT refcount FROM blob').fetchall(), [(2, )])
+        stats = self.downloader.stats()
+        self.assertEqual(stats['bytes'], len(BODIES[1]))
+        self.assertEqual(stats['deduplicated'], 1)
+        self.assertEqual(self.downloader.blobLocks, {})
+
+    def test_bad_digest_retried(self):
+        type(self).badDigests = True
+        self.enqueue(1)
+        self.finishDownloads()
+        self.assertEqual(self.rows(), [(1, 'pending', 1)])
+        self.assertEqual(self.downloader.inFlight, set())
+        self.assertEqual(self.downloader.stats()['failed'], 1)
+
+    def test_download_without_digest_endpoint(self):
+        type(self).digests = False
+        self.enqueue(1)
+        self.finishDownloads()
+        self.assertStored(1)
+        self.enqueue(6)
+        self.finishDownloads()
+        # Fetched again, but stored once.
+        self.assertEqual(len(self.ranges), 2)
+        self.assertStored(6)
+        self.assertEqual(self.storedFiles(), [sha256(BODIES[1])])
+
+    def test_failed_download_retried_then_given_up(self):
+        self.enqueue(3)
+        self.downloader.retryDelay = 0
+        self.finishDownloads()
+        self.assertEqual(self.rows(), [(3, 'pending', 1)])
+        # poll resubmitted it straight away since retryDelay is 0.
+        self.finishDownloads()
+        self.assertEqual(self.rows(), [(3, 'failed', 2)])
+        self.assertEqual(self.downloader.queueDepth(), 0)
+
+    def test_interrupted_download_kept_as_part_file(self):
+        self.enqueue(2)
+        self.finishDownloads()
+        (rowid, status, attempts), = self.rows()
+        self.assertEqual((status, attempts), ('pending', 1))
+        self.assertGreater(self.conn.execute(
+            'SELECT next_attempt FROM attachment_download').fetchone()[0],
+            time.time())
+        # Resumed straight away while every attempt made progress. Only
+        # whole chunks are written, so each attempt keeps 2000 bytes.
+        attempts = downloader.RESUME_ATTEMPTS + 1
+        self.assertEqual(self.ranges[1:], [
+            (2, 'bytes={}-'.format(2000 * i)) for i in range(1, attempts)])
+        partPath = self.store.partPath(sha256(BODIES[2]))
+        with open(partPath, 'rb') as infile:
+            self.assertEqual(infile.read(), BODIES[2][:2000 * attempts])
+        self.assertEqual(self.filename(2), 'old')
+
+    def test_resume_after_drop(self):
+        self.enqueue(4)
+        self.finishDownloads()
+        self.assertEqual(self.ranges, [
+            (4, None),
+            (4, 'bytes={}-'.format(len(BODIES[4]) // 2 // 1000 * 1000))])
+        self.assertStored(4)
+        self.assertEqual(self.rows(), [])
+
+    def test_resume_part_file_from_previous_run(self):
+        partPath = self.store.partPath(sha256(BODIES[1]))
+        os.makedirs(os.path.dirname(partPath))
+        with open(partPath, 'wb') as outfile:
+            outfile.write(BODIES[1][:5000])
+        self.enqueue(1)
+        self.finishDownloads()
+        self.assertEqual(self.ranges, [(1, 'bytes=5000-')])
+        self.assertStored(1)
+        self.assertEqual(self.downloader.stats()['bytes'],
+                         len(BODIES[1]) - 5000)
+
+    def test_checksum_mismatch_discards_download(self):
+        self.enqueue(5)
+        self.finishDownloads()
+        self.assertEqual(self.rows(), [(5, 'pending', 1)])
+        self.assertEqual(self.storedFiles(), [])
+        self.assertEqual(self.filename(5), 'old')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from localCode.messageApi import events, session
+from tests import standinserver
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..',
+                                'benchmarks'))
+import syntheticdb  # noqa: E402
+
+
+class TestParseEvents(unittest.TestCase):
+
+    def test_parse_events(self):
+        lines = [
+            ': keepalive', '',
+            'event: update', 'id: 10', 'data: {"a":', 'data: 1}', '',
+            'data:no space', '',
+            'id: 11', '',
+            'data: unfinished'
+        ]
+        parsed = list(events.parseEvents(lines))
+        self.assertEqual(parsed, [
+            events.Event('update', '10', '{"a":\n1}'),
+            events.Event('message', None, 'no space')
+        ])
+
+
+@unittest.skipUnless(standinserver.haveOpenssl(), 'openssl is required')
+class TestEventStream(unittest.TestCase):
+
+    def setUp(self):
+        self.server = standinserver.StandInServer()
+        self.server.__enter__()
+        certs = self.server.certs
+        session._session = session.HttpSession(
+            'localhost', certs['server'], certs['client'], certs['clientKey'],
+            port=self.server.port, retries=0)
+        self.tempDir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        session._session.close()
+        session._session = None
+        self.server.__exit__()
+        self.tempDir.cleanup()
+
+    def startStream(self, params):
+        stream = events.EventStream('/events', params)
+        stream.start()
+        self.addCleanup(stream.stopThread)
+        return stream
+
+    def test_stream_reconnects_from_latest_cursor(self):
+        paths = []
+
+        def sendEvents(request):
+            paths.append(request.path)
+            request.startChunked('text/event-stream')
+            request.sendChunk('id: 1\ndata: first\n\n')
+            request.sendChunk(': keepalive\n\nid: 2\ndata: second\n\n')
+            request.endChunked()
+            request.close_connection = True
+
+        self.server.route('GET', '/events', sendEvents)
+        cursor = [0]
+        stream = self.startStream(lambda: {'last_update_time': cursor[0]})
+        first = stream.events.get(timeout=5)
+        second = stream.events.get(timeout=5)
+        self.assertEqual((first.id, first.data), ('1', 'first'))
+        self.assertEqual((second.id, second.data), ('2', 'second'))
+
+        # The server closed the stream, so it is reopened after a second.
+        cursor[0] = 2
+        stream.events.get(timeout=5)
+        self.assertEqual(paths, ['/events?last_update_time=0',
+                                 '/events?last_update_time=2'])
+
+    def test_error_response_not_parsed(self):
+        responses = []
+
+        def sendEvents(request):
+            responses.append(request.path)
+            if len(responses) == 1:
+                # An error page that happens to look like an event.
+                return request.sendBody('data: bogus\n\n', status=500,
+                                        contentType='text/html')
+            request.startChunked('text/event-stream')
+            request.sendChunk('id: 1\ndata: first\n\n')
+            request.endChunked()
+            request.close_connection = True
+
+        self.server.route('GET', '/events', sendEvents)
+        stream = self.startStream(lambda: {})
+        event = stream.events.get(timeout=5)
+        self.assertEqual(event.data, 'first')
+        self.assertEqual(len(responses), 2)
+
+    def test_missing_endpoint(self):
+        stream = self.startStream(lambda: {})
+        stream.join(5)
+        self.assertFalse(stream.is_alive())
+        self.assertFalse(stream.supported)
+
+    def test_update_feed(self):
+        chatDbPath = os.path.join(self.tempDir.name, 'chat.db')
+        chatDb = syntheticdb.createDatabase(chatDbPath, messages=20)
+        feed = standinserver.UpdateFeed(self.server, chatDbPath)
+        self.addCleanup(feed.close)
+        stream = self.startStream(lambda: {'last_update_time': 0})
+
+        catchUp = stream.events.get(timeout=5)
+        self.assertEqual(len(standinserver.json.loads(catchUp.data)
+                             ['message']), 20)
+
+        now = int(time.time())
+        with chatDb:
+            chatDb.execute("INSERT INTO message (ROWID, guid, text, date, "
+                           "date_read, date_delivered) "
+                           "VALUES (21, 'NEW', 'hi', 0, 0, 0)")
+            chatDb.execute('INSERT INTO chat_message_join VALUES (1, 21)')
+            chatDb.execute('INSERT INTO message_update_date_join '
+                           'VALUES (21, ?)', (now, ))
+        feed.notify()
+        pushed = stream.events.get(timeout=5)
+        messages = standinserver.json.loads(pushed.data)['message']
+        self.assertEqual([m['ROWID'] for m in messages], [21])
+        self.assertLess(int(pushed.id), now + 1)
+        chatDb.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
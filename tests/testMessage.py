@@ -277,6 +277,19 @@ class TestMessageMethods(unittest.TestCase):
 
         self.assertEqual(msg2.messageParts[0].attachment, attachment)
 
+    def test_update_downloaded_attachment(self):
+        msg = api.Message(ROWID=1, text='￼')
+        msg.addAttachment(api.Attachment(ROWID=1, filename='old'), 0)
+        part = msg.messageParts[0]
+        msg2 = api.Message(ROWID=1, text='￼')
+        attachment = api.Attachment(ROWID=1, filename='blob')
+        msg2.addAttachment(attachment, 0)
+
+        msg.update(msg2)
+
+        self.assertIs(msg.messageParts[0], part)
+        self.assertEqual(part.attachment, attachment)
+
     def test_is_newer(self):
         msg = api.Message(ROWID=1, date=0)
         msg2 = api.Message(ROWID=2, date=1)
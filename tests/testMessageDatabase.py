@@ -1,7 +1,11 @@
 import unittest
 import sqlite3
 import os
+import shutil
+import tempfile
 from localCode.messageApi import api
+from localCode.messageApi import migrations
+from localCode.messageApi import connections
 
 class TestMessageDatabaseMethods(unittest.TestCase):
 
@@ -38,6 +42,31 @@ class TestMessageDatabaseMethods(unittest.TestCase):
         self.assertTrue(msgs[0].isReaction)
         self.assertEqual(lastAccessTime, 1593473316)
 
+    def test_get_messages_for_chat_query_count(self):
+        messageDb = api.MessageDatabase()
+        statements = []
+        messageDb.conn.set_trace_callback(statements.append)
+
+        (msgs, _) = messageDb.getMessagesForChat(82, 0)
+
+        # One query for the messages, one for handles, one for attachments
+        # and none for reaction targets since there are no reactions.
+        self.assertEqual(len(msgs), 2)
+        self.assertEqual(len(statements), 3)
+
+    def test_get_messages_for_chat_chunked(self):
+        messageDb = api.MessageDatabase()
+        chunkSize = api.SQL_CHUNK_SIZE
+        api.SQL_CHUNK_SIZE = 1
+        try:
+            (msgs, lastAccessTime) = messageDb.getMessagesForChat(82, 0)
+        finally:
+            api.SQL_CHUNK_SIZE = chunkSize
+
+        self.assertEqual(msgs[1].ROWID, 12732)
+        self.assertIsNotNone(msgs[1].messageParts[1].attachment)
+        self.assertEqual(msgs[0].handleName, 'testEmail@test.com')
+
     def test_get_most_recent_message(self):
         messageDb = api.MessageDatabase()
 
@@ -53,6 +82,29 @@ class TestMessageDatabaseMethods(unittest.TestCase):
 
         self.assertEqual(msg.ROWID, 13068) 
 
+    def test_get_most_recent_message_skips_orphan_reaction(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dbPath = os.path.join(tmp, 'sms.db')
+            shutil.copyfile(self.dbPath, dbPath)
+            conn = sqlite3.connect(dbPath)
+            # A reaction to a message that was never copied over.
+            conn.execute(
+                'INSERT INTO message (ROWID, guid, date, '
+                'associated_message_guid, associated_message_type) '
+                "VALUES (99999, 'ORPHAN', 9999999999999, "
+                "'p:0/MISSING', 2000)")
+            conn.execute('INSERT INTO chat_message_join (chat_id, message_id) '
+                         'VALUES (82, 99999)')
+            conn.commit()
+            conn.close()
+            api._useTestDatabase(dbPath)
+            messageDb = api.MessageDatabase()
+
+            msg = messageDb.getMostRecentMessage(82)
+
+            self.assertEqual(msg.ROWID, 12732)
+            connections.getManager().close()
+
     def test_get_most_recent_message_bad_chat(self):
         messageDb = api.MessageDatabase()
 
@@ -60,6 +112,131 @@ class TestMessageDatabaseMethods(unittest.TestCase):
 
         self.assertIsNone(msg) 
 
+    def test_get_most_recent_messages(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dbPath = os.path.join(tmp, 'sms.db')
+            shutil.copyfile(self.dbPath, dbPath)
+            conn = sqlite3.connect(dbPath)
+            migrations.migrate(conn)
+            conn.close()
+            api._useTestDatabase(dbPath)
+            messageDb = api.MessageDatabase()
+            chatIds = [row[0] for row in
+                       messageDb.conn.execute('SELECT ROWID FROM chat')]
+
+            statements = []
+            messageDb.conn.set_trace_callback(statements.append)
+            msgs = messageDb.getMostRecentMessages(chatIds + [1])
+            messageDb.conn.set_trace_callback(None)
+            # Only the chat without messages read the chat newest first.
+            self.assertEqual(len([sql for sql in statements
+                                  if 'ORDER BY date DESC' in sql]), 1)
+            for chatId in chatIds:
+                expected = messageDb._readMostRecentMessage(chatId)
+                self.assertEqual(msgs[chatId].ROWID, expected.ROWID)
+                self.assertEqual(msgs[chatId].handleName,
+                                 expected.handleName)
+            self.assertNotIn(1, msgs)
+            self.assertEqual(msgs[82].ROWID, 12732)
+            self.assertEqual(msgs[87].ROWID, 13068)
+            connections.getManager().close()
+
+    def test_get_chat_summaries(self):
+        messageDb = api.MessageDatabase()
+        self.assertEqual(messageDb.getChatSummaries(), ([], 0))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            dbPath = os.path.join(tmp, 'sms.db')
+            shutil.copyfile(self.dbPath, dbPath)
+            conn = sqlite3.connect(dbPath)
+            migrations.migrate(conn)
+            conn.close()
+            api._useTestDatabase(dbPath)
+            messageDb = api.MessageDatabase()
+
+            chats, lastAccessTime = messageDb.getChatSummaries()
+            chatIds, expectedTime = messageDb.getChatsToUpdate(0)
+            self.assertEqual(lastAccessTime, expectedTime)
+            self.assertCountEqual([chat.chatId for chat in chats], chatIds)
+            for chat in chats:
+                row = messageDb.getChat(chat.chatId)
+                self.assertEqual(chat.displayName, row['display_name'])
+                self.assertEqual(chat.recipientList,
+                                 messageDb.getRecipients(chat.chatId))
+                self.assertEqual(
+                    chat.getMostRecentMessage().rowid,
+                    messageDb._readMostRecentMessage(chat.chatId).rowid)
+            unread = {chat.chatId: chat.unreadCount for chat in chats
+                      if chat.unreadCount}
+            self.assertEqual(unread, {85: 5, 86: 5, 87: 2})
+            self.assertEqual(messageDb.getUnreadCounts([85, 87, 1]),
+                             {85: 5, 87: 2})
+            connections.getManager().close()
+
+    def test_get_unread_counts_without_summaries(self):
+        messageDb = api.MessageDatabase()
+        self.assertEqual(messageDb.getUnreadCounts([85]), {})
+
+    def test_get_messages_before(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dbPath = os.path.join(tmp, 'sms.db')
+            shutil.copyfile(self.dbPath, dbPath)
+            conn = sqlite3.connect(dbPath)
+            migrations.migrate(conn)
+            conn.close()
+            api._useTestDatabase(dbPath)
+            self.addCleanup(connections.getManager().close)
+            messageDb = api.MessageDatabase()
+
+            msgs, _ = messageDb.getMessagesForChat(85, 0)
+            keys = sorted((msg.date, msg.rowid) for msg in msgs)
+            self.assertEqual(len(keys), 5)
+
+            page = messageDb.getMessagesBefore(85, keys[-1], 2)
+            self.assertEqual([(msg.date, msg.rowid) for msg in page],
+                             keys[-3:-1])
+            # Walking back a message at a time visits every message once.
+            walked = []
+            before = (float('inf'), 0)
+            while True:
+                page = messageDb.getMessagesBefore(85, before, 1)
+                if not page:
+                    break
+                before = (page[0].date, page[0].rowid)
+                walked.insert(0, before)
+            self.assertEqual(walked, keys)
+
+    def test_get_messages_by_page(self):
+        messageDb = api.MessageDatabase()
+        # Databases without chat_message_date are read as one page.
+        msgs, lastAccessTime = messageDb.getLatestMessages(85, 2)
+        self.assertEqual(len(msgs), 5)
+        self.assertEqual(messageDb.getMessagesBefore(85, (0, 0), 2), [])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            dbPath = os.path.join(tmp, 'sms.db')
+            shutil.copyfile(self.dbPath, dbPath)
+            conn = sqlite3.connect(dbPath)
+            migrations.migrate(conn)
+            conn.close()
+            api._useTestDatabase(dbPath)
+            self.addCleanup(connections.getManager().close)
+            messageDb = api.MessageDatabase()
+            keys = sorted((msg.date, msg.rowid) for msg in msgs)
+
+            latest, latestTime = messageDb.getLatestMessages(85, 2)
+            self.assertEqual([(msg.date, msg.rowid) for msg in latest],
+                             keys[-2:])
+            self.assertEqual(latestTime, messageDb.getChatsToUpdate(0)[1])
+
+            # Updates are read from a key on.
+            since, sinceTime = messageDb.getMessagesForChat(85, 0, keys[2])
+            self.assertCountEqual([(msg.date, msg.rowid) for msg in since],
+                                  keys[2:])
+            self.assertEqual(sinceTime, lastAccessTime)
+            self.assertEqual(messageDb.getMessagesForChat(
+                85, sinceTime, keys[0]), ([], sinceTime))
+
     def test_get_attachment_index_p_str(self):
         associatedMessageGuid = 'p:1/B7E83654-FE3F-4D60-AA56-0D7E3704D5FF'
         messageDb = api.MessageDatabase()
@@ -90,6 +267,38 @@ class TestMessageDatabaseMethods(unittest.TestCase):
 
         self.assertEqual(handle, '')
 
+    def test_get_handle_names(self):
+        messageDb = api.MessageDatabase()
+
+        handles = messageDb._getHandleNames([86, 1])
+
+        self.assertDictEqual(handles, {86: 'testEmail@test.com'})
+
+    def test_get_handle_names_empty(self):
+        messageDb = api.MessageDatabase()
+
+        handles = messageDb._getHandleNames([])
+
+        self.assertDictEqual(handles, {})
+
+    def test_get_attachments_for_messages(self):
+        messageDb = api.MessageDatabase()
+
+        attachments = messageDb._getAttachmentsForMessages([12727, 12732])
+
+        self.assertListEqual(list(attachments.keys()), [12732])
+        self.assertEqual(len(attachments[12732]), 1)
+        self.assertIsInstance(attachments[12732][0], api.Attachment)
+
+    def test_get_message_ids_for_guids(self):
+        messageDb = api.MessageDatabase()
+        guid = messageDb.conn.execute(
+            'SELECT guid FROM message WHERE ROWID = 12727').fetchone()[0]
+
+        messageIds = messageDb._getMessageIdsForGuids([guid, 'NOT-A-GUID'])
+
+        self.assertDictEqual(messageIds, {guid: 12727})
+
     def test_get_formatted_columns(self):
         messageDb = api.MessageDatabase()
         correctColumns = ('ROWID, guid, text, handle_id, service, error, date,'
@@ -151,3 +360,34 @@ class TestMessageDatabaseMethods(unittest.TestCase):
         self.assertEqual(maxUpdate, 1596330123)
         self.assertListEqual(chats, [82, 85, 86, 87, 1])
         self.assertFalse(chat.localUpdate)
+
+    def test_get_chats_to_update_unchanged(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dbPath = os.path.join(tmp, 'sms.db')
+            shutil.copyfile(self.dbPath, dbPath)
+            api._useTestDatabase(dbPath)
+            self.addCleanup(connections.getManager().close)
+            messageDb = api.MessageDatabase()
+            statements = []
+            messageDb.conn.set_trace_callback(statements.append)
+            self.addCleanup(messageDb.conn.set_trace_callback, None)
+
+            chats, maxUpdate = messageDb.getChatsToUpdate(0)
+            self.assertListEqual(chats, [82, 85, 86, 87])
+            self.assertEqual(len(statements), 2)
+
+            # Nothing was written, so nothing is read but the data version.
+            chat = api.Chat(ROWID=1)
+            chat.localUpdate = True
+            self.assertEqual(api.MessageDatabase().getChatsToUpdate(
+                maxUpdate, {chat.ROWID: chat}), ([1], maxUpdate))
+            self.assertEqual(statements[2:], ['PRAGMA data_version'])
+
+            writer = sqlite3.connect(dbPath)
+            with writer:
+                writer.execute('UPDATE message_update_date_join '
+                               'SET message_update_date = ? '
+                               'WHERE message_id = 13068', (maxUpdate + 1, ))
+            writer.close()
+            self.assertEqual(messageDb.getChatsToUpdate(maxUpdate),
+                             ([87], maxUpdate + 1))
@@ -78,7 +78,7 @@ class TestMessageListMethods(unittest.TestCase):
         }
         msgList.append(msg)
 
-        msgList._insert(msg2, msgList.messages, list(msgList))
+        msgList._insert(msg2, msgList.messages)
 
         self.assertDictEqual(msgList.messages, correctMessagesDict)
         self.assertListEqual(list(msgList.messages.keys()),
@@ -94,12 +94,99 @@ class TestMessageListMethods(unittest.TestCase):
         }
         msgList.append(msg2)
 
-        msgList._insert(msg, msgList.messages, list(msgList.messages))
+        msgList._insert(msg, msgList.messages)
 
         self.assertDictEqual(msgList.messages, correctMessagesDict)
         self.assertListEqual(list(msgList.messages.keys()),
                              list(correctMessagesDict.keys()))
 
+    def test_append_out_of_order_messages(self):
+        msgList = api.MessageList()
+        dates = [5, 1, 4, 2, 3, 2]
+        for i in range(len(dates)):
+            msgList.append(api.Message(ROWID=i + 1, date=dates[i]))
+
+        self.assertListEqual(list(msgList.messages.keys()), [2, 4, 6, 5, 3, 1])
+        self.assertEqual(msgList.mostRecentMessage.ROWID, 1)
+
+    def test_append_updated_message_changes_order(self):
+        msgList = api.MessageList()
+        msgList.append(api.Message(ROWID=1, date=10))
+        msgList.append(api.Message(ROWID=2, date=11))
+
+        msgList.append(api.Message(ROWID=1, date=12))
+
+        self.assertListEqual(list(msgList.messages.keys()), [2, 1])
+        self.assertEqual(msgList.messages[1].date, 12)
+
+    def test_delete_message_keeps_order(self):
+        msgList = api.MessageList()
+        for i in range(1, 5):
+            msgList.append(api.Message(ROWID=i, date=i))
+
+        del msgList.messages[2]
+
+        self.assertListEqual(list(msgList.messages), [1, 3, 4])
+        self.assertNotIn(2, msgList.messages.keys())
+        self.assertListEqual(msgList.getLastIds(2), [3, 4])
+
+    def test_get_last_ids(self):
+        msgList = api.MessageList()
+        for i in range(10, 0, -1):
+            msgList.append(api.Message(ROWID=i, date=i))
+
+        self.assertListEqual(msgList.getLastIds(3), [8, 9, 10])
+        self.assertListEqual(msgList.getLastIds(20), list(range(1, 11)))
+        self.assertListEqual(msgList.getLastIds(0), [])
+
+    def test_get_ids_between(self):
+        msgList = api.MessageList()
+        for i in range(1, 11):
+            msgList.append(api.Message(ROWID=i, date=i * 10))
+
+        ids = msgList.getIdsBetween((30, 0), (60, 0))
+
+        self.assertListEqual(ids, [3, 4, 5])
+
+    def test_keys_before(self):
+        msgList = api.MessageList()
+        for i in range(1, 11):
+            msgList.append(api.Message(ROWID=i, date=i * 10))
+
+        ids = msgList.messages.keysBefore((50, 5), 3)
+
+        self.assertListEqual(ids, [2, 3, 4])
+
+    def test_dict_methods_keep_order(self):
+        messages = api.SortedMessageDict()
+        messages.update({i: api.Message(ROWID=i, date=10 - i)
+                         for i in range(1, 6)})
+
+        self.assertEqual(messages.popitem()[0], 1)
+        newMessage = api.Message(ROWID=6, date=0)
+        self.assertIs(messages.setdefault(6, newMessage), newMessage)
+        self.assertIs(messages.setdefault(6, api.Message(ROWID=6)),
+                      newMessage)
+        copy = messages.copy()
+        del copy[5]
+
+        self.assertListEqual(list(messages), [6, 5, 4, 3, 2])
+        self.assertListEqual(list(copy), [6, 4, 3, 2])
+        self.assertListEqual(messages.lastKeys(2), [3, 2])
+        messages.clear()
+        self.assertListEqual(messages.lastKeys(2), [])
+        with self.assertRaises(KeyError):
+            messages.popitem()
+
+    def test_setdefault_needs_message(self):
+        messages = api.SortedMessageDict()
+
+        with self.assertRaises(TypeError):
+            messages.setdefault(1)
+
+        self.assertNotIn(1, messages)
+        self.assertListEqual(messages.lastKeys(1), [])
+
     def test_add_reaction_with_message_in_list(self):
         msgList = api.MessageList()
         msg = api.Message(ROWID=1)
@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 import tkinter as tk
 from tkinter import ttk
 from datetime import datetime, timedelta
@@ -377,6 +378,44 @@ class TestMessageFrameMethods(unittest.TestCase):
         self.assertFalse(result)
         self.assertListEqual(list(self.messageFrame.messageBubbles.keys()), [i for i in range(2, maxId)])
 
+    def test_add_older_messages(self):
+        chat = api.Chat(ROWID=1)
+        for i in range(1, 41):
+            chat.addMessage(api.Message(ROWID=i, guid=str(i), date=i))
+        self.messageFrame.currentChat = chat
+        self.messageFrame.addMessages(chat)
+        self.assertEqual(self.messageFrame.firstMessageId, 26)
+        bubble = self.messageFrame.messageBubbles[26][-1]
+
+        result = self.messageFrame.addOlderMessages(chat)
+
+        self.assertTrue(result)
+        self.assertEqual(self.messageFrame.firstMessageId, 6)
+        self.assertCountEqual(self.messageFrame.messageBubbles, range(6, 41))
+        # The bubbles already shown are kept and the page goes above them.
+        self.assertIs(self.messageFrame.messageBubbles[26][-1], bubble)
+        slaves = self.messageFrame.interior.pack_slaves()
+        self.assertLess(
+            slaves.index(self.messageFrame.messageBubbles[25][-1]),
+            slaves.index(bubble))
+        self.assertNotIn(26, self.messageFrame.timeLabels)
+        self.assertIn(6, self.messageFrame.timeLabels)
+
+    def test_add_older_messages_sender_label(self):
+        chat = api.Chat(ROWID=1, style=43)
+        for i in range(1, 41):
+            chat.addMessage(api.Message(ROWID=i, guid=str(i), date=i,
+                                        handle_id=1, is_from_me=0))
+        self.messageFrame.currentChat = chat
+        self.messageFrame.addMessages(chat)
+        bubble = self.messageFrame.messageBubbles[26][-1]
+        self.assertIsNotNone(bubble.senderLabel)
+
+        self.messageFrame.addOlderMessages(chat)
+
+        # The same sender sent the message now before it.
+        self.assertIsNone(bubble.senderLabel)
+
     def test_get_messages_up_to_limit(self):
         chat = api.Chat(ROWID=1)
         maxId = self.messageFrame.messageLimit + 2 
@@ -426,6 +465,114 @@ class TestMessageFrameMethods(unittest.TestCase):
         self.messageFrame._showReactionWindow(msg, msg.messageParts[0])
 
         self.assertTrue(self.messageFrame.reactionWindow.winfo_exists())
-        
+
+    def test_hidden_resize_waits_for_show(self):
+        chat = api.Chat(ROWID=1)
+        self.messageFrame.changeChat(chat)
+        resized = []
+        self.messageFrame.messageBubbles[1] = [mock.Mock(
+            resize=resized.append)]
+        event = mock.Mock(width=300, height=200)
+
+        self.messageFrame.hide()
+        self.messageFrame._configure_messages_canvas(event)
+        self.assertListEqual(resized, [])
+
+        self.messageFrame.showChat(chat)
+        self.assertListEqual(resized, [event])
+        self.assertIsNone(self.messageFrame.pendingResize)
+
+
+class View:
+    """Stands in for a MessageFrame in the view cache."""
+
+    def __init__(self, size=1):
+        self.size = size
+        self.estimates = 0
+        self.destroyed = False
+
+    def estimateSize(self):
+        self.estimates += 1
+        return self.size
+
+    def destroy(self):
+        self.destroyed = True
+
+
+class TestViewCache(unittest.TestCase):
+
+    def test_hit_and_miss(self):
+        views = mf.ViewCache()
+        view = View()
+        self.assertIsNone(views.get(1))
+        views.put(1, view)
+
+        self.assertIs(views.get(1), view)
+        self.assertEqual(views.stats()['hits'], 1)
+        self.assertEqual(views.stats()['misses'], 1)
+
+    def test_evict_least_recently_used(self):
+        views = mf.ViewCache(maxViews=2)
+        first, second, third = View(), View(), View()
+        views.put(1, first)
+        views.put(2, second)
+        # Showing chat 1 again makes chat 2 the least recently used.
+        views.put(1, views.get(1))
+
+        views.put(3, third)
+
+        self.assertListEqual(list(views.views), [1, 3])
+        self.assertTrue(second.destroyed)
+        self.assertFalse(first.destroyed or third.destroyed)
+        self.assertEqual(views.stats()['evictions'], 1)
+
+    def test_evict_over_bytes(self):
+        views = mf.ViewCache(maxBytes=100)
+        small, large = View(40), View(70)
+        views.put(1, small)
+
+        views.put(2, large)
+
+        self.assertListEqual(list(views.views), [2])
+        self.assertTrue(small.destroyed)
+        self.assertEqual(views.stats()['evictedBytes'], 40)
+
+    def test_keep_shown_view(self):
+        views = mf.ViewCache(maxBytes=100)
+        large = View(200)
+
+        views.put(1, large)
+
+        self.assertIs(views.get(1), large)
+        self.assertFalse(large.destroyed)
+
+    def test_remove(self):
+        views = mf.ViewCache()
+        view = View()
+        views.put(1, view)
+
+        views.remove(1)
+        views.remove(2)
+
+        self.assertTrue(view.destroyed)
+        self.assertIsNone(views.get(1))
+        self.assertEqual(views.total, 0)
+
+    def test_estimate_only_put_view(self):
+        views = mf.ViewCache(maxBytes=100)
+        first, second = View(30), View(30)
+        views.put(1, first)
+        views.put(2, second)
+        # Chat 1 grew while it was shown again.
+        first.size = 80
+
+        views.put(1, views.get(1))
+
+        self.assertEqual(first.estimates, 2)
+        self.assertEqual(second.estimates, 1)
+        self.assertListEqual(list(views.views), [1])
+        self.assertEqual(views.stats()['evictedBytes'], 30)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,238 @@
+import os
+import subprocess
+import sys
+import unittest
+import sqlite3
+from unittest import mock
+from localCode.messageApi import migrations
+from localCode.messageApi import sqlcommands
+
+# Queries that read every row on purpose, and sqlite_master, which has no
+# indexes.
+FULL_SCANS = {'LOAD_CHATS_SQL', 'CHAT_SUMMARIES_SQL', 'HAS_TABLE_SQL'}
+COLUMN_LISTS = {'LOAD_MESSAGES_SQL', 'LOAD_MESSAGES_BEFORE_SQL',
+                'LOAD_LATEST_MESSAGES_SQL', 'LOAD_MESSAGES_SINCE_SQL'}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def hotQueries():
+    for name in sorted(dir(sqlcommands)):
+        if name.endswith('_SQL') and name not in FULL_SCANS:
+            sql = getattr(sqlcommands, name)
+            # The queries that load messages take a column list, the rest
+            # an IN list.
+            sql = sql.replace('{}', '*' if name in COLUMN_LISTS else '?, ?')
+            yield name, sql
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+
+    def tearDown(self):
+        self.conn.close()
+
+    def names(self, kind):
+        return {row[0] for row in self.conn.execute(
+            'SELECT name FROM sqlite_master WHERE type = ?', (kind, ))}
+
+    def test_migrate_new_database(self):
+        self.assertEqual(migrations.currentVersion(self.conn), 0)
+        self.assertEqual(migrations.migrate(self.conn),
+                         list(range(1, len(migrations.MIGRATIONS) + 1)))
+        self.assertEqual(migrations.currentVersion(self.conn),
+                         len(migrations.MIGRATIONS))
+        self.assertLessEqual({'message', 'chat_message_join', 'sync_state',
+                              'attachment_download', 'blob'},
+                             self.names('table'))
+        self.assertIn('message_update_date_join_idx_message_update_date',
+                      self.names('index'))
+        self.assertEqual(migrations.migrate(self.conn), [])
+
+    def test_migrate_install_database(self):
+        # Mirrors made by INSTALL before migrations have the chat.db schema
+        # and a user_version of 0.
+        self.conn.executescript(migrations.BASE_SCHEMA_SQL)
+        self.conn.execute("INSERT INTO message (ROWID, guid, text) "
+                          "VALUES (1, 'A', 'kept')")
+        self.conn.commit()
+        self.assertEqual(migrations.migrate(self.conn),
+                         list(range(1, len(migrations.MIGRATIONS) + 1)))
+        self.assertEqual(self.conn.execute(
+            'SELECT text FROM message').fetchall(), [('kept', )])
+
+    def test_failed_migration_rolls_back(self):
+        migrations.migrate(self.conn)
+        self.addCleanup(migrations.MIGRATIONS.pop)
+        migrations.MIGRATIONS.append(
+            ['CREATE TABLE half (a)', 'INSERT INTO missing VALUES (1)'])
+        with self.assertRaises(sqlite3.OperationalError):
+            migrations.migrate(self.conn)
+        self.assertFalse(self.conn.in_transaction)
+        self.assertEqual(migrations.currentVersion(self.conn),
+                         len(migrations.MIGRATIONS) - 1)
+        self.assertNotIn('half', self.names('table'))
+
+    def test_old_sqlite_refused(self):
+        with mock.patch.object(sqlite3, 'sqlite_version_info', (3, 22, 0)):
+            with self.assertRaisesRegex(sqlite3.NotSupportedError, '3.25.0'):
+                migrations.migrate(self.conn)
+        self.assertEqual(migrations.currentVersion(self.conn), 0)
+
+    def test_import_without_downloader(self):
+        # INSTALL runs the migrations before requests may be installed.
+        code = ('import sys\n'
+                'from localCode.messageApi import migrations\n'
+                "sys.exit('requests' in sys.modules)")
+        result = subprocess.run([sys.executable, '-c', code], cwd=ROOT)
+        self.assertEqual(result.returncode, 0)
+
+    def test_hot_queries_use_indexes(self):
+        migrations.migrate(self.conn)
+        for name, sql in hotQueries():
+            with self.subTest(query=name):
+                plan = self.conn.execute('EXPLAIN QUERY PLAN ' + sql,
+                                         [0] * sql.count('?')).fetchall()
+                scans = [row[3] for row in plan
+                         if row[3].startswith('SCAN')]
+                self.assertEqual(scans, [])
+
+    def test_chats_to_update(self):
+        migrations.migrate(self.conn)
+        self.conn.executemany("INSERT INTO message (ROWID, guid, text) "
+                              "VALUES (?, ?, ?)",
+                              [(1, 'A', 'old'), (2, 'B', 'new'),
+                               (3, 'C', 'other')])
+        self.conn.executemany('INSERT INTO chat_message_join VALUES (?, ?)',
+                              [(1, 1), (1, 2), (2, 3)])
+        self.conn.execute('DELETE FROM message_update_date_join')
+        self.conn.executemany('INSERT INTO message_update_date_join '
+                              'VALUES (?, ?)', [(1, 10), (2, 20), (3, 5)])
+        rows = self.conn.execute(sqlcommands.CHATS_TO_UPDATE_SQL,
+                                 (8, )).fetchall()
+        self.assertEqual(rows, [(1, 20, 'new')])
+
+
+class MigratedTestCase(unittest.TestCase):
+    """Runs each test on a freshly migrated in-memory database."""
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        migrations.migrate(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def addMessage(self, rowid, date, chatId=1, joinFirst=False):
+        # updater writes tables in the order the payload lists them.
+        statements = [
+            ('INSERT OR REPLACE INTO message (ROWID, guid, date) '
+             'VALUES (?, ?, ?)', (rowid, 'G{}'.format(rowid), date)),
+            ('INSERT OR REPLACE INTO chat_message_join VALUES (?, ?)',
+             (chatId, rowid))]
+        if joinFirst:
+            statements.reverse()
+        with self.conn:
+            for sql, params in statements:
+                self.conn.execute(sql, params)
+
+
+class TestChatLastMessage(MigratedTestCase):
+
+    def lastMessages(self):
+        return dict(self.conn.execute(
+            'SELECT chat_id, message_id FROM chat_last_message'))
+
+    def test_newest_message_wins(self):
+        self.addMessage(1, 100)
+        self.addMessage(2, 200, joinFirst=True)
+        self.addMessage(3, 150)
+        self.addMessage(4, 50, chatId=2, joinFirst=True)
+        self.assertEqual(self.lastMessages(), {1: 2, 2: 4})
+        # Same date, so the higher ROWID is newer.
+        self.addMessage(5, 200)
+        self.assertEqual(self.lastMessages(), {1: 5, 2: 4})
+        # Applying the same message again changes nothing.
+        self.addMessage(3, 150)
+        self.assertEqual(self.lastMessages(), {1: 5, 2: 4})
+
+    def test_date_updated(self):
+        self.addMessage(1, 100)
+        self.addMessage(2, 200)
+        self.conn.execute('UPDATE message SET date = 300 WHERE ROWID = 1')
+        self.assertEqual(self.lastMessages(), {1: 1})
+
+    def test_last_message_date_lowered(self):
+        self.addMessage(1, 100)
+        self.addMessage(2, 200)
+        self.conn.execute('UPDATE message SET date = 50 WHERE ROWID = 2')
+        self.assertEqual(self.lastMessages(), {1: 1})
+        self.assertEqual(self.conn.execute(
+            'SELECT date FROM chat_last_message').fetchone()[0], 100)
+
+    def test_deleted(self):
+        self.addMessage(1, 100)
+        self.addMessage(2, 200)
+        self.addMessage(3, 50, chatId=2)
+        self.conn.execute('DELETE FROM message WHERE ROWID = 2')
+        self.assertEqual(self.lastMessages(), {1: 1, 2: 3})
+        self.conn.execute('DELETE FROM chat_message_join WHERE chat_id = 2')
+        self.assertEqual(self.lastMessages(), {1: 1})
+
+    def test_backfill(self):
+        # Messages already in the mirror when the table is first created.
+        self.conn.close()
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.executescript(migrations.BASE_SCHEMA_SQL)
+        self.addMessage(1, 100)
+        self.addMessage(2, 200)
+        self.addMessage(3, 50, chatId=2)
+        migrations.migrate(self.conn)
+        self.assertEqual(self.lastMessages(), {1: 2, 2: 3})
+
+
+class TestChatMessageDate(MigratedTestCase):
+
+    def dates(self):
+        return self.conn.execute(
+            'SELECT chat_id, message_id, message_date FROM chat_message_date '
+            'ORDER BY chat_id, message_date, message_id').fetchall()
+
+    def test_either_order(self):
+        self.addMessage(1, 100)
+        self.addMessage(2, 50, joinFirst=True)
+        self.addMessage(3, 75, chatId=2)
+        self.assertEqual(self.dates(), [(1, 2, 50), (1, 1, 100),
+                                        (2, 3, 75)])
+        # Applying a message again replaces its row.
+        self.addMessage(2, 150)
+        self.assertEqual(self.dates(), [(1, 1, 100), (1, 2, 150),
+                                        (2, 3, 75)])
+
+    def test_date_updated(self):
+        self.addMessage(1, 100)
+        self.conn.execute('UPDATE message SET date = 20 WHERE ROWID = 1')
+        self.assertEqual(self.dates(), [(1, 1, 20)])
+
+    def test_deleted(self):
+        self.addMessage(1, 100)
+        self.addMessage(2, 200)
+        self.addMessage(3, 300, chatId=2)
+        self.conn.execute('DELETE FROM message WHERE ROWID = 2')
+        self.conn.execute('DELETE FROM chat_message_join WHERE chat_id = 2')
+        self.assertEqual(self.dates(), [(1, 1, 100)])
+
+    def test_backfill(self):
+        self.conn.close()
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.executescript(migrations.BASE_SCHEMA_SQL)
+        self.addMessage(1, 100)
+        self.addMessage(2, 50, chatId=2)
+        migrations.migrate(self.conn)
+        self.assertEqual(self.dates(), [(1, 1, 100), (2, 2, 50)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+import threading
+from localCode import scheduler
+
+
+class Root:
+    """Records after() calls instead of running a Tk mainloop."""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def after(self, ms, func, *args):
+        self.scheduled.append((ms, func, args))
+
+    def runScheduled(self):
+        scheduled, self.scheduled = self.scheduled, []
+        for ms, func, args in scheduled:
+            func(*args)
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = scheduler.Scheduler()
+        self.handled = []
+        for kind in (scheduler.CHAT_UPDATED, scheduler.CONNECTION_STATE):
+            self.scheduler.handle(
+                kind, lambda values, kind=kind:
+                self.handled.append((kind, values)))
+
+    def test_coalesce(self):
+        self.scheduler.post(scheduler.CHAT_UPDATED, 2, 'a')
+        self.scheduler.post(scheduler.CONNECTION_STATE, value=False)
+        self.scheduler.post(scheduler.CHAT_UPDATED, 1, 'b')
+        self.scheduler.post(scheduler.CHAT_UPDATED, 2, 'c')
+        self.scheduler.post(scheduler.CONNECTION_STATE, value=True)
+        self.assertEqual(self.scheduler.drain(), 5)
+        self.assertEqual(self.handled, [
+            (scheduler.CHAT_UPDATED, ['c', 'b']),
+            (scheduler.CONNECTION_STATE, [True])])
+        self.assertEqual(self.scheduler.drain(), 0)
+        self.assertEqual(len(self.handled), 2)
+
+    def test_unhandled_kind(self):
+        self.scheduler.post(scheduler.PLAY_SOUND)
+        self.assertEqual(self.scheduler.drain(), 1)
+        self.assertEqual(self.handled, [])
+
+    def test_handled_on_root_thread(self):
+        root = Root()
+        self.scheduler.start(root)
+        threads = []
+        self.scheduler.handle(
+            scheduler.PLAY_SOUND,
+            lambda values: threads.append(threading.current_thread()))
+        poster = threading.Thread(
+            target=lambda: self.scheduler.post(scheduler.PLAY_SOUND))
+        poster.start()
+        poster.join()
+        self.assertEqual(threads, [])
+        root.runScheduled()
+        self.assertEqual(threads, [threading.current_thread()])
+        # Each frame schedules the next.
+        self.assertEqual(len(root.scheduled), 1)
+        self.assertEqual(root.scheduled[0][0], scheduler.FRAME_INTERVAL)
+
+    def test_handler_error_keeps_ticking(self):
+        root = Root()
+        self.scheduler.start(root)
+
+        def fail(values):
+            raise ValueError
+        self.scheduler.handle(scheduler.PLAY_SOUND, fail)
+        self.scheduler.post(scheduler.PLAY_SOUND)
+        with self.assertRaises(ValueError):
+            root.runScheduled()
+        self.assertEqual(len(root.scheduled), 1)
+
+
+class TestThreadCounter(unittest.TestCase):
+
+    def test_counts_started_threads(self):
+        counter = scheduler.ThreadCounter()
+        counter.install()
+        try:
+            for _ in range(3):
+                thread = threading.Thread(target=lambda: None)
+                thread.start()
+                thread.join()
+        finally:
+            counter.uninstall()
+        thread = threading.Thread(target=lambda: None)
+        thread.start()
+        thread.join()
+        self.assertEqual(counter.total, 3)
+        self.assertEqual(counter.perMinute(), 3)
+
+    def test_previous_hook_kept(self):
+        original = scheduler.getThreadTrace()
+        self.addCleanup(threading.settrace, original)
+        traced = []
+
+        def hook(frame, event, arg):
+            traced.append(threading.current_thread().name)
+
+        threading.settrace(hook)
+        counter = scheduler.ThreadCounter()
+        counter.install()
+        thread = threading.Thread(target=lambda: None, name='Traced')
+        thread.start()
+        thread.join()
+        counter.uninstall()
+
+        self.assertEqual(counter.total, 1)
+        self.assertEqual(set(traced), {'Traced'})
+        self.assertIs(scheduler.getThreadTrace(), hook)
+
+
+if __name__ == '__main__':
+    unittest.main()
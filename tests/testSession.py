@@ -0,0 +1,93 @@
+import unittest
+import json
+import time
+import requests
+from localCode.messageApi import session
+from tests import standinserver
+
+
+@unittest.skipUnless(standinserver.haveOpenssl(), 'openssl is required')
+class TestHttpSession(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = standinserver.StandInServer()
+        cls.server.__enter__()
+        cls.posted = []
+
+        def ping(request):
+            request.sendBody('{"ok": true}')
+
+        def message(request):
+            cls.posted.append(json.loads(request.readBody()))
+            request.sendBody('{}')
+
+        def slow(request):
+            time.sleep(1)
+            request.sendBody('{}')
+
+        cls.server.route('GET', '/ping', ping)
+        cls.server.route('POST', '/message', message)
+        cls.server.route('GET', '/slow', slow)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.__exit__()
+
+    def createSession(self, **kwargs):
+        certs = self.server.certs
+        httpSession = session.HttpSession(
+            'localhost', certs['server'], certs['client'], certs['clientKey'],
+            port=self.server.port, **kwargs)
+        self.addCleanup(httpSession.close)
+        return httpSession
+
+    def test_connection_reused(self):
+        httpSession = self.createSession()
+        for _ in range(5):
+            r = httpSession.get('/ping')
+            self.assertEqual(r.json(), {'ok': True})
+        self.assertEqual(httpSession.stats(),
+                         {'requests': 5, 'connections': 1, 'reused': 4})
+
+    def test_post(self):
+        httpSession = self.createSession()
+        r = httpSession.post('/message', json={'text': 'hi', 'chatId': 1})
+        self.assertEqual(r.status_code, 200)
+        self.assertIn({'text': 'hi', 'chatId': 1}, self.posted)
+
+    def test_default_timeout(self):
+        httpSession = self.createSession(timeout=(5, 0.2), retries=0)
+        # Once retries are exhausted urllib3 reports the read timeout as a
+        # ConnectionError, so callers catch both.
+        start = time.perf_counter()
+        with self.assertRaises((requests.exceptions.ConnectionError,
+                                requests.exceptions.Timeout)):
+            httpSession.get('/slow')
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_requires_client_cert(self):
+        httpSession = self.createSession(retries=0)
+        httpSession.session.cert = None
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            httpSession.get('/ping')
+
+
+class TestSessionInitialize(unittest.TestCase):
+
+    def tearDown(self):
+        session._session = None
+
+    def test_initialize_once(self):
+        secrets = {'ip': 'localhost', 'serverCrt': 'server.crt',
+                   'clientCrt': 'client.crt', 'clientKey': 'client.key',
+                   'poolSize': 2, 'timeout': 10}
+        first = session.initialize(secrets)
+        self.assertIs(session.initialize(secrets), first)
+        self.assertIs(session.getSession(), first)
+        self.assertEqual(first.timeout, 10)
+        self.assertEqual(first.baseUrl, 'https://localhost:3000')
+
+
+if __name__ == '__main__':
+    unittest.main()
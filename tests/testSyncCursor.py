@@ -0,0 +1,346 @@
+import unittest
+import os
+import sys
+import tempfile
+import threading
+from localCode import updater
+from tests import standinserver
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..',
+                                'benchmarks'))
+import syntheticdb  # noqa: E402
+
+
+class TestChangeCursor(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.chatDbPath = os.path.join(self.tempDir.name, 'chat.db')
+        self.chatDb = syntheticdb.createDatabase(self.chatDbPath, messages=100)
+        self.chatDb.execute('PRAGMA journal_mode=WAL')
+        self.exporter = standinserver.loadExporter()
+        self.exporter.installChangeLog(self.chatDb)
+        self.nextRowid = 101
+
+    def tearDown(self):
+        self.chatDb.close()
+        self.tempDir.cleanup()
+
+    def export(self, sinceSeq, pageSize=None):
+        conn = self.exporter.connect(self.chatDbPath)
+        try:
+            output = self.exporter.getUpdates(conn, 0, sinceSeq=sinceSeq,
+                                              pageSize=pageSize)
+        finally:
+            conn.close()
+        return output, {m['ROWID']: m['text'] for m in output['message']}
+
+    def insert(self, conn, text):
+        rowid = self.nextRowid
+        self.nextRowid += 1
+        conn.execute("INSERT INTO message (ROWID, guid, text, date, "
+                     "date_read, date_delivered) VALUES (?, ?, ?, 0, 0, 0)",
+                     (rowid, 'NEW{}'.format(rowid), text))
+        conn.execute('INSERT INTO chat_message_join VALUES (1, ?)', (rowid, ))
+        return rowid
+
+    def test_install_records_existing_messages(self):
+        output, messages = self.export(0)
+        self.assertEqual(len(messages), 100)
+        self.assertEqual(output['cursor'], 100)
+
+        output, messages = self.export(output['cursor'])
+        self.assertEqual(messages, {})
+        self.assertEqual(output['cursor'], 100)
+
+    def test_without_cursor(self):
+        # Clients that don't send a cursor get one to start from.
+        output, messages = self.export(None)
+        self.assertEqual(len(messages), 100)
+        self.assertEqual(output['cursor'], 100)
+
+    def test_same_second_bursts(self):
+        cursor = self.export(0)[0]['cursor']
+        # Every write below lands in the same second, which a time window
+        # can't tell apart.
+        with self.chatDb:
+            first = [self.insert(self.chatDb, 'a') for _ in range(5)]
+        output, messages = self.export(cursor)
+        self.assertEqual(messages, {rowid: 'a' for rowid in first})
+        cursor = output['cursor']
+
+        with self.chatDb:
+            second = self.insert(self.chatDb, 'b')
+            self.chatDb.execute("UPDATE message SET text = 'edited' "
+                                "WHERE ROWID IN (?, 7)", (first[0], ))
+            self.chatDb.execute("UPDATE message SET text = 'twice' "
+                                "WHERE ROWID = ?", (second, ))
+        output, messages = self.export(cursor)
+        self.assertEqual(messages, {second: 'twice', first[0]: 'edited',
+                                    7: 'edited'})
+        cursor = output['cursor']
+
+        with self.chatDb:
+            self.chatDb.execute('DELETE FROM message WHERE ROWID = ?',
+                                (first[1], ))
+        output, messages = self.export(cursor)
+        self.assertEqual(messages, {})
+        self.assertEqual(
+            self.chatDb.execute('SELECT count(*) FROM message_change')
+            .fetchone()[0], 105)
+
+    def test_join_rows_committed_later(self):
+        cursor = self.export(0)[0]['cursor']
+        rowid = self.nextRowid
+        with self.chatDb:
+            self.chatDb.execute(
+                "INSERT INTO message (ROWID, guid, text, date, date_read, "
+                "date_delivered) VALUES (?, 'LATE', 'late', 0, 0, 0)",
+                (rowid, ))
+        # Without its chat the message can't be sent yet.
+        output, messages = self.export(cursor)
+        self.assertEqual(messages, {})
+        cursor = output['cursor']
+
+        with self.chatDb:
+            self.chatDb.execute('INSERT INTO chat_message_join VALUES (1, ?)',
+                                (rowid, ))
+            self.chatDb.execute(
+                "INSERT INTO attachment (ROWID, guid, filename) "
+                "VALUES (999, 'AT_LATE', 'late.jpg')")
+            self.chatDb.execute(
+                'INSERT INTO message_attachment_join VALUES (?, 999)',
+                (rowid, ))
+        output, messages = self.export(cursor)
+        self.assertEqual(messages, {rowid: 'late'})
+        self.assertEqual([row['ROWID'] for row in output['attachment']],
+                         [999])
+
+    def test_pages(self):
+        cursor = 0
+        pages = []
+        while True:
+            output, messages = self.export(cursor, pageSize=30)
+            pages.append(sorted(messages))
+            self.assertEqual(output['cursor'], cursor + len(messages))
+            cursor = output['cursor']
+            if not output['more']:
+                break
+            if len(pages) == 2:
+                # A change made while paging comes after the pages before it.
+                with self.chatDb:
+                    self.chatDb.execute("UPDATE message SET text = 'late' "
+                                        "WHERE ROWID = 1")
+        self.assertEqual(pages, [list(range(1, 31)), list(range(31, 61)),
+                                 list(range(61, 91)),
+                                 [1] + list(range(91, 101))])
+        output, messages = self.export(cursor, pageSize=30)
+        self.assertEqual(messages, {})
+        self.assertFalse(output['more'])
+
+    def test_stream_records(self):
+        conn = self.exporter.connect(self.chatDbPath)
+        self.addCleanup(conn.close)
+        stats = self.exporter.ExportStats()
+        records = self.exporter.streamUpdates(conn, 0, stats, 0)
+        first = next(records)
+        # Records come out while the message query is still being read.
+        self.assertIn(first['table'], ('message', 'chat_message_join'))
+        self.assertLessEqual(stats._current['rows'], 1)
+
+        streamed = {table: [] for table in self.exporter.TABLES}
+        streamed[first['table']].append(first['row'])
+        for record in records:
+            if 'end' in record:
+                end = record
+            else:
+                streamed[record['table']].append(record['row'])
+        self.assertEqual(end, {'end': True, 'cursor': 100, 'more': False})
+        output = self.exporter.getUpdates(conn, 0, sinceSeq=0)
+        self.assertEqual(streamed,
+                         {table: output[table]
+                          for table in self.exporter.TABLES})
+
+    def test_columnar(self):
+        conn = self.exporter.connect(self.chatDbPath)
+        self.addCleanup(conn.close)
+        rows = self.exporter.getUpdates(conn, 0, sinceSeq=0)
+        columnar = self.exporter.getUpdates(conn, 0, sinceSeq=0,
+                                            columnar=True)
+        messages = columnar.pop('message')
+        self.assertEqual(messages['columns'],
+                         self.exporter.neededColumnsMessage)
+        self.assertEqual([dict(zip(messages['columns'], values))
+                          for values in messages['rows']],
+                         rows.pop('message'))
+        self.assertEqual(columnar, rows)
+
+    def test_concurrent_bursts_lose_and_repeat_nothing(self):
+        output, local = self.export(0)
+        cursor = output['cursor']
+        delivered = set(local.items())
+        done = threading.Event()
+
+        def write():
+            conn = self.exporter.connect(self.chatDbPath)
+            version = 0
+            for burst in range(100):
+                with conn:
+                    for _ in range(5):
+                        version += 1
+                        self.insert(conn, 'v{}'.format(version))
+                        version += 1
+                        conn.execute('UPDATE message SET text = ? '
+                                     'WHERE ROWID = ?',
+                                     ('v{}'.format(version),
+                                      1 + version % (self.nextRowid - 1)))
+            conn.close()
+            done.set()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        while True:
+            finished = done.is_set()
+            output, messages = self.export(cursor)
+            self.assertGreaterEqual(output['cursor'], cursor)
+            cursor = output['cursor']
+            for rowid, text in messages.items():
+                self.assertNotIn((rowid, text), delivered)
+                delivered.add((rowid, text))
+                local[rowid] = text
+            if finished:
+                break
+        writer.join()
+
+        remote = dict(self.chatDb.execute('SELECT ROWID, text FROM message'))
+        self.assertEqual(len(remote), 600)
+        self.assertEqual(local, remote)
+
+
+@unittest.skipUnless(standinserver.haveOpenssl(), 'openssl is required')
+class TestPagedSync(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        chatDbPath = os.path.join(self.tempDir.name, 'chat.db')
+        chatDb = syntheticdb.createDatabase(chatDbPath, messages=100,
+                                            attachmentEvery=0)
+        standinserver.loadExporter().installChangeLog(chatDb)
+        chatDb.close()
+
+        self.server = standinserver.StandInServer()
+        self.server.__enter__()
+        self.feed = standinserver.UpdateFeed(self.server, chatDbPath,
+                                             push=False)
+        certs = self.server.certs
+        updater.session._session = updater.session.HttpSession(
+            'localhost', certs['server'], certs['client'], certs['clientKey'],
+            port=self.server.port, retries=0)
+
+        self.conn = updater.openDatabase(
+            os.path.join(self.tempDir.name, 'sms.db'))
+        self.conn.executescript(syntheticdb.SCHEMA)
+        self.downloader = updater.downloader.AttachmentDownloader(
+            updater.blobstore.BlobStore(self.tempDir.name))
+        updater.updateLastAccess(0)
+        updater.updateSyncCursor(None)
+        self.pageSize = updater.PAGE_SIZE
+        updater.PAGE_SIZE = 30
+
+    def tearDown(self):
+        updater.PAGE_SIZE = self.pageSize
+        updater.updateSyncCursor(None)
+        self.downloader.shutdown()
+        self.conn.close()
+        updater.session._session.close()
+        updater.session._session = None
+        self.server.__exit__()
+        self.tempDir.cleanup()
+
+    def test_interrupted_sync_resumes(self):
+        pages = []
+
+        def dropThirdPage(request):
+            pages.append(request.path)
+            if len(pages) == 3:
+                # Go away without answering, as if the network dropped.
+                request.close_connection = True
+                return
+            self.feed.update(request)
+
+        self.server.route('GET', '/update', dropThirdPage)
+        updater.retrieveUpdates(self.conn, self.downloader)
+        self.assertEqual(self.feed.messagesSent, 60)
+        self.assertEqual(updater.lastAccess, 0)
+
+        # Start again the way UpdaterThread does after a restart.
+        updater.updateSyncCursor(None)
+        updater.readSyncCursor(self.conn)
+        self.assertEqual(updater.syncCursor, 60)
+        updater.retrieveUpdates(self.conn, self.downloader)
+        self.assertEqual(self.feed.messagesSent, 100)
+        self.assertEqual(len(pages), 5)
+        self.assertEqual(
+            self.conn.execute('SELECT count(*) FROM message').fetchone()[0],
+            100)
+        self.assertGreater(updater.lastAccess, 0)
+
+    def test_json_server(self):
+        # Servers from before streaming answer with one document, which is
+        # compressed and has columnar messages.
+        self.feed.ndjson = False
+        self.assertTrue(updater.retrieveUpdates(self.conn, self.downloader))
+        self.assertEqual(
+            self.conn.execute('SELECT count(*) FROM message').fetchone()[0],
+            100)
+        self.assertEqual(updater.syncCursor, 100)
+
+        plainBytes = 0
+        cursor = 0
+        while cursor < 100:
+            output, _ = self.feed.export(0, cursor, updater.PAGE_SIZE)
+            plainBytes += len(standinserver.json.dumps(output))
+            cursor = output['cursor']
+        self.assertLess(self.feed.bytesSent, plainBytes / 3)
+
+    def test_server_error(self):
+        def fail(request):
+            request.readBody()
+            request.sendBody('{"error": "database is locked"}', status=500)
+
+        self.server.route('GET', '/update', fail)
+        self.assertFalse(updater.retrieveUpdates(self.conn, self.downloader))
+        self.assertIsNone(updater.syncCursor)
+        self.assertEqual(updater.lastAccess, 0)
+
+        def failWithJson(request):
+            request.readBody()
+            request.sendBody('{"error": "database is locked"}')
+
+        self.server.route('GET', '/update', failWithJson)
+        self.assertFalse(updater.retrieveUpdates(self.conn, self.downloader))
+        self.assertEqual(
+            self.conn.execute('SELECT count(*) FROM message').fetchone()[0],
+            0)
+
+    def test_stream_cut_short(self):
+        def cutShort(request):
+            request.readBody()
+            request.startChunked('application/x-ndjson')
+            for rowid in range(1, 11):
+                request.sendChunk(standinserver.json.dumps({
+                    'table': 'message',
+                    'row': {'ROWID': rowid, 'guid': str(rowid)}}) + '\n')
+            request.endChunked()
+
+        self.server.route('GET', '/update', cutShort)
+        updater.retrieveUpdates(self.conn, self.downloader)
+        self.assertEqual(
+            self.conn.execute('SELECT count(*) FROM message').fetchone()[0],
+            0)
+        self.assertIsNone(updater.syncCursor)
+        self.assertEqual(updater.lastAccess, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import unittest
+import os
+import tempfile
+import threading
+from PIL import Image
+from localCode.messageApi import api
+from localCode import scheduler
+from localCode import thumbnails
+
+
+class Photo:
+    """Stands in for a PhotoImage, which needs a Tk root."""
+
+    def __init__(self, width, height):
+        self._width = width
+        self._height = height
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+
+class TestThumbnailCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.cache = thumbnails.ThumbnailCache(
+            os.path.join(self.tempDir.name, 'thumbnails'))
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    def createAttachment(self, name, size, mode='RGB', guid='ATT-1'):
+        filename = os.path.join(self.tempDir.name, name)
+        Image.new(mode, size).save(filename)
+        return api.Attachment(ROWID=1, guid=guid, filename=filename,
+                              uti='public.jpeg')
+
+    def test_bucket_box(self):
+        self.assertEqual(thumbnails.bucketBox(500, 130), (448, 128))
+        self.assertEqual(thumbnails.bucketBox(0, 0), (64, 64))
+
+    def test_thumbnail(self):
+        attachment = self.createAttachment('photo.jpg', (2000, 1000))
+
+        image = self.cache.thumbnail(attachment, (256, 256))
+
+        self.assertEqual(image.size, (256, 128))
+        self.assertTrue(os.path.isfile(
+            self.cache.thumbnailPath('ATT-1', (256, 256))))
+        self.assertEqual(self.cache.decodes, 1)
+
+    def test_thumbnail_from_disk(self):
+        attachment = self.createAttachment('photo.jpg', (2000, 1000))
+        self.cache.thumbnail(attachment, (256, 256))
+        os.remove(attachment.filename)
+
+        image = self.cache.thumbnail(attachment, (256, 256))
+
+        self.assertEqual(image.size, (256, 128))
+        self.assertEqual(self.cache.decodes, 1)
+        self.assertEqual(self.cache.diskHits, 1)
+
+    def test_thumbnail_not_enlarged(self):
+        attachment = self.createAttachment('small.png', (100, 50))
+
+        image = self.cache.thumbnail(attachment, (256, 256))
+
+        self.assertEqual(image.size, (100, 50))
+
+    def test_thumbnail_palette(self):
+        attachment = self.createAttachment('anim.gif', (512, 512), mode='P')
+
+        image = self.cache.thumbnail(attachment, (128, 128))
+
+        self.assertEqual(image.mode, 'RGBA')
+        self.assertEqual(image.size, (128, 128))
+
+    def test_thumbnail_without_guid(self):
+        attachment = self.createAttachment('photo.jpg', (500, 500), guid='')
+
+        self.cache.thumbnail(attachment, (128, 128))
+
+        self.assertFalse(os.path.exists(self.cache.root))
+
+    def test_thumbnail_not_found(self):
+        attachment = api.Attachment(ROWID=1, guid='ATT-1',
+                                    filename='bogus.png')
+
+        with self.assertRaises(FileNotFoundError):
+            self.cache.thumbnail(attachment, (128, 128))
+
+    def test_fitted_size(self):
+        for size in ((2000, 1000), (999, 1601), (100, 50), (3000, 7)):
+            attachment = self.createAttachment('photo.jpg', size, guid='')
+
+            fitted = self.cache.fittedSize(attachment, (256, 192))
+
+            self.assertEqual(
+                fitted, self.cache.thumbnail(attachment, (256, 192)).size)
+
+    def test_fitted_size_not_found(self):
+        attachment = api.Attachment(ROWID=1, guid='ATT-1',
+                                    filename='bogus.png')
+
+        with self.assertRaises(FileNotFoundError):
+            self.cache.fittedSize(attachment, (128, 128))
+
+    def test_request_on_workers(self):
+        eventScheduler = scheduler.Scheduler()
+        self.cache.start(eventScheduler)
+        # PhotoImages need a Tk root, so collect what the workers post.
+        decoded = []
+        eventScheduler.handle(scheduler.IMAGE_DECODED, decoded.extend)
+        attachment = self.createAttachment('photo.jpg', (2000, 1000))
+        missing = api.Attachment(ROWID=2, guid='ATT-2', filename='bogus.png')
+
+        self.cache.request(attachment, (256, 256), print)
+        self.cache.request(attachment, (256, 256), print)
+        self.cache.request(missing, (256, 256), print)
+        self.cache.executor.shutdown(wait=True)
+        eventScheduler.drain()
+
+        self.assertEqual(len(self.cache.waiting[(attachment.filename,
+                                                 (256, 256))]), 2)
+        images = dict(decoded)
+        self.assertEqual(len(images), 2)
+        self.assertEqual(images[(attachment.filename, (256, 256))].size,
+                         (256, 128))
+        self.assertIsNone(images[('bogus.png', (256, 256))])
+        self.assertEqual(self.cache.decodes, 1)
+
+    def test_shutdown_cancels_queued_decodes(self):
+        eventScheduler = scheduler.Scheduler()
+        self.cache.start(eventScheduler, workers=1)
+        # Keep the only worker busy so the decodes stay queued.
+        busy = threading.Event()
+        executor = self.cache.executor
+        executor.submit(busy.wait, 10)
+        attachment = self.createAttachment('photo.jpg', (2000, 1000))
+        self.cache.request(attachment, (256, 256), print)
+        self.cache.request(attachment, (128, 128), print)
+        futures = list(self.cache.futures)
+
+        self.cache.shutdown()
+        busy.set()
+        executor.shutdown(wait=True)
+
+        self.assertEqual(len(futures), 2)
+        self.assertTrue(all(future.cancelled() for future in futures))
+        self.assertEqual(self.cache.decodes, 0)
+
+    def test_evict_over_bytes(self):
+        cache = thumbnails.ThumbnailCache(self.tempDir.name, maxBytes=1000)
+        cache.add('a', Photo(10, 10))
+        cache.add('b', Photo(10, 10))
+
+        cache.add('c', Photo(10, 10))
+
+        self.assertListEqual(list(cache.photos), ['b', 'c'])
+        self.assertEqual(cache.bytes, 800)
+        self.assertEqual(cache.evictions, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
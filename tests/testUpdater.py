@@ -0,0 +1,262 @@
+import unittest
+import sqlite3
+import os
+import json
+import queue
+import tempfile
+from localCode import updater
+
+
+class TestUpdaterMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('CREATE TABLE message (ROWID INTEGER PRIMARY KEY, '
+                          'guid TEXT, text TEXT, date INTEGER)')
+        self.conn.execute('CREATE TABLE chat_message_join (chat_id INTEGER, '
+                          'message_id INTEGER, '
+                          'PRIMARY KEY (chat_id, message_id))')
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_apply_updates(self):
+        output = {
+            'message': [
+                {'ROWID': 1, 'guid': 'A', 'text': 'hi', 'date': 10},
+                {'ROWID': 2, 'guid': 'B', 'text': 'hey', 'date': 11}
+            ],
+            'chat_message_join': [
+                {'chat_id': 1, 'message_id': 1},
+                {'chat_id': 1, 'message_id': 2}
+            ]
+        }
+
+        rowCount = updater.applyUpdates(self.conn, output)
+
+        self.assertEqual(rowCount, 4)
+        rows = self.conn.execute('SELECT ROWID, text FROM message').fetchall()
+        self.assertListEqual(rows, [(1, 'hi'), (2, 'hey')])
+        joins = self.conn.execute(
+            'SELECT count(*) FROM chat_message_join').fetchone()[0]
+        self.assertEqual(joins, 2)
+
+    def test_apply_updates_replaces_rows(self):
+        updater.applyUpdates(self.conn, {'message': [
+            {'ROWID': 1, 'guid': 'A', 'text': 'hi', 'date': 10}]})
+
+        updater.applyUpdates(self.conn, {'message': [
+            {'ROWID': 1, 'guid': 'A', 'text': 'edited', 'date': 10}]})
+
+        rows = self.conn.execute('SELECT ROWID, text FROM message').fetchall()
+        self.assertListEqual(rows, [(1, 'edited')])
+
+    def test_apply_updates_mixed_columns(self):
+        output = {'message': [
+            {'ROWID': 1, 'guid': 'A', 'text': 'hi'},
+            {'ROWID': 2, 'guid': 'B', 'date': 5},
+            {}
+        ]}
+
+        rowCount = updater.applyUpdates(self.conn, output)
+
+        self.assertEqual(rowCount, 2)
+        rows = self.conn.execute(
+            'SELECT ROWID, text, date FROM message').fetchall()
+        self.assertListEqual(rows, [(1, 'hi', None), (2, None, 5)])
+
+    def test_apply_updates_columnar(self):
+        output = {
+            'message': {
+                'columns': ['ROWID', 'guid', 'text'],
+                'rows': [[1, 'A', 'hello'], [2, 'B', 'there']]
+            },
+            'chat_message_join': [{'chat_id': 1, 'message_id': 1}]
+        }
+        self.assertEqual(updater.applyUpdates(self.conn, output), 3)
+        rows = self.conn.execute(
+            'SELECT ROWID, guid, text FROM message ORDER BY ROWID').fetchall()
+        self.assertListEqual(rows, [(1, 'A', 'hello'), (2, 'B', 'there')])
+
+    def test_apply_updates_rolls_back_on_error(self):
+        output = {
+            'message': [{'ROWID': 1, 'guid': 'A', 'text': 'hi', 'date': 10}],
+            'no_such_table': [{'ROWID': 1}]
+        }
+
+        with self.assertRaises(sqlite3.OperationalError):
+            updater.applyUpdates(self.conn, output)
+
+        count = self.conn.execute('SELECT count(*) FROM message').fetchone()[0]
+        self.assertEqual(count, 0)
+
+    def test_open_database_uses_wal(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = updater.openDatabase(os.path.join(tmp, 'sms.db'))
+
+            mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+            conn.close()
+
+        self.assertEqual(mode, 'wal')
+
+    def test_is_complete(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'IMG_1.png')
+            self.assertFalse(updater.isComplete(path, 10))
+            with open(path, 'wb') as outfile:
+                outfile.write(b'12345')
+            self.assertFalse(updater.isComplete(path, 10))
+            self.assertTrue(updater.isComplete(path, 5))
+            # chat.db doesn't always know the size.
+            self.assertTrue(updater.isComplete(path, 0))
+            self.assertTrue(updater.isComplete(path, None))
+
+    def test_receive_updates(self):
+        updater.blobstore.createTables(self.conn)
+        updater.downloader.createTable(self.conn)
+
+        class Stream:
+            events = queue.Queue()
+
+        def update(rowid):
+            return json.dumps({
+                'attachment': [],
+                'message': [{'ROWID': rowid, 'guid': str(rowid),
+                             'text': 'hi', 'date': 10}],
+                'chat_message_join': [{'chat_id': 1, 'message_id': rowid}]
+            })
+
+        Stream.events.put(updater.events.Event('update', '100', update(1)))
+        # Failed exports are skipped.
+        Stream.events.put(updater.events.Event(
+            'update', '200', json.dumps({'error': 'database is locked'})))
+        Stream.events.put(updater.events.Event('update', '101', update(2)))
+        with tempfile.TemporaryDirectory() as tmp:
+            attachmentDownloader = updater.downloader.AttachmentDownloader(
+                updater.blobstore.BlobStore(tmp))
+            updater.updateLastAccess(0)
+            updater.receiveUpdates(self.conn, attachmentDownloader, Stream,
+                                   timeout=0)
+            attachmentDownloader.shutdown()
+
+        rows = self.conn.execute('SELECT ROWID FROM message').fetchall()
+        self.assertListEqual(rows, [(1, ), (2, )])
+        self.assertEqual(updater.lastAccess, 101)
+
+    def test_handle_update_saves_cursor(self):
+        updater.blobstore.createTables(self.conn)
+        updater.downloader.createTable(self.conn)
+        self.conn.execute(updater.migrations.SYNC_STATE_SQL)
+        updater.updateLastAccess(50)
+        updater.updateSyncCursor(None)
+        params = updater.updateParams()
+        self.assertEqual(params['last_update_time'], 50)
+        self.assertNotIn('since_seq', params)
+
+        class Stream:
+            events = queue.Queue()
+
+        Stream.events.put(updater.events.Event('update', '7', json.dumps({
+            'attachment': [],
+            'message': [{'ROWID': 1, 'guid': '1', 'text': 'hi', 'date': 10}],
+            'cursor': 7,
+            'more': False
+        })))
+        with tempfile.TemporaryDirectory() as tmp:
+            attachmentDownloader = updater.downloader.AttachmentDownloader(
+                updater.blobstore.BlobStore(tmp))
+            updater.receiveUpdates(self.conn, attachmentDownloader, Stream,
+                                   timeout=0)
+            attachmentDownloader.shutdown()
+
+        self.assertEqual(updater.syncCursor, 7)
+        # The event id is a change cursor, not a time.
+        self.assertEqual(updater.lastAccess, 50)
+        params = updater.updateParams()
+        self.assertEqual(params['since_seq'], 7)
+        self.assertNotIn('last_update_time', params)
+        updater.updateSyncCursor(None)
+        updater.readSyncCursor(self.conn)
+        self.assertEqual(updater.syncCursor, 7)
+        updater.updateSyncCursor(None)
+
+    def test_apply_updates_summarizes_chats(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = updater.openDatabase(os.path.join(tmp, 'sms.db'))
+            self.addCleanup(conn.close)
+
+            def summary():
+                return conn.execute(
+                    'SELECT chat_id, display_name, recipients, '
+                    'last_message_id, unread_count FROM chat_summary'
+                ).fetchall()
+
+            updater.applyUpdates(conn, {
+                'chat': [{'ROWID': 1, 'guid': 'C', 'display_name': 'Team'}],
+                'handle': [{'ROWID': 1, 'id': '+1555', 'service': 'SMS'},
+                           {'ROWID': 2, 'id': 'a@b.c', 'service': 'SMS'}],
+                'chat_handle_join': [{'chat_id': 1, 'handle_id': 2},
+                                     {'chat_id': 1, 'handle_id': 1}],
+                'message': {'columns': ['ROWID', 'guid', 'date', 'is_read'],
+                            'rows': [[1, 'A', 10, 0], [2, 'B', 20, 0]]},
+                'chat_message_join': [{'chat_id': 1, 'message_id': 1},
+                                      {'chat_id': 1, 'message_id': 2}]})
+            self.assertEqual(summary(),
+                             [(1, 'Team', '["+1555","a@b.c"]', 2, 2)])
+
+            # Reading a message only sends the message.
+            records = [{'table': 'message',
+                        'row': {'ROWID': 1, 'guid': 'A', 'date': 10,
+                                'is_read': 1}},
+                       {'end': True}]
+            attachmentDownloader = updater.downloader.AttachmentDownloader(
+                updater.blobstore.BlobStore(tmp))
+            updater.handleUpdateStream(conn, attachmentDownloader, records)
+            attachmentDownloader.shutdown()
+            self.assertEqual(summary(),
+                             [(1, 'Team', '["+1555","a@b.c"]', 2, 1)])
+
+    def test_apply_listeners(self):
+        applied = []
+        updater.addApplyListener(lambda: applied.append(True))
+        self.addCleanup(updater.applyListeners.clear)
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = updater.openDatabase(os.path.join(tmp, 'sms.db'))
+            self.addCleanup(conn.close)
+            attachmentDownloader = updater.downloader.AttachmentDownloader(
+                updater.blobstore.BlobStore(tmp))
+            self.addCleanup(attachmentDownloader.shutdown)
+
+            updater.handleUpdate(conn, attachmentDownloader, {
+                'attachment': [],
+                'message': [{'ROWID': 1, 'guid': 'A', 'date': 10}]})
+            self.assertEqual(len(applied), 1)
+
+            records = [{'table': 'message',
+                        'row': {'ROWID': 2, 'guid': 'B', 'date': 20}}]
+            with self.assertRaises(updater.UpdateStreamError):
+                updater.handleUpdateStream(conn, attachmentDownloader,
+                                           records)
+            self.assertEqual(len(applied), 1)
+            updater.handleUpdateStream(conn, attachmentDownloader,
+                                       records + [{'end': True}])
+            self.assertEqual(len(applied), 2)
+
+    def test_touch_attachment_messages(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = updater.openDatabase(os.path.join(tmp, 'sms.db'))
+            self.addCleanup(conn.close)
+            updater.applyUpdates(conn, {
+                'message': [{'ROWID': 1, 'guid': 'A', 'date': 10},
+                            {'ROWID': 2, 'guid': 'B', 'date': 20}],
+                'attachment': [{'ROWID': 1, 'guid': 'ATT-1'}],
+                'message_attachment_join': [{'message_id': 2,
+                                             'attachment_id': 1}]})
+            conn.execute('UPDATE message_update_date_join '
+                         'SET message_update_date = 0')
+
+            updater.touchAttachmentMessages(conn, [1])
+
+            self.assertEqual(conn.execute(
+                'SELECT message_id FROM message_update_date_join '
+                'WHERE message_update_date > 0').fetchall(), [(2, )])